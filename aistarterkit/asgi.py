@@ -10,7 +10,22 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from chat.http_client import aclose_async_session
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'aistarterkit.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    """Serves Django, closing the worker's upstream HTTP session when the server shuts down."""
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await aclose_async_session()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
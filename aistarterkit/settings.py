@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import json
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -110,6 +111,39 @@ db_path = Path(sqlite_storage_path) / 'db.sqlite3'
 
 
 CHROMADB_STORAGE_PATH = os.getenv('CHROMADB_STORAGE_PATH')
+
+# Embedding cache shared by all worker processes; set EMBEDDING_CACHE_PATH to an empty string to disable it.
+# Off by default under test, so test runs do not write a cache file into the checkout
+EMBEDDING_CACHE_PATH = os.getenv(
+    'EMBEDDING_CACHE_PATH', '' if ENV == 'test' else str(Path(sqlite_storage_path) / 'embedding_cache.sqlite3')
+)
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 100000))
+
+# In-process cache of vector search results; a TTL of 0 disables it
+SEARCH_CACHE_TTL = int(os.getenv('SEARCH_CACHE_TTL', 300))
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 1024))
+
+# Answer the first message of a thread from earlier answers to similar questions (see chat/ai/answer_cache.py)
+AGENT_ANSWER_CACHE = os.getenv('AGENT_ANSWER_CACHE', 'false').lower() == 'true'
+
+ANSWER_CACHE_COLLECTION = os.getenv('ANSWER_CACHE_COLLECTION', 'answer_cache')
+
+# Adding documents to this collection invalidates the cached answers
+ANSWER_CACHE_SOURCE_COLLECTION = os.getenv('ANSWER_CACHE_SOURCE_COLLECTION', 'default')
+
+# Cosine similarity a cached question needs to answer a new one
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 86400))
+
+# "user" answers each user only from their own threads; "global" shares answers between users,
+# but only those of turns that looked up the shared data through a tool
+ANSWER_CACHE_SCOPE = os.getenv('ANSWER_CACHE_SCOPE', 'user')
+
+# Seconds the source collection's revision is reused before it is fetched again
+ANSWER_CACHE_REVISION_TTL = int(os.getenv('ANSWER_CACHE_REVISION_TTL', 5))
   
 
 DATABASES = {
@@ -120,6 +154,63 @@ DATABASES = {
 }
 
 
+# Users behind API tokens are cached per process (see chat/token_cache.py); 0 disables the cache
+API_TOKEN_CACHE_TTL = int(os.getenv('API_TOKEN_CACHE_TTL', 60))
+
+API_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('API_TOKEN_CACHE_MAX_ENTRIES', 10000))
+
+# Cache passthrough completions of temperature 0 requests for this many seconds; 0 disables the cache
+PASSTHROUGH_CACHE_TTL = int(os.getenv('PASSTHROUGH_CACHE_TTL', 0))
+
+# "user" keeps each user's cached completions apart, "global" shares them between users
+PASSTHROUGH_CACHE_SCOPE = os.getenv('PASSTHROUGH_CACHE_SCOPE', 'user')
+
+PASSTHROUGH_CACHE_MAX_ENTRIES = int(os.getenv('PASSTHROUGH_CACHE_MAX_ENTRIES', 10000))
+
+# Per-user rate and concurrency limits for the passthrough API as JSON (see chat/rate_limit.py), e.g.
+# {"default": {"requests_per_minute": 60, "burst": 10, "concurrency": 2}, "groups": {...}, "users": {...}}
+# Empty disables the limits.
+PASSTHROUGH_RATE_LIMITS = json.loads(os.getenv('PASSTHROUGH_RATE_LIMITS', '{}'))
+
+PASSTHROUGH_RATE_LIMIT_PATH = os.getenv('PASSTHROUGH_RATE_LIMIT_PATH', str(Path(sqlite_storage_path) / 'rate_limits.sqlite3'))
+
+# Slots of requests that never finished (e.g. their worker died) are freed after this many seconds
+PASSTHROUGH_LEASE_SECONDS = int(os.getenv('PASSTHROUGH_LEASE_SECONDS', 600))
+
+# The cache is shared by every worker process, so an entry invalidated by one is dropped for all.
+# Tests use a dummy cache so entries never leak from one test case into the next.
+if ENV == 'test':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        },
+        'completions': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('DJANGO_CACHE_PATH', str(Path(sqlite_storage_path) / 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        # Kept apart so large completions cannot evict the small entries of the default cache
+        'completions': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('PASSTHROUGH_CACHE_PATH', str(Path(sqlite_storage_path) / 'completions')),
+            'OPTIONS': {'MAX_ENTRIES': PASSTHROUGH_CACHE_MAX_ENTRIES},
+        },
+    }
+
+# Threads per sidebar page, and how long a user's first page is cached
+SIDEBAR_THREADS_PAGE_SIZE = int(os.getenv('SIDEBAR_THREADS_PAGE_SIZE', 50))
+
+SIDEBAR_CACHE_TTL = int(os.getenv('SIDEBAR_CACHE_TTL', 300))
+
+# Messages per page of a thread; earlier pages load as the user scrolls up
+THREAD_MESSAGES_PAGE_SIZE = int(os.getenv('THREAD_MESSAGES_PAGE_SIZE', 50))
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -184,6 +275,62 @@ OPENAI_API_BASE = ENV_OPENAI_API_BASE if ENV_OPENAI_API_BASE else DEFAULT_OPENAI
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", None)
 
+# Pooled HTTP client shared by upstream OpenAI calls (see chat/http_client.py)
+OPENAI_HTTP_POOL_SIZE = int(os.getenv("OPENAI_HTTP_POOL_SIZE", 10))
+
+OPENAI_HTTP_CONNECT_TIMEOUT = float(os.getenv("OPENAI_HTTP_CONNECT_TIMEOUT", 5))
+
+OPENAI_HTTP_READ_TIMEOUT = float(os.getenv("OPENAI_HTTP_READ_TIMEOUT", 120))
+
+OPENAI_HTTP_MAX_RETRIES = int(os.getenv("OPENAI_HTTP_MAX_RETRIES", 3))
+
+OPENAI_HTTP_BACKOFF_FACTOR = float(os.getenv("OPENAI_HTTP_BACKOFF_FACTOR", 0.5))
+
+# Async views hold many requests per process, so their pool is larger
+OPENAI_ASYNC_HTTP_POOL_SIZE = int(os.getenv("OPENAI_ASYNC_HTTP_POOL_SIZE", 100))
+
+# Bound the conversation history sent with each completion
+AGENT_HISTORY_MAX_MESSAGES = int(os.getenv("AGENT_HISTORY_MAX_MESSAGES", 50))
+
+AGENT_HISTORY_MAX_TOKENS = int(os.getenv("AGENT_HISTORY_MAX_TOKENS", 3000))
+
+# Save each agent turn's messages with one bulk insert when the turn ends
+AGENT_BUFFER_HISTORY = os.getenv("AGENT_BUFFER_HISTORY", "true").lower() == "true"
+
+# Summarize messages that fall out of the history window, off the request path
+AGENT_SUMMARY_IN_BACKGROUND = os.getenv("AGENT_SUMMARY_IN_BACKGROUND", "true").lower() == "true"
+
+AGENT_SUMMARY_MAX_TOKENS = int(os.getenv("AGENT_SUMMARY_MAX_TOKENS", 500))
+
+# Tool calls from one reply run concurrently; each gets this many seconds to finish
+AGENT_TOOL_TIMEOUT = float(os.getenv("AGENT_TOOL_TIMEOUT", 30))
+
+# Threads shared by all agents for running tools. Tool calls that time out keep their thread
+# until they return; while all of them are held, new tool calls fail instead of waiting
+AGENT_TOOL_WORKERS = int(os.getenv("AGENT_TOOL_WORKERS", 8))
+
+# Offer tools through the API's native function calling instead of the "Tool: " text protocol.
+# Falls back to the text protocol if the API rejects function definitions.
+AGENT_FUNCTION_CALLING = os.getenv("AGENT_FUNCTION_CALLING", "false").lower() == "true"
+
+# Seconds to use the text protocol after the API rejected function definitions before trying them again
+AGENT_FUNCTION_CALLING_RETRY_SECONDS = int(os.getenv("AGENT_FUNCTION_CALLING_RETRY_SECONDS", 600))
+
+# Run agent turns off the request thread: "" runs them in the request, "thread" in a pool
+# inside each web process, "worker" in separate run_agent_worker processes
+AGENT_TASK_MODE = os.getenv("AGENT_TASK_MODE", "")
+
+AGENT_TASK_WORKERS = int(os.getenv("AGENT_TASK_WORKERS", 4))
+
+# Running tasks older than this were abandoned by a stopped worker
+AGENT_TASK_STALE_SECONDS = int(os.getenv("AGENT_TASK_STALE_SECONDS", 600))
+
+# Seconds between sweeps for abandoned tasks in each process that claims tasks
+AGENT_TASK_SWEEP_INTERVAL = int(os.getenv("AGENT_TASK_SWEEP_INTERVAL", 60))
+
+# Route the chat and passthrough endpoints to their async views (for ASGI deployments)
+ASYNC_VIEWS = os.getenv("DJANGO_ASYNC_VIEWS", "false").lower() == "true"
+
 AUTH_USER_MODEL = 'chat.CustomUser'
 
 DEFAULT_ADMIN_USERNAME=os.getenv("DEFAULT_ADMIN_USERNAME")
@@ -3,12 +3,44 @@ import { Controller } from "stimulus"
 import Idiomorph from 'idiomorph'
 import Prism from 'prismjs';
 
+// Stop polling for a queued reply after this many seconds, a little longer than the
+// server's AGENT_TASK_STALE_SECONDS, and show the thread as it was saved instead
+const TASK_POLL_TIMEOUT_SECONDS = 660
+
 export default class extends Controller {
-  static targets = ["form", "messageList", "messageInput", "emptyMessage"]
+  static targets = ["form", "messageList", "messageInput", "emptyMessage", "earlierMessages"]
 
   connect() {
     console.log("Connected to StimulusJS Thread Controller!")
     this.scrollToBottom()
+    // Fill the view if the latest page of messages is too short to scroll
+    this.loadEarlier()
+  }
+
+  loadEarlier() {
+    // Fetch the previous page of messages once the user scrolls near the top
+    if (!this.hasEarlierMessagesTarget || this.loadingEarlier || this.messageListTarget.scrollTop > 200) {
+      return
+    }
+    this.loadingEarlier = true
+
+    const sentinel = this.earlierMessagesTarget
+    fetch(sentinel.dataset.url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+      .then(response => response.text())
+      .then(html => {
+        // Keep the messages in view from jumping as the earlier ones are inserted above them
+        const previousHeight = this.messageListTarget.scrollHeight
+        sentinel.insertAdjacentHTML('afterend', html)
+        sentinel.remove()
+        this.messageListTarget.scrollTop += this.messageListTarget.scrollHeight - previousHeight
+
+        Prism.highlightAll()
+        this.loadingEarlier = false
+        this.loadEarlier()
+      })
+      .catch(() => {
+        this.loadingEarlier = false
+      })
   }
 
   submit(event) {
@@ -19,16 +51,19 @@ export default class extends Controller {
       this.emptyMessageTarget.remove()
     }
 
+    // Rows added after this point are placeholders, replaced once the reply is saved
+    const firstPlaceholderIndex = this.messageListTarget.children.length
+
     // Add user's message to the message list
-    this.messageListTarget.innerHTML += `
+    this.messageListTarget.insertAdjacentHTML('beforeend', `
       <div class="flex gap-4 p-6 border-b border-gray-200 text-gray-800 bg-gray-50">
         <i class="fas fa-user w-6 text-lg text-green-400"></i>
         <div>${this.escapeHTML(this.messageInputTarget.value)}</div>
       </div>
-    `
+    `)
 
     // Display loading indicator
-    this.messageListTarget.innerHTML += `
+    this.messageListTarget.insertAdjacentHTML('beforeend', `
       <div class="flex gap-4 p-6 border-b border-gray-200 text-gray-800 bg-gray-50">
         <i class="fas fa-robot w-6 text-lg text-indigo-400"></i>
         <div role="status">
@@ -39,27 +74,52 @@ export default class extends Controller {
           <span class="sr-only">Loading...</span>
         </div>
       </div>
-    `
+    `)
+    const placeholders = Array.from(this.messageListTarget.children).slice(firstPlaceholderIndex)
 
     // Scroll to the bottom
     this.scrollToBottom()
 
-    // Submit the form via AJAX
+    // The reply streams into the loading indicator's bubble
+    const replyElement = this.messageListTarget.lastElementChild.querySelector('[role=status]')
+
+    // Submit the form via AJAX, asking for the reply as a stream of Server-Sent Events
     fetch(this.formTarget.action, {
       method: 'POST',
       body: new FormData(this.formTarget),
       headers: {
+        'Accept': 'text/event-stream',
+        'X-Requested-With': 'XMLHttpRequest',
         'X-CSRFToken': this.formTarget.querySelector('[name=csrfmiddlewaretoken]').value
       }
     })
-      .then(response => response.text())
-      .then(html => {
-        const parser = new DOMParser()
-        const doc = parser.parseFromString(html, 'text/html')
+      .then(response => {
+        // 202 Accepted means the reply was queued to run in the background
+        if (response.status === 202) {
+          return response.json().then(task => this.pollTask(task.status_url))
+        }
+        return this.readStream(response.body.getReader(), new TextDecoder(), replyElement)
+      })
+      .then(({ html }) => {
+        if (html !== null) {
+          // Swap the placeholders for the saved messages, rendered by the server
+          placeholders[0].insertAdjacentHTML('beforebegin', html)
+          placeholders.forEach(placeholder => placeholder.remove())
+          return
+        }
 
-        // Use idiomorph to only update the parts of the page that have changed
-        Idiomorph.morph(document.body, doc.body)
+        // The reply failed part way, so fetch the rendered thread to show what was saved
+        return fetch(window.location.href)
+          .then(response => response.text())
+          .then(page => {
+            const parser = new DOMParser()
+            const doc = parser.parseFromString(page, 'text/html')
 
+            // Use idiomorph to only update the parts of the page that have changed
+            Idiomorph.morph(document.body, doc.body)
+          })
+      })
+      .then(() => {
         // Defer the scrolling until after the browser has rendered the updated DOM
         requestAnimationFrame(() => {
           Prism.highlightAll()
@@ -71,6 +131,65 @@ export default class extends Controller {
     this.messageInputTarget.value = ''
   }
 
+  pollTask(url, deadline = Date.now() + TASK_POLL_TIMEOUT_SECONDS * 1000) {
+    // Check on a queued reply every second until it is done, has failed or has taken too long
+    if (Date.now() > deadline) {
+      return Promise.resolve({ html: null })
+    }
+    return new Promise(resolve => setTimeout(resolve, 1000))
+      .then(() => fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } }))
+      .then(response => response.json())
+      .then(task => {
+        if (task.status === 'done') {
+          return { html: task.html }
+        }
+        if (task.status === 'failed') {
+          return { html: null }
+        }
+        return this.pollTask(url, deadline)
+      })
+  }
+
+  readStream(reader, decoder, element, buffer = '', reply = '', html = null) {
+    return reader.read().then(({ value, done }) => {
+      if (done) {
+        return { reply, html }
+      }
+
+      // Events are separated by a blank line; keep any partial event for the next read
+      const events = (buffer + decoder.decode(value, { stream: true })).split('\n\n')
+      buffer = events.pop()
+
+      events.forEach(event => {
+        const data = event.split('\n')
+          .filter(line => line.startsWith('data: '))
+          .map(line => line.slice('data: '.length))
+          .join('\n')
+        if (!data) {
+          return
+        }
+
+        const payload = JSON.parse(data)
+        if (payload.reset) {
+          // The text so far led to a tool call; the reply that follows replaces it
+          reply = ''
+        }
+        if (payload.delta) {
+          reply += payload.delta
+          element.classList.add('whitespace-pre-wrap')
+          element.textContent = reply
+          this.scrollToBottom()
+        }
+        if (payload.html !== undefined) {
+          // The final event carries the rendered rows of the saved messages
+          html = payload.html
+        }
+      })
+
+      return this.readStream(reader, decoder, element, buffer, reply, html)
+    })
+  }
+
   scrollToBottom() {
     this.messageListTarget.scrollTop = this.messageListTarget.scrollHeight
   }
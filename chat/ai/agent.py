@@ -2,7 +2,7 @@
 
 The Agent class is responsible for interacting with the user and invoking
 the necessary tools based on the user's input. The ToolInvoker class is
-used to invoke a specific tool based on the tool's name and parameters.
+used to invoke the tool calls of a reply based on their names and parameters.
 
 Typical usage example:
 
@@ -15,13 +15,114 @@ Typical usage example:
     })
     response = agent.chat("I'm looking for a good burger place.")
 """
+import json
+import logging
 import openai
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from ..models import Message
+from django.db import connection, transaction
+from ..models import Message, Thread
+from ..rendering import render_markdown
+from ..http_client import BorrowedSession, get_async_session, get_timeout
+from .tokens import estimate_tokens
 
 openai.api_base = settings.OPENAI_API_BASE
 openai.api_key = settings.OPENAI_API_KEY
+openai.requestssession = BorrowedSession  # Reuse pooled connections to the API across requests
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a user and a restaurant assistant.
+Update the summary with the new messages. Keep the facts, preferences, names and recommendations
+that later turns may refer to, and drop small talk. Reply with the updated summary only.
+"""
+
+_tool_executor = None
+_tool_executor_lock = threading.Lock()
+
+# Tool calls that timed out but are still running, each holding a worker of the tool pool
+_abandoned_tool_calls = 0
+_abandoned_tool_calls_lock = threading.Lock()
+
+# Set when the API rejects function definitions; the API base is process-wide, so every
+# agent uses the text protocol until this time.monotonic() value has passed
+_function_calling_disabled_until = 0.0
+
+# Yielded by the streaming chat methods before the reply of a follow-up completion. The text
+# streamed before it led to a tool call and was not the final reply.
+STREAM_RESET = object()
+
+# The start of a tool call in the text protocol
+TOOL_CALL_MARKER = "Tool:"
+
+def get_tool_executor():
+    """Returns the thread pool shared by all agents for running tools, creating it on first use."""
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(max_workers=settings.AGENT_TOOL_WORKERS, thread_name_prefix='agent-tool')
+    return _tool_executor
+
+def abandon_tool_call(future):
+    """Counts a timed out tool call as holding a pool worker until it returns.
+
+    Returns:
+        The number of abandoned calls still running, including this one.
+    """
+    global _abandoned_tool_calls
+    with _abandoned_tool_calls_lock:
+        _abandoned_tool_calls += 1
+        abandoned = _abandoned_tool_calls
+    future.add_done_callback(_release_tool_call)
+    return abandoned
+
+def _release_tool_call(future):
+    """Stops counting an abandoned tool call once it has returned."""
+    global _abandoned_tool_calls
+    with _abandoned_tool_calls_lock:
+        _abandoned_tool_calls -= 1
+
+def add_function_call_deltas(functions, delta):
+    """Adds the function call fragments of a streamed chunk to the calls received so far.
+
+    Args:
+        functions: A dictionary of calls by their index in the reply, each a dictionary
+                   with the "name" and "arguments" received so far.
+        delta: The delta of a streamed chat completion chunk.
+    """
+    for call in delta.get("tool_calls") or []:
+        function = functions.setdefault(call["index"], {"name": "", "arguments": ""})
+        fragment = call.get("function") or {}
+        function["name"] += fragment.get("name") or ""
+        function["arguments"] += fragment.get("arguments") or ""
+
+def streamable_length(text):
+    """Returns the length of the part of a streamed reply that can be shown to the user.
+
+    Tool calls are meant for the agent, so the text from the first "Tool:" on is held
+    back, along with a partial marker at the end that may still become one.
+    """
+    index = text.find(TOOL_CALL_MARKER)
+    if index != -1:
+        return index
+    for size in range(min(len(TOOL_CALL_MARKER) - 1, len(text)), 0, -1):
+        if TOOL_CALL_MARKER.startswith(text[-size:]):
+            return len(text) - size
+    return len(text)
+
+def is_unsupported_tools_error(error):
+    """Checks if an InvalidRequestError was caused by the API not accepting function definitions."""
+    return getattr(error, "param", None) in ("tools", "tool_choice")
+
+def function_calling_available():
+    """Checks if the API has not rejected function definitions within AGENT_FUNCTION_CALLING_RETRY_SECONDS."""
+    return time.monotonic() >= _function_calling_disabled_until
 
 class ToolInvoker:
     """A class used to invoke a specific tool based on its name and parameters.
@@ -30,12 +131,41 @@ class ToolInvoker:
         tools: A dictionary of tools where the key is the tool's name and the
                value is a dictionary containing the tool's parameters and function.
     """
+    TOOL_CALL_PATTERN = r'Tool: (\w+)\((.*?)\)'
+
     def __init__(self, tools):
         self.tools = tools
 
+    def invoke_calls(self, response):
+        """Invokes every tool call found in the response concurrently.
+
+        Each call runs in the shared tool thread pool and is given AGENT_TOOL_TIMEOUT
+        seconds to finish. A call that takes longer is reported as an error result
+        instead of holding up the others. A call still queued is cancelled, but a
+        running one cannot be stopped and keeps its worker until it returns, so
+        tools should bound their own I/O. While every worker is held by such
+        calls, new calls are not queued behind them but fail straight away.
+
+        Args:
+            response: A string containing one or more tool calls.
+
+        Returns:
+            A list of (tool_name, parameters, result) tuples in the order the calls
+            appear in the response.
+
+        Raises:
+            ValueError: If the response has no tool call, or names an unknown tool.
+        """
+        calls = self.extract_calls(response)
+        if not calls:
+            raise ValueError("No tool call found in the response")
+        return self.run_calls(calls)
+
     def invoke_tool(self, response):
         """Invokes a tool based on the tool's name and parameters found in the response.
 
+        Only the first tool call in the response is invoked, as described in `invoke_calls`.
+
         Args:
             response: A string containing the tool's name and parameters.
 
@@ -43,33 +173,129 @@ class ToolInvoker:
             The result of the tool's function.
 
         Raises:
-            ValueError: If the tool's name is not found in the tools dictionary.
+            ValueError: If the response has no tool call, or the tool's name is not found
+                        in the tools dictionary.
         """
-        tool_name, parameters = self._extract_call(response)
-        if tool_name in self.tools:
-            tool_function = self.tools[tool_name]['function']
-            return tool_function(*parameters)
-        else:
-            raise ValueError(f"Unknown tool: {tool_name}")
+        calls = self.extract_calls(response)
+        if not calls:
+            raise ValueError("No tool call found in the response")
+        return self.run_calls(calls[:1])[0][2]
 
-    def _extract_call(self, string):
-        """Extracts the tool's name and parameters from a string.
+    def run_calls(self, calls):
+        """Runs already parsed tool calls concurrently, as described in `invoke_calls`.
 
         Args:
-            string: A string containing the tool's name and parameters.
+            calls: A list of (tool_name, parameters) tuples.
 
         Returns:
-            A tuple containing the tool's name and a list of parameters.
+            A list of (tool_name, parameters, result) tuples in the order of calls. A call
+            whose parameters are None had invalid arguments and gets an error result.
+
+        Raises:
+            ValueError: If a call names an unknown tool.
         """
-        pattern = r'Tool: (\w+)\((.*?)\)'
-        match = re.search(pattern, string)
-        if match:
-            tool_name = match.group(1)
-            parameters = match.group(2).replace('"', '').split(', ')
-            return tool_name, parameters
-        else:
-            return None, None
-        
+        for tool_name, _ in calls:
+            if tool_name not in self.tools:
+                raise ValueError(f"Unknown tool: {tool_name}")
+
+        timeout = settings.AGENT_TOOL_TIMEOUT
+        if _abandoned_tool_calls >= settings.AGENT_TOOL_WORKERS:
+            return [
+                (tool_name, parameters, f"Error: {tool_name} could not run because earlier tool calls have not finished.")
+                for tool_name, parameters in calls
+            ]
+        executor = get_tool_executor()
+        futures = [
+            executor.submit(self.tools[tool_name]['function'], *parameters) if parameters is not None else None
+            for tool_name, parameters in calls
+        ]
+        deadline = time.monotonic() + timeout  # The calls run side by side, so they share one deadline
+
+        results = []
+        for (tool_name, parameters), future in zip(calls, futures):
+            if future is None:
+                results.append((tool_name, parameters, f"Error: the arguments for {tool_name} were not a valid JSON object."))
+                continue
+            try:
+                result = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                if not future.cancel():
+                    abandoned = abandon_tool_call(future)
+                    logger.warning("%s did not finish within %g seconds; %d timed out tool calls are still running", tool_name, timeout, abandoned)
+                result = f"Error: {tool_name} did not finish within {timeout:g} seconds."
+            results.append((tool_name, parameters, result))
+        return results
+
+    def extract_calls(self, string):
+        """Extracts every tool call from a string.
+
+        Args:
+            string: A string containing tool calls.
+
+        Returns:
+            A list of (tool_name, parameters) tuples, where parameters is a list of strings.
+        """
+        return [
+            (match.group(1), match.group(2).replace('"', '').split(', '))
+            for match in re.finditer(self.TOOL_CALL_PATTERN, string)
+        ]
+
+    def function_definitions(self):
+        """Describes the tools as functions for the API's native function calling.
+
+        Every parameter listed in a tool's "params" becomes a required string argument.
+
+        Returns:
+            A list of tool definitions for the `tools` argument of a chat completion.
+        """
+        return [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool_name,
+                    "description": tool_info['description'],
+                    "parameters": {
+                        "type": "object",
+                        "properties": {name: {"type": "string"} for name in self.parameter_names(tool_name)},
+                        "required": self.parameter_names(tool_name),
+                    },
+                },
+            }
+            for tool_name, tool_info in self.tools.items()
+        ]
+
+    def parse_function_calls(self, functions):
+        """Converts the function calls of a completion into tool calls.
+
+        Args:
+            functions: A list of dictionaries with the "name" of the function and its
+                       "arguments" as a JSON string.
+
+        Returns:
+            A list of (tool_name, parameters) tuples, with the arguments in the order
+            of the tool's "params". Parameters are None if the arguments are not a
+            JSON object, which `run_calls` reports back to the model as an error.
+        """
+        calls = []
+        for function in functions:
+            try:
+                arguments = json.loads(function.get("arguments") or "{}")
+            except json.JSONDecodeError:
+                arguments = None
+            if not isinstance(arguments, dict):
+                logger.warning("Invalid arguments for %s: %r", function["name"], function.get("arguments"))
+                calls.append((function["name"], None))
+                continue
+            names = self.parameter_names(function["name"])
+            values = [arguments.get(name, "") for name in names] if names else list(arguments.values())
+            calls.append((function["name"], [str(value) for value in values]))
+        return calls
+
+    def parameter_names(self, tool_name):
+        """Returns the parameter names listed in a tool's "params", or an empty list for unknown tools."""
+        params = self.tools.get(tool_name, {}).get('params', '')
+        return [name.strip() for name in params.split(',') if name.strip()]
+
 class Agent:
     """A class used to interact with the user and invoke the necessary tools.
 
@@ -79,14 +305,28 @@ class Agent:
         tool_invoker: An instance of the ToolInvoker class.
         history: A list of previous interactions with the user.
         prompt: A string used as the initial prompt for the chat.
+        buffer_history: A boolean indicating if a turn's messages are saved together
+                        when the turn ends instead of one at a time.
+        new_messages: A list of the Message instances this agent has added to the thread.
+        function_calling: A boolean indicating if tools are offered through the API's
+                          native function calling instead of the "Tool: " text protocol.
+        answer_cache: A SemanticAnswerCache used to answer the first message of a
+                      thread without a completion, or None.
     """
 
-    def __init__(self, tools={}, thread=None) -> None:
+    def __init__(self, tools={}, thread=None, answer_cache=None) -> None:
         self.tools = tools
+        self.answer_cache = answer_cache
         self.tool_invoker = ToolInvoker(tools)
         self.thread = thread
+        self.function_calling = settings.AGENT_FUNCTION_CALLING and bool(tools) and function_calling_available()
         self.history = self._build_history()
         self.prompt = self._build_prompt()
+        self.buffer_history = settings.AGENT_BUFFER_HISTORY
+        self._pending_messages = []
+        self.new_messages = []
+        self._tool_calls = None
+        self._used_tools = False
 
     def chat(self, message):
         """Interacts with the user and invokes the necessary tools.
@@ -97,30 +337,321 @@ class Agent:
         Returns:
             A string containing the assistant's response.
         """
-        ai_reply = self._get_ai_reply(message, system_message=self.prompt.strip())
-        self._update_history("user", message)
-        self._update_history("assistant", ai_reply)
-        
-        while(self._needs_tool(ai_reply)):
-            tool_result = self.tool_invoker.invoke_tool(ai_reply)
-            self._update_history("assistant", f"Tool Result: {tool_result}")
-            ai_reply = self._get_ai_reply(None, system_message=self.prompt.strip())
+        first_turn = not self.history
+        if first_turn:
+            cached_answer = self._lookup_answer(message)
+            if cached_answer is not None:
+                self._record_cached_answer(message, cached_answer)
+                return cached_answer
+
+        try:
+            ai_reply = self._get_ai_reply(message, system_message=self.prompt.strip())
+            self._update_history("user", message)
+            self._update_history("assistant", ai_reply)
+
+            while(self._needs_tool(ai_reply)):
+                self._record_tool_results(self._invoke_tools(ai_reply))
+                ai_reply = self._get_ai_reply(None, system_message=self.prompt.strip())
+                self._update_history("assistant", ai_reply)
+        finally:
+            self._flush_history()  # Save what the turn produced, even if it failed part way
+
+        if first_turn:
+            self._store_answer(message, ai_reply)
+        self._schedule_summary()
+        return ai_reply
+
+    def chat_stream(self, message):
+        """Interacts with the user, yielding the assistant's response as it is generated.
+
+        Behaves like `chat`, but each completion is requested with streaming enabled
+        and its content is yielded chunk by chunk. Messages are persisted once each
+        completion has finished streaming.
+
+        Args:
+            message: A string containing the user's input.
+
+        Yields:
+            Strings containing chunks of the assistant's response, without its tool
+            calls, and STREAM_RESET before the reply that follows a tool call.
+        """
+        first_turn = not self.history
+        if first_turn:
+            cached_answer = self._lookup_answer(message)
+            if cached_answer is not None:
+                self._record_cached_answer(message, cached_answer)
+                yield cached_answer
+                return cached_answer
+
+        try:
+            ai_reply = yield from self._stream_ai_reply(message, system_message=self.prompt.strip())
+            self._update_history("user", message)
             self._update_history("assistant", ai_reply)
-         
+
+            while(self._needs_tool(ai_reply)):
+                self._record_tool_results(self._invoke_tools(ai_reply))
+                yield STREAM_RESET
+                ai_reply = yield from self._stream_ai_reply(None, system_message=self.prompt.strip())
+                self._update_history("assistant", ai_reply)
+        finally:
+            self._flush_history()
+
+        if first_turn:
+            self._store_answer(message, ai_reply)
+        self._schedule_summary()
+        return ai_reply
+
+    async def achat(self, message):
+        """Asynchronous version of `chat` for use from async views.
+
+        Completions are awaited on the shared aiohttp session, while database
+        writes and tool invocations run in worker threads.
+
+        Args:
+            message: A string containing the user's input.
+
+        Returns:
+            A string containing the assistant's response.
+        """
+        first_turn = not self.history
+        if first_turn:
+            cached_answer = await sync_to_async(self._lookup_answer, thread_sensitive=False)(message)
+            if cached_answer is not None:
+                await sync_to_async(self._record_cached_answer)(message, cached_answer)
+                return cached_answer
+
+        try:
+            ai_reply = await self._aget_ai_reply(message, system_message=self.prompt.strip())
+            await sync_to_async(self._update_history)("user", message)
+            await sync_to_async(self._update_history)("assistant", ai_reply)
+
+            while(self._needs_tool(ai_reply)):
+                tool_results = await sync_to_async(self._invoke_tools, thread_sensitive=False)(ai_reply)
+                await sync_to_async(self._record_tool_results)(tool_results)
+                ai_reply = await self._aget_ai_reply(None, system_message=self.prompt.strip())
+                await sync_to_async(self._update_history)("assistant", ai_reply)
+        finally:
+            await sync_to_async(self._flush_history)()
+
+        if first_turn:
+            await sync_to_async(self._store_answer, thread_sensitive=False)(message, ai_reply)
+        await sync_to_async(self._schedule_summary)()
         return ai_reply
+
+    async def achat_stream(self, message):
+        """Asynchronous version of `chat_stream` for use from async views.
+
+        Args:
+            message: A string containing the user's input.
+
+        Yields:
+            Strings containing chunks of the assistant's response, and STREAM_RESET,
+            as in `chat_stream`.
+        """
+        first_turn = not self.history
+        if first_turn:
+            cached_answer = await sync_to_async(self._lookup_answer, thread_sensitive=False)(message)
+            if cached_answer is not None:
+                await sync_to_async(self._record_cached_answer)(message, cached_answer)
+                yield cached_answer
+                return
+
+        pending_message = message
+        try:
+            while True:
+                if pending_message is None:
+                    yield STREAM_RESET
+                reply = []
+                functions = []
+                async for content in self._astream_ai_reply(
+                    pending_message, system_message=self.prompt.strip(), functions=functions, reply=reply
+                ):
+                    yield content
+                ai_reply = self._finish_reply("".join(reply).strip(), functions)
+
+                if pending_message is not None:
+                    await sync_to_async(self._update_history)("user", pending_message)
+                    pending_message = None
+                await sync_to_async(self._update_history)("assistant", ai_reply)
+
+                if not self._needs_tool(ai_reply):
+                    break
+                tool_results = await sync_to_async(self._invoke_tools, thread_sensitive=False)(ai_reply)
+                await sync_to_async(self._record_tool_results)(tool_results)
+        finally:
+            await sync_to_async(self._flush_history)()
+
+        if first_turn:
+            await sync_to_async(self._store_answer, thread_sensitive=False)(message, ai_reply)
+        await sync_to_async(self._schedule_summary)()
     
+    def _lookup_answer(self, message):
+        """Looks up a cached answer to the first message of a thread.
+
+        Only first messages are answered from the cache, as later ones depend on the
+        conversation before them. A failing lookup is logged and treated as a miss.
+
+        Args:
+            message: A string containing the user's input.
+
+        Returns:
+            A string containing the cached answer, or None.
+        """
+        scope = self._answer_scope()
+        if self.answer_cache is None or scope is None:
+            return None
+        try:
+            return self.answer_cache.lookup(message, scope=scope)
+        except Exception:
+            logger.exception("Answer cache lookup failed")
+            return None
+
+    def _record_cached_answer(self, message, answer):
+        """Saves a turn answered from the cache to the history."""
+        try:
+            self._update_history("user", message)
+            self._update_history("assistant", answer)
+        finally:
+            self._flush_history()
+
+    def _store_answer(self, message, answer):
+        """Caches the answer to the first message of a thread, logging any failure."""
+        scope = self._answer_scope()
+        if self.answer_cache is None or scope is None:
+            return
+        if scope == 'global' and not self._used_tools:
+            return  # Without a tool the answer comes from the user's message alone, which may be personal
+        try:
+            self.answer_cache.store(message, answer, scope=scope)
+        except Exception:
+            logger.exception("Answer cache store failed")
+
+    def _answer_scope(self):
+        """Returns the scope of the answer cache this agent's answers belong to, per ANSWER_CACHE_SCOPE.
+
+        Returns:
+            "global", a string naming the thread's user, or None if answers are scoped
+            per user and the agent has no thread.
+        """
+        if settings.ANSWER_CACHE_SCOPE == 'global':
+            return 'global'
+        if self.thread is None:
+            return None
+        return f"user:{self.thread.user_id}"
+
     def _build_history(self):
-        """Builds the history from the thread messages.
+        """Builds the history from the most recent thread messages.
+
+        Only the newest AGENT_HISTORY_MAX_MESSAGES messages are loaded, so the cost
+        of starting a turn does not grow with the length of the thread.
 
         Returns:
-            A list of previous interactions with the user.
+            A list of previous interactions with the user, oldest first.
         """
         history = []
         if self.thread is not None:  # Ensure that thread is not None
-            messages = Message.objects.filter(thread=self.thread).order_by('timestamp')
-            for message in messages:
-                history.append({"role": message.role, "content": message.content})
+            # Fetch the newest messages first so the limit keeps the most recent ones
+            messages = (
+                Message.objects.filter(thread=self.thread)
+                .order_by('-timestamp', '-id')
+                .values_list('role', 'content')[:settings.AGENT_HISTORY_MAX_MESSAGES]
+            )
+            for role, content in reversed(messages):
+                history.append({"role": role, "content": content})
         return history
+
+    def _windowed_history(self):
+        """Selects the most recent history that fits in the prompt's token budget.
+
+        Returns:
+            A list of the newest messages in the history, oldest first, whose combined
+            estimated size is within AGENT_HISTORY_MAX_TOKENS. The newest message is
+            always included.
+        """
+        window = []
+        budget = settings.AGENT_HISTORY_MAX_TOKENS
+        for entry in reversed(self.history[-settings.AGENT_HISTORY_MAX_MESSAGES:]):
+            budget -= estimate_tokens(entry["content"])
+            if budget < 0 and window:
+                break
+            window.append(entry)
+        window.reverse()
+        return window
+
+    def _schedule_summary(self):
+        """Folds the messages that fell out of the history window into the thread's summary.
+
+        Checking for such messages is a single indexed query. When there are some, the
+        summary is updated in a background thread if AGENT_SUMMARY_IN_BACKGROUND is set,
+        so the completion it needs does not delay the reply.
+        """
+        if self.thread is None:
+            return
+        messages = self._unsummarized_messages(len(self._windowed_history()))
+        if not messages:
+            return
+        if settings.AGENT_SUMMARY_IN_BACKGROUND:
+            threading.Thread(target=self._update_summary_in_background, args=(messages,), daemon=True).start()
+        else:
+            self._update_summary(messages)
+
+    def _unsummarized_messages(self, window_size):
+        """Returns the messages older than the history window that the summary does not cover yet.
+
+        Args:
+            window_size: The number of most recent messages sent to the model.
+
+        Returns:
+            A list of (id, role, content) tuples, oldest first, of at most
+            AGENT_HISTORY_MAX_MESSAGES messages.
+        """
+        messages = Message.objects.filter(thread=self.thread).order_by('-id')
+        newest_outside_window = messages.values_list('id', flat=True)[window_size:window_size + 1]
+        if not newest_outside_window:
+            return []
+        messages = messages.filter(id__lte=newest_outside_window[0])
+        if self.thread.summarized_message_id is not None:
+            messages = messages.filter(id__gt=self.thread.summarized_message_id)
+        # Oldest first, so a long backlog is caught up over several turns
+        return list(messages.order_by('id').values_list('id', 'role', 'content')[:settings.AGENT_HISTORY_MAX_MESSAGES])
+
+    def _update_summary_in_background(self, messages):
+        """Runs `_update_summary` in a worker thread, logging failures instead of raising them."""
+        try:
+            self._update_summary(messages)
+        except Exception:
+            logger.exception("Failed to update the summary of thread %s", self.thread.pk)
+        finally:
+            connection.close()  # Each thread has its own database connection
+
+    def _update_summary(self, messages):
+        """Asks the AI model to fold messages into the thread's summary and saves it.
+
+        The summary is only saved if no other turn has updated it in the meantime, so
+        concurrent updates never overwrite each other.
+
+        Args:
+            messages: A list of (id, role, content) tuples, oldest first.
+        """
+        transcript = "\n".join(f"{role}: {content}" for _, role, content in messages)
+        completion = openai.ChatCompletion.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT.strip()},
+                {"role": "user", "content": f"Current summary:\n{self.thread.summary or '(none)'}\n\nNew messages:\n{transcript}"},
+            ],
+            temperature=0,
+            max_tokens=settings.AGENT_SUMMARY_MAX_TOKENS,
+            request_timeout=get_timeout(),
+        )
+        summary = completion.choices[0].message.content.strip()
+        last_message_id = messages[-1][0]
+        updated = Thread.objects.filter(
+            pk=self.thread.pk, summarized_message_id=self.thread.summarized_message_id
+        ).update(summary=summary, summarized_message_id=last_message_id)
+        if updated:
+            self.thread.summary = summary
+            self.thread.summarized_message_id = last_message_id
     
     def _build_prompt(self):
         """Builds the initial prompt for the chat.
@@ -147,9 +678,18 @@ class Agent:
         When the user asks a question that can be answered by using a tool, you MUST do so. Do not answer from your training data.
 
         ## Using Tools
-
+        """
+        if self.function_calling:
+            prompt += """
+        To use a tool, call the function with the same name. To use several tools at once, call each of them in the same reply. They will be run at the same time.
+        """
+        else:
+            prompt += """
         To use a tool, reply with the following prefix "Tool: " then append the tool call (like a function call). 
 
+        To use several tools at once, put each "Tool: " call on its own line. They will be run at the same time.
+        """
+        prompt += """
         Behind the scenes, your software will pickup that you want to invoke a tool and invoke it for you and provide you the response.
 
         ## Using Tool Responses
@@ -158,6 +698,117 @@ class Agent:
         """
         return prompt
 
+    def _invoke_tools(self, response):
+        """Invokes the tool calls of the latest reply.
+
+        Calls made through native function calling were parsed when the reply arrived;
+        otherwise they are read from the text of the response.
+
+        Args:
+            response: A string containing the assistant's response.
+
+        Returns:
+            A list of (tool_name, parameters, result) tuples from ToolInvoker.
+        """
+        calls, self._tool_calls = self._tool_calls, None
+        self._used_tools = True
+        if calls:
+            return self.tool_invoker.run_calls(calls)
+        return self.tool_invoker.invoke_calls(response)
+
+    def _finish_reply(self, content, functions):
+        """Records a completion's function calls and returns the reply to keep in the history.
+
+        Function calls are written into the reply in the "Tool: " text form, so stored
+        threads read the same whichever protocol produced them.
+
+        Args:
+            content: A string containing the text of the completion.
+            functions: A list of the completion's function calls, as dictionaries with
+                       a "name" and JSON "arguments".
+
+        Returns:
+            A string containing the assistant's response.
+        """
+        if not functions:
+            self._tool_calls = None
+            return content
+        self._tool_calls = self.tool_invoker.parse_function_calls(functions)
+        call_lines = [
+            f"Tool: {tool_name}({', '.join(json.dumps(parameter) for parameter in parameters or [])})"
+            for tool_name, parameters in self._tool_calls
+        ]
+        return "\n".join([content, *call_lines]).strip()
+
+    def _create_completion(self, message, system_message, **kwargs):
+        """Requests a chat completion, offering the tools as functions when function calling is on.
+
+        If the API rejects the function definitions, the agent falls back to the text
+        protocol and the request is sent again without them. Agents in the process keep
+        to the text protocol for AGENT_FUNCTION_CALLING_RETRY_SECONDS, then try again.
+
+        Args:
+            message: A string containing the user's input.
+            system_message: A string containing a system message.
+            **kwargs: Further arguments for openai.ChatCompletion.create.
+
+        Returns:
+            The completion, or its chunks when streaming.
+        """
+        if self.function_calling:
+            try:
+                return openai.ChatCompletion.create(
+                    messages=self._prepare_messages(message, system_message),
+                    tools=self.tool_invoker.function_definitions(), **kwargs
+                )
+            except openai.error.InvalidRequestError as e:
+                if not is_unsupported_tools_error(e):
+                    raise
+                system_message = self._fall_back_to_text_protocol(e, system_message)
+        return openai.ChatCompletion.create(messages=self._prepare_messages(message, system_message), **kwargs)
+
+    async def _acreate_completion(self, message, system_message, **kwargs):
+        """Asynchronous version of `_create_completion`."""
+        openai.aiosession.set(get_async_session())
+        if self.function_calling:
+            try:
+                return await openai.ChatCompletion.acreate(
+                    messages=self._prepare_messages(message, system_message),
+                    tools=self.tool_invoker.function_definitions(), **kwargs
+                )
+            except openai.error.InvalidRequestError as e:
+                if not is_unsupported_tools_error(e):
+                    raise
+                system_message = self._fall_back_to_text_protocol(e, system_message)
+        return await openai.ChatCompletion.acreate(messages=self._prepare_messages(message, system_message), **kwargs)
+
+    def _fall_back_to_text_protocol(self, error, system_message):
+        """Switches to the "Tool: " text protocol after the API rejected function calling.
+
+        Returns:
+            The system message to send instead, built for the text protocol.
+        """
+        global _function_calling_disabled_until
+        logger.warning("The API does not support function calling, using the text protocol: %s", error)
+        _function_calling_disabled_until = time.monotonic() + settings.AGENT_FUNCTION_CALLING_RETRY_SECONDS
+        self.function_calling = False
+        self.prompt = self._build_prompt()
+        return self.prompt.strip() if system_message is not None else None
+
+    def _record_tool_results(self, tool_results):
+        """Adds the results of a reply's tool calls to the history.
+
+        Args:
+            tool_results: A list of (tool_name, parameters, result) tuples from
+                          ToolInvoker.invoke_calls.
+        """
+        if len(tool_results) == 1:
+            self._update_history("assistant", f"Tool Result: {tool_results[0][2]}")
+            return
+        # Label each result with its call so the model can tell them apart
+        for tool_name, parameters, result in tool_results:
+            self._update_history("assistant", f"Tool Result for {tool_name}({', '.join(parameters or [])}): {result}")
+
     def _needs_tool(self, response):
         """Checks if a response needs a tool to be invoked.
 
@@ -181,11 +832,111 @@ class Agent:
         Returns:
             A string containing the AI's response.
         """
-        messages = self._prepare_messages(message, system_message)
-        completion = openai.ChatCompletion.create(
-            model=model, messages=messages, temperature=temperature
+        completion = self._create_completion(
+            message, system_message, model=model, temperature=temperature, request_timeout=get_timeout()
+        )
+        reply = completion.choices[0].message
+        return self._finish_reply(
+            (reply.get("content") or "").strip(), [call["function"] for call in reply.get("tool_calls") or []]
+        )
+
+    def _stream_ai_reply(self, message, model="gpt-3.5-turbo", system_message=None, temperature=0):
+        """Gets a streamed response from the AI model.
+
+        Args:
+            message: A string containing the user's input.
+            model: A string containing the name of the AI model.
+            system_message: A string containing a system message.
+            temperature: A float used to control the randomness of the AI's output.
+
+        Yields:
+            Strings containing chunks of the AI's response as they arrive, without
+            its tool calls.
+
+        Returns:
+            A string containing the AI's complete response.
+        """
+        completion = self._create_completion(
+            message, system_message, model=model, temperature=temperature, stream=True,
+            request_timeout=get_timeout()
         )
-        return completion.choices[0].message.content.strip()
+        reply = ""
+        shown = 0
+        functions = {}
+        for chunk in completion:
+            delta = chunk.choices[0].delta
+            add_function_call_deltas(functions, delta)
+            content = delta.get("content")
+            if content:
+                reply += content
+                visible = streamable_length(reply)
+                if visible > shown:
+                    yield reply[shown:visible]
+                    shown = visible
+        if not self._needs_tool(reply) and shown < len(reply):
+            yield reply[shown:]  # A held back partial marker that did not become a tool call
+        return self._finish_reply(reply.strip(), [functions[index] for index in sorted(functions)])
+
+    async def _aget_ai_reply(self, message, model="gpt-3.5-turbo", system_message=None, temperature=0):
+        """Asynchronous version of `_get_ai_reply`.
+
+        Args:
+            message: A string containing the user's input.
+            model: A string containing the name of the AI model.
+            system_message: A string containing a system message.
+            temperature: A float used to control the randomness of the AI's output.
+
+        Returns:
+            A string containing the AI's response.
+        """
+        completion = await self._acreate_completion(
+            message, system_message, model=model, temperature=temperature, request_timeout=get_timeout()
+        )
+        reply = completion.choices[0].message
+        return self._finish_reply(
+            (reply.get("content") or "").strip(), [call["function"] for call in reply.get("tool_calls") or []]
+        )
+
+    async def _astream_ai_reply(self, message, model="gpt-3.5-turbo", system_message=None, temperature=0, functions=None, reply=None):
+        """Asynchronous version of `_stream_ai_reply`.
+
+        Args:
+            message: A string containing the user's input.
+            model: A string containing the name of the AI model.
+            system_message: A string containing a system message.
+            temperature: A float used to control the randomness of the AI's output.
+            functions: A list the completion's function calls are appended to once
+                       the stream ends, for `_finish_reply`.
+            reply: A list the chunks of the complete response are appended to,
+                   including the tool calls that are not yielded.
+
+        Yields:
+            Strings containing chunks of the AI's response as they arrive, without
+            its tool calls.
+        """
+        completion = await self._acreate_completion(
+            message, system_message, model=model, temperature=temperature, stream=True,
+            request_timeout=get_timeout()
+        )
+        text = ""
+        shown = 0
+        streamed_functions = {}
+        async for chunk in completion:
+            delta = chunk.choices[0].delta
+            add_function_call_deltas(streamed_functions, delta)
+            content = delta.get("content")
+            if content:
+                text += content
+                visible = streamable_length(text)
+                if visible > shown:
+                    yield text[shown:visible]
+                    shown = visible
+        if not self._needs_tool(text) and shown < len(text):
+            yield text[shown:]
+        if reply is not None:
+            reply.append(text)
+        if functions is not None:
+            functions.extend(streamed_functions[index] for index in sorted(streamed_functions))
 
     def _prepare_messages(self, message, system_message):
         """Prepares the messages for the AI model.
@@ -200,7 +951,9 @@ class Agent:
         messages = []
         if system_message is not None:
             messages.append({"role": "system", "content": system_message})
-        messages.extend(self.history)
+        if self.thread is not None and self.thread.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.thread.summary}"})
+        messages.extend(self._windowed_history())
         if message is not None:
             messages.append({"role": "user", "content": message})
         return messages
@@ -215,4 +968,24 @@ class Agent:
         self.history.append({"role": role, "content": content})
         # Create and save a Message instance
         if self.thread is not None:  # Ensure that thread is not None
-            Message.objects.create(thread=self.thread, user=self.thread.user, content=content, role=role)
\ No newline at end of file
+            message = Message(
+                thread=self.thread, user=self.thread.user, content=content, role=role,
+                content_html=render_markdown(content)  # Rendered once here instead of on every page load
+            )
+            if self.buffer_history:
+                self._pending_messages.append(message)
+            else:
+                message.save()
+            self.new_messages.append(message)
+
+    def _flush_history(self):
+        """Saves the buffered messages with a single INSERT in one transaction.
+
+        Writing a turn's messages together takes the database write lock once per turn
+        instead of once per message.
+        """
+        if not self._pending_messages:
+            return
+        messages, self._pending_messages = self._pending_messages, []
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
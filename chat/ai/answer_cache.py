@@ -0,0 +1,175 @@
+"""This module contains SemanticAnswerCache, a cache of answers to similar questions.
+
+Many first messages of a conversation ask the same thing in different words
+("where can I get tacos?"). The cache embeds each question it stores in its own
+Chroma collection, so a new question whose embedding is close enough to a stored
+one is answered without a completion. Entries remember the revision of the source
+collection the answer was drawn from and are ignored once it changes, so newly
+ingested data is never hidden behind an old answer. Each entry belongs to a scope,
+such as one user, and is only served to questions asked in the same scope.
+
+Typical usage example:
+
+    answer_cache = SemanticAnswerCache(source=VectorCollection("restaurants"))
+    agent = Agent(tools=tools, answer_cache=answer_cache)
+"""
+import hashlib
+import threading
+import time
+from django.conf import settings
+from .vector_collection import VectorCollection, normalize_query
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """
+    Returns the process's answer cache, or None if AGENT_ANSWER_CACHE is off.
+
+    Returns
+    -------
+    SemanticAnswerCache or None
+        the cache over ANSWER_CACHE_SOURCE_COLLECTION, created on first use
+    """
+    global _default_cache
+    if not settings.AGENT_ANSWER_CACHE:
+        return None
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = SemanticAnswerCache(
+                    source=VectorCollection(collection_name=settings.ANSWER_CACHE_SOURCE_COLLECTION)
+                )
+    return _default_cache
+
+
+class SemanticAnswerCache:
+    """
+    A class to cache answers by the meaning of the question they answer.
+
+    ...
+
+    Attributes
+    ----------
+    source : VectorCollection or None
+        the collection answers are drawn from; entries stored under an older
+        revision of it are ignored
+    entries : VectorCollection
+        the collection holding the cached questions, compared by cosine distance
+    threshold : float
+        the cosine similarity a stored question needs to answer a new one
+    ttl : int
+        the number of seconds an entry stays valid
+    revision_ttl : int
+        the number of seconds the source's revision is reused before it is fetched again
+
+    Methods
+    -------
+    lookup(question, scope):
+        Returns the cached answer to a question similar to question, or None.
+    store(question, answer, scope):
+        Caches the answer to a question.
+    """
+
+    def __init__(self, source=None, collection_name=None, threshold=None, ttl=None, revision_ttl=None):
+        """
+        Constructs all the necessary attributes for the SemanticAnswerCache object.
+
+        Parameters
+        ----------
+            source : VectorCollection, optional
+                the collection answers are drawn from
+            collection_name : str, optional
+                the name of the collection holding the cache (default is ANSWER_CACHE_COLLECTION)
+            threshold : float, optional
+                the similarity needed for a hit (default is ANSWER_CACHE_THRESHOLD)
+            ttl : int, optional
+                the number of seconds an entry stays valid (default is ANSWER_CACHE_TTL)
+            revision_ttl : int, optional
+                the number of seconds the source's revision is reused (default is ANSWER_CACHE_REVISION_TTL)
+        """
+        self.source = source
+        self.entries = VectorCollection(
+            collection_name=collection_name or settings.ANSWER_CACHE_COLLECTION,
+            metadata={"hnsw:space": "cosine"}
+        )
+        self.threshold = settings.ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl = settings.ANSWER_CACHE_TTL if ttl is None else ttl
+        self.revision_ttl = settings.ANSWER_CACHE_REVISION_TTL if revision_ttl is None else revision_ttl
+        self._revision = None
+        self._revision_expires = 0.0
+        self._revision_lock = threading.Lock()
+
+    def lookup(self, question, scope=""):
+        """
+        Returns the cached answer to a question similar to question, or None.
+
+        Parameters
+        ----------
+            question : str
+                the user's message
+            scope : str, optional
+                the scope of the answers to search, such as "user:1"
+
+        Returns
+        -------
+        str or None
+            the answer of the most similar stored question, if it is similar enough,
+            has not expired and was stored under the source's current revision
+        """
+        if self.entries.collection.count() == 0:
+            return None
+        results = self.entries.collection.query(
+            query_texts=[normalize_query(question)], n_results=1, where={"scope": scope},
+            include=["metadatas", "distances"]
+        )
+        if not results["ids"][0]:
+            return None
+        similarity = 1 - results["distances"][0][0]  # Cosine distance is 1 - similarity
+        entry = results["metadatas"][0][0]
+        if similarity < self.threshold or entry["created_at"] + self.ttl < time.time():
+            return None
+        if entry["revision"] != self._source_revision():
+            return None
+        return entry["answer"]
+
+    def store(self, question, answer, scope=""):
+        """
+        Caches the answer to a question, replacing any earlier answer to the same question.
+
+        Parameters
+        ----------
+            question : str
+                the user's message
+            answer : str
+                the assistant's answer
+            scope : str, optional
+                the scope the answer may be served in, such as "user:1"
+        """
+        normalized = normalize_query(question)
+        self.entries.collection.upsert(
+            ids=[hashlib.sha256(f"{scope}\0{normalized}".encode()).hexdigest()],
+            documents=[normalized],
+            metadatas=[{
+                "answer": answer, "scope": scope, "revision": self._source_revision(), "created_at": time.time()
+            }]
+        )
+
+    def _source_revision(self):
+        """
+        Returns the source collection's revision as stored in entry metadata.
+
+        Fetching the revision is a round trip to Chroma, so it is reused for
+        revision_ttl seconds; answers may outlive a change to the source by that long.
+        """
+        if self.source is None:
+            return ""
+        with self._revision_lock:
+            if time.monotonic() < self._revision_expires:
+                return self._revision
+        revision = self.source.revision() or ""  # Chroma metadata values cannot be None
+        with self._revision_lock:
+            self._revision = revision
+            self._revision_expires = time.monotonic() + self.revision_ttl
+        return revision
@@ -0,0 +1,164 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+
+# SQLite limits the number of bound parameters per statement
+SQLITE_MAX_PARAMS = 500
+
+class CachedEmbeddingFunction:
+    """
+    A class to represent an embedding function backed by a persistent cache.
+
+    ...
+
+    Vectors are keyed by a hash of the model name and the text, and stored as
+    float32 blobs in a SQLite database. Fresh embeddings are rounded to float32
+    too, so a text gets the same vector whether or not it was cached. SQLite's
+    file locking lets every worker process share the same cache file. When the
+    cache grows past max_entries, the least recently used vectors are evicted.
+
+    Attributes
+    ----------
+    embedding_function : callable
+        the embedding function used for texts that are not cached
+    model_name : str
+        the name of the embedding model, part of every cache key
+    path : str
+        the path to the SQLite cache file
+    max_entries : int
+        the number of vectors kept before the least recently used are evicted
+
+    Methods
+    -------
+    __call__(input):
+        Returns the embeddings for a list of texts, embedding only cache misses.
+    """
+
+    # Hits refresh an entry's recency at most this often, so most hits avoid a write
+    TOUCH_INTERVAL_SECONDS = 60
+
+    # Inserts between checks of the cache size
+    EVICTION_CHECK_INTERVAL = 100
+
+    def __init__(self, embedding_function, model_name, path, max_entries=100000):
+        """
+        Constructs all the necessary attributes for the CachedEmbeddingFunction object.
+
+        Parameters
+        ----------
+            embedding_function : callable
+                the embedding function used for texts that are not cached
+            model_name : str
+                the name of the embedding model, part of every cache key
+            path : str
+                the path to the SQLite cache file
+            max_entries : int, optional
+                the number of vectors kept before the least recently used are evicted (default is 100000)
+        """
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._inserts_since_eviction = 0
+        self._eviction_lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._connection().execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    def __call__(self, input):
+        """
+        Returns the embeddings for a list of texts, embedding only cache misses.
+
+        Parameters
+        ----------
+            input : list of str
+                the texts to embed
+
+        Returns
+        -------
+        list
+            a list of embeddings, one per text, in the order of input
+        """
+        keys = [self._key(text) for text in input]
+        vectors = self._get_many(set(keys))
+
+        missing = {}
+        for key, text in zip(keys, input):
+            if key not in vectors:
+                missing[key] = text
+        if missing:
+            embeddings = self.embedding_function(list(missing.values()))
+            new_vectors = {key: array("f", embedding).tolist() for key, embedding in zip(missing.keys(), embeddings)}
+            self._put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+    def _key(self, text):
+        """Hashes the model name and text into a cache key."""
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def _connection(self):
+        """Returns this thread's connection to the cache file."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")  # Readers do not block the writer, or each other
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _get_many(self, keys):
+        """Returns a dictionary of the cached vectors for the given keys."""
+        keys = list(keys)
+        vectors = {}
+        now = time.time()
+        connection = self._connection()
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk)
+            hits = []
+            for key, blob in rows:
+                vectors[key] = array("f", blob).tolist()
+                hits.append(key)
+            if hits:
+                placeholders = ",".join("?" * len(hits))
+                connection.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders}) AND last_used < ?",
+                    [now, *hits, now - self.TOUCH_INTERVAL_SECONDS]
+                )
+        return vectors
+
+    def _put_many(self, vectors):
+        """Stores vectors in the cache, evicting the least recently used if it is full."""
+        now = time.time()
+        self._connection().executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, array("f", vector).tobytes(), now) for key, vector in vectors.items()]
+        )
+
+        with self._eviction_lock:
+            self._inserts_since_eviction += len(vectors)
+            if self._inserts_since_eviction < self.EVICTION_CHECK_INTERVAL:
+                return
+            self._inserts_since_eviction = 0
+        self._evict()
+
+    def _evict(self):
+        """Deletes the least recently used vectors beyond max_entries."""
+        connection = self._connection()
+        (count,) = connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (overflow,)
+            )
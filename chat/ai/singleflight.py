@@ -0,0 +1,96 @@
+"""This module contains SingleFlight, which coalesces concurrent identical calls.
+
+When several threads make the same call at once, such as embedding the same
+question during a spike of traffic, only the first runs it; the others wait and
+share its result, or its exception. Nothing is kept once the call returns, so a
+later call runs again; caching results is left to TTLCache and the embedding cache.
+
+Typical usage example:
+
+    flight = SingleFlight()
+    results = flight.do(key, expensive_lookup, query)
+"""
+import threading
+
+class _Call:
+    """An in-flight call and the outcome its waiters share."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Runs at most one call per key at a time, sharing its outcome with concurrent callers.
+
+    Attributes:
+        shared: The number of calls answered by another caller's call instead of running.
+    """
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args, **kwargs):
+        """Returns function(*args, **kwargs), or the result of the identical call already in flight.
+
+        Args:
+            key: A hashable identifying the call. Calls with equal keys must be interchangeable.
+            function: The function to call.
+
+        Returns:
+            The function's result.
+
+        Raises:
+            Exception: Whatever the function raised, in every caller that shared the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key):
+        """Returns the number of callers waiting on the call in flight for key, or None if there is none."""
+        with self._lock:
+            call = self._calls.get(key)
+            return None if call is None else call.waiters
+
+class SingleFlightEmbeddingFunction:
+    """Wraps an embedding function so concurrent identical requests share one call.
+
+    Attributes:
+        embedding_function: The wrapped embedding function.
+        model_name: The name of the embedding model, part of every key.
+        flight: The SingleFlight the requests are coalesced in.
+    """
+    # Shared by every wrapper in the process, so requests coalesce across collections
+    default_flight = SingleFlight()
+
+    def __init__(self, embedding_function, model_name, flight=None):
+        self.embedding_function = embedding_function
+        self.model_name = model_name
+        self.flight = flight or self.default_flight
+
+    def __call__(self, input):
+        """Returns the embeddings for a list of texts."""
+        return self.flight.do((self.model_name, tuple(input)), self.embedding_function, input)
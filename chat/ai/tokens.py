@@ -0,0 +1,26 @@
+"""This module estimates how many tokens a piece of text costs.
+
+The estimate follows OpenAI's rule of thumb of roughly four characters per
+token for English text. It is intended for budgeting and throughput reporting,
+where an exact count is not worth the cost of running a tokenizer.
+
+Typical usage example:
+
+    tokens = estimate_tokens("Where can I get tacos in Edinburg?")
+"""
+import math
+
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    """Estimates the number of tokens in a string.
+
+    Args:
+        text: A string to estimate the token count of.
+
+    Returns:
+        An integer estimate of the number of tokens.
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
@@ -0,0 +1,74 @@
+"""This module contains TTLCache, a small in-process cache with expiry.
+
+Entries expire a fixed number of seconds after they are stored, and the least
+recently used entries are evicted once the cache holds max_entries. Hit and
+miss counters are kept so the cache's effectiveness can be monitored.
+
+Typical usage example:
+
+    cache = TTLCache(max_entries=1024, ttl=300)
+    results = cache.get(key)
+    if results is None:
+        results = expensive_lookup()
+        cache.set(key, results)
+"""
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """A thread-safe, size-bounded LRU cache whose entries expire after a time-to-live.
+
+    Attributes:
+        max_entries: The number of entries kept before the least recently used are evicted.
+        ttl: The number of seconds an entry stays valid. A ttl of 0 disables the cache.
+        hits: The number of lookups that found a valid entry.
+        misses: The number of lookups that did not.
+    """
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value stored for key, or default if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Stores value for key, evicting the least recently used entry if the cache is full."""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Removes the entry for key, if there is one."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Returns a dictionary with the hit and miss counts and the current size."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
@@ -1,10 +1,22 @@
 import os
 import json
+import threading
+import uuid
+from collections import defaultdict
+from itertools import islice
 from pathlib import Path
 import chromadb
 from chromadb.utils import embedding_functions
 from tenacity import retry, wait_exponential, stop_after_attempt
 from django.conf import settings
+from .embedding_cache import CachedEmbeddingFunction
+from .singleflight import SingleFlight, SingleFlightEmbeddingFunction
+from .ttl_cache import TTLCache
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# The maximum number of inputs the OpenAI embeddings endpoint accepts per request
+EMBEDDING_BATCH_LIMIT = 2048
 
 class Document:
     """
@@ -63,6 +75,14 @@ class VectorCollection:
         a client to interact with the ChromaDB
     collection : chromadb.Collection
         a collection of documents in the ChromaDB
+    search_cache : TTLCache
+        the search results cache shared by all collections in the process; its
+        stats() method reports hit and miss counts
+    search_flight : SingleFlight
+        coalesces concurrent identical searches that miss the cache, so they
+        share one query
+    embedding_function : callable
+        the function used to embed the collection's documents and queries
 
     Methods
     -------
@@ -72,9 +92,19 @@ class VectorCollection:
         Searches the collection for a query and returns the top n_results.
     add(document):
         Adds a document to the collection.
+    add_many(documents, batch_size=100, progress_callback=None):
+        Adds documents to the collection in batches.
+    revision():
+        Returns the collection's current revision.
     """
 
-    def __init__(self, collection_name="default"):
+    # Search results shared by every VectorCollection in this process
+    search_cache = TTLCache(max_entries=settings.SEARCH_CACHE_MAX_ENTRIES, ttl=settings.SEARCH_CACHE_TTL)
+    search_flight = SingleFlight()
+    _generations = defaultdict(int)
+    _generations_lock = threading.Lock()
+
+    def __init__(self, collection_name="default", metadata=None):
         """
         Constructs all the necessary attributes for the VectorCollection object.
 
@@ -84,6 +114,8 @@ class VectorCollection:
                 the path to the ChromaDB storage. If None, an in-memory client will be used.
             collection_name : str
                 the name of the collection in the ChromaDB
+            metadata : dict, optional
+                the metadata the collection is created with, such as its "hnsw:space"
         """
         path = settings.CHROMADB_STORAGE_PATH
 
@@ -93,9 +125,9 @@ class VectorCollection:
             self.chroma_client = chromadb.PersistentClient(path=path)
         else:
             self.chroma_client = chromadb.Client()
-        self.collection = self._get_chroma_collection(collection_name)
+        self.collection = self._get_chroma_collection(collection_name, metadata)
 
-    def _get_chroma_collection(self, collection_name):
+    def _get_chroma_collection(self, collection_name, metadata=None):
         """
         Retrieves or creates a collection in the ChromaDB.
 
@@ -103,26 +135,47 @@ class VectorCollection:
         ----------
             collection_name : str
                 the name of the collection in the ChromaDB
+            metadata : dict, optional
+                the metadata the collection is created with
 
         Returns
         -------
         chromadb.Collection
             a collection of documents in the ChromaDB
         """
-        openai_ef = embedding_functions.OpenAIEmbeddingFunction(
+        embedding_function = embedding_functions.OpenAIEmbeddingFunction(
                         api_key=settings.OPENAI_API_KEY,
                         api_base=settings.OPENAI_API_BASE,
-                        model_name="text-embedding-ada-002"
+                        model_name=EMBEDDING_MODEL
                     )
 
-        collection = self.chroma_client.get_or_create_collection(name=collection_name, embedding_function=openai_ef)
+        # Serve repeated texts from the shared on-disk cache instead of re-embedding them
+        if settings.EMBEDDING_CACHE_PATH:
+            embedding_function = CachedEmbeddingFunction(
+                embedding_function,
+                model_name=EMBEDDING_MODEL,
+                path=settings.EMBEDDING_CACHE_PATH,
+                max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES
+            )
+
+        # Concurrent requests for the same texts share one embedding call
+        embedding_function = SingleFlightEmbeddingFunction(embedding_function, model_name=EMBEDDING_MODEL)
+
+        self.embedding_function = embedding_function
+        collection = self.chroma_client.get_or_create_collection(
+            name=collection_name, metadata=metadata, embedding_function=embedding_function
+        )
         return collection
 
-    @retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5), reraise=True)
     def search(self, query, n_results=10):
         """
         Searches the collection for a query and returns the top n_results.
 
+        Results are cached per process for SEARCH_CACHE_TTL seconds, keyed by the
+        collection, the normalized query and n_results. Adding documents to the
+        collection invalidates its cached results. Identical searches that miss the
+        cache at the same time share one query.
+
         Parameters
         ----------
             query : str
@@ -130,6 +183,38 @@ class VectorCollection:
             n_results : int, optional
                 the number of results to return (default is 10)
 
+        Returns
+        -------
+        list
+            a list of metadata for the top n_results documents
+        """
+        name = self.collection.name
+        key = (name, self._generations[name], normalize_query(query), n_results)
+        metadatas = self.search_cache.get(key)
+        if metadatas is None:
+            metadatas = self.search_flight.do(key, self._query_and_cache, key, query, n_results)
+        return list(metadatas)
+
+    def _query_and_cache(self, key, query, n_results):
+        """
+        Queries the collection and caches the results under key.
+        """
+        metadatas = self._query(query, n_results)
+        self.search_cache.set(key, metadatas)
+        return metadatas
+
+    @retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5), reraise=True)
+    def _query(self, query, n_results):
+        """
+        Queries the collection, bypassing the search cache.
+
+        Parameters
+        ----------
+            query : str
+                the query to search for in the collection
+            n_results : int
+                the number of results to return
+
         Returns
         -------
         list
@@ -157,4 +242,113 @@ class VectorCollection:
             documents=[document.to_embed_str()],
             metadatas=[document.data],
             ids=[document.id]
-        )
\ No newline at end of file
+        )
+        self._invalidate_search_cache()
+        self._bump_revision()
+
+    def add_many(self, documents, batch_size=100, progress_callback=None):
+        """
+        Adds documents to the collection in batches.
+
+        Each batch is embedded with a single embedding request and upserted into the
+        collection in a single call, and is retried as a whole if either fails.
+
+        Parameters
+        ----------
+            documents : iterable of Document
+                the documents to add to the collection; may be a generator
+            batch_size : int, optional
+                the number of documents per batch (default is 100, at most EMBEDDING_BATCH_LIMIT)
+            progress_callback : callable, optional
+                called after each batch with the number of documents added so far and
+                the total number of documents (None when documents has no length)
+
+        Returns
+        -------
+        int
+            the number of documents added
+        """
+        if not 1 <= batch_size <= EMBEDDING_BATCH_LIMIT:
+            raise ValueError(f"batch_size must be between 1 and {EMBEDDING_BATCH_LIMIT}")
+
+        total = len(documents) if hasattr(documents, "__len__") else None
+        iterator = iter(documents)
+        added = 0
+        while True:
+            batch = list(islice(iterator, batch_size))
+            if not batch:
+                break
+            self._add_batch(batch)
+            added += len(batch)
+            if progress_callback is not None:
+                progress_callback(added, total)
+        return added
+
+    @retry(wait=wait_exponential(multiplier=1, min=2, max=30), stop=stop_after_attempt(5), reraise=True)
+    def _add_batch(self, documents):
+        """
+        Embeds and upserts a batch of documents with a single request.
+
+        Parameters
+        ----------
+            documents : list of Document
+                the documents to upsert into the collection
+        """
+        self.collection.upsert(
+            documents=[document.to_embed_str() for document in documents],
+            metadatas=[document.data for document in documents],
+            ids=[document.id for document in documents]
+        )
+        self._invalidate_search_cache()
+        self._bump_revision()
+
+    def revision(self):
+        """
+        Returns the collection's current revision.
+
+        The revision changes whenever documents are added, by this or any other
+        process, so caches derived from the collection can tell when they are stale.
+
+        Returns
+        -------
+        str or None
+            the revision, or None if no documents were added since revisions were introduced
+        """
+        collection = self.chroma_client.get_collection(
+            name=self.collection.name, embedding_function=self.embedding_function
+        )
+        return (collection.metadata or {}).get("revision")
+
+    def _bump_revision(self):
+        """
+        Records a new revision in the collection's metadata.
+        """
+        # Chroma replaces the whole metadata, so the existing keys are sent along with it
+        self.collection.modify(metadata={**(self.collection.metadata or {}), "revision": uuid.uuid4().hex})
+
+    def _invalidate_search_cache(self):
+        """
+        Invalidates this process's cached search results for the collection.
+
+        Cache keys include a per-collection generation, so bumping it makes every
+        existing entry for the collection unreachable; those entries then age out.
+        """
+        with self._generations_lock:
+            self._generations[self.collection.name] += 1
+
+
+def normalize_query(query):
+    """
+    Normalizes a search query for use in a cache key by case-folding it and collapsing whitespace.
+
+    Parameters
+    ----------
+        query : str
+            the query to normalize
+
+    Returns
+    -------
+    str
+        the normalized query
+    """
+    return " ".join(query.casefold().split())
@@ -1,13 +1,14 @@
 # chat/context_processors.py
-from .models import Thread
+from django.utils.functional import SimpleLazyObject
+from .sidebar import get_sidebar_page
 
 def thread_list(request):
     if request.user.is_authenticated:
-        # Order threads by 'created_at' in descending order so the newest threads are first
-        threads = Thread.objects.filter(user=request.user).order_by('-created_at')
+        # Lazy, so the threads are only fetched when a template renders the sidebar
+        sidebar = SimpleLazyObject(lambda: get_sidebar_page(request.user))
     else:
-        threads = []
+        sidebar = {'threads': [], 'has_more': False}
     
     return {
-        'threads': threads
-    }
\ No newline at end of file
+        'sidebar': sidebar
+    }
@@ -0,0 +1,158 @@
+"""This module provides the process-wide HTTP sessions used for upstream OpenAI calls.
+
+Sharing one session keeps TCP+TLS connections to the API alive between requests
+instead of opening a new connection per call. The session applies the configured
+connect/read timeouts and retries 429 and 5xx responses and failed connections with
+exponential backoff. A request that timed out while reading is never retried: it
+was already sent, and completions are not idempotent, so a retry could bill for
+and generate a second reply. Async views use an equivalent aiohttp session, one
+per event loop.
+
+Typical usage example:
+
+    response = get_session().post(url, json=payload)
+
+    response = await apost(url, json=payload)
+"""
+import asyncio
+import threading
+import weakref
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+_async_sessions = weakref.WeakKeyDictionary()  # aiohttp sessions are bound to the loop that created them
+
+
+class TimeoutSession(requests.Session):
+    """A requests.Session that applies a default timeout to every request.
+
+    Attributes:
+        timeout: A (connect, read) tuple used when a request does not set its own timeout.
+    """
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+class BorrowedSession:
+    """The shared session, lent to a client that closes its sessions when done with them.
+
+    openai closes and replaces each thread's session every few minutes. Closing the
+    shared session would drop the pooled connections of every other caller, so
+    `close` does nothing and everything else is passed through to `get_session()`.
+    """
+    def __getattr__(self, name):
+        return getattr(get_session(), name)
+
+    def close(self):
+        pass
+
+
+def get_timeout():
+    """Returns the (connect, read) timeout tuple for upstream requests."""
+    return (settings.OPENAI_HTTP_CONNECT_TIMEOUT, settings.OPENAI_HTTP_READ_TIMEOUT)
+
+
+def get_session():
+    """Returns the shared session, creating it on first use.
+
+    Returns:
+        A TimeoutSession with a pooled, retrying adapter mounted for HTTP and HTTPS.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def _build_session():
+    """Builds a session with a connection pool and retry policy from the settings."""
+    retry = Retry(
+        total=settings.OPENAI_HTTP_MAX_RETRIES,
+        read=0,  # The request was sent; retrying it could run the completion twice
+        backoff_factor=settings.OPENAI_HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=None,  # Completions are POSTs, which urllib3 does not retry by default
+        raise_on_status=False,  # Hand the last response back to the caller once retries run out
+    )
+    adapter = HTTPAdapter(
+        pool_connections=settings.OPENAI_HTTP_POOL_SIZE,
+        pool_maxsize=settings.OPENAI_HTTP_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = TimeoutSession(get_timeout())
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_async_session():
+    """Returns the aiohttp session for the running event loop, creating it on first use.
+
+    Returns:
+        An aiohttp.ClientSession with a pooled connector and the configured timeouts.
+    """
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        connect_timeout, read_timeout = get_timeout()
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=settings.OPENAI_ASYNC_HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout),
+        )
+        _async_sessions[loop] = session
+    return session
+
+
+async def aclose_async_session():
+    """Closes the aiohttp session of the running event loop, if it has one."""
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+async def apost(url, **kwargs):
+    """Posts to `url` on the shared aiohttp session, retrying like the synchronous session.
+
+    Args:
+        url: A string containing the URL to post to.
+        **kwargs: Keyword arguments passed to aiohttp.ClientSession.post.
+
+    Returns:
+        The aiohttp.ClientResponse of the last attempt. The caller must read or release it.
+    """
+    session = get_async_session()
+    max_retries = settings.OPENAI_HTTP_MAX_RETRIES
+    for attempt in range(max_retries + 1):
+        try:
+            response = await session.post(url, **kwargs)
+        except aiohttp.ClientConnectorError:  # Only retry when the request was never sent
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(_backoff(attempt))
+            continue
+        if response.status not in RETRY_STATUS_CODES or attempt == max_retries:
+            return response
+        retry_after = response.headers.get("Retry-After")
+        response.release()
+        await asyncio.sleep(_backoff(attempt, retry_after))
+
+
+def _backoff(attempt, retry_after=None):
+    """Returns the seconds to wait before retry number `attempt`, honoring a Retry-After header."""
+    if retry_after is not None and retry_after.isdigit():
+        return int(retry_after)
+    return settings.OPENAI_HTTP_BACKOFF_FACTOR * (2 ** attempt)
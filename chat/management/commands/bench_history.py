@@ -0,0 +1,130 @@
+"""Benchmarks the chat history and sidebar queries against a large synthetic dataset.
+
+The command fills the database with synthetic users, threads and messages inside
+a transaction, times the queries behind Agent._build_history, the thread page's
+newest and earlier messages and the thread list sidebar, prints their query plans, and then rolls the
+transaction back so nothing is left behind. With --compare the queries are timed
+again after dropping the composite indexes, showing what they save.
+
+Typical usage example:
+
+    python manage.py bench_history --messages 1000000 --compare
+"""
+import statistics
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from chat.models import Message, Thread
+from chat.views import message_page_queryset
+
+INSERT_BATCH_SIZE = 10000
+
+# The composite indexes added for these queries, by table
+INDEXES = {
+    "chat_message": "chat_message_thread_ts_idx",
+    "chat_thread": "chat_thread_user_created_idx",
+}
+
+
+class Command(BaseCommand):
+    help = "Times the history and thread list queries against synthetic data, then rolls the data back."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000000, help="Number of synthetic messages.")
+        parser.add_argument("--threads", type=int, default=1000, help="Number of synthetic threads.")
+        parser.add_argument("--users", type=int, default=10, help="Number of synthetic users owning the threads.")
+        parser.add_argument("--repeat", type=int, default=20, help="Times each query is run.")
+        parser.add_argument("--compare", action="store_true", help="Also time the queries without the composite indexes.")
+
+    def handle(self, *args, **options):
+        if min(options["messages"], options["threads"], options["users"], options["repeat"]) < 1:
+            raise CommandError("--messages, --threads, --users and --repeat must be at least 1.")
+
+        with transaction.atomic():
+            thread, user = self._populate(options["users"], options["threads"], options["messages"])
+            queries = benchmark_queries(thread, user)
+
+            self.stdout.write(self.style.MIGRATE_HEADING("With indexes"))
+            self._run(queries, options["repeat"], "with indexes")
+            if options["compare"]:
+                with connection.cursor() as cursor:
+                    for index in INDEXES.values():
+                        cursor.execute(f"DROP INDEX {connection.ops.quote_name(index)}")
+                self.stdout.write(self.style.MIGRATE_HEADING("Without indexes"))
+                self._run(queries, options["repeat"], "without indexes")
+
+            transaction.set_rollback(True)  # Discard the synthetic data and restore any dropped indexes
+
+    def _populate(self, users, threads, messages):
+        """Creates the synthetic data and returns a thread and user to query."""
+        started = time.monotonic()
+        User = get_user_model()
+        owners = User.objects.bulk_create(
+            User(email=f"bench-{number}@example.com", password="!") for number in range(users)
+        )
+        created_threads = Thread.objects.bulk_create(
+            Thread(user=owners[number % users], name=f"Thread {number}") for number in range(threads)
+        )
+        for start in range(0, messages, INSERT_BATCH_SIZE):
+            # Interleave the threads' messages, as concurrent conversations would be
+            Message.objects.bulk_create(
+                Message(
+                    thread=created_threads[number % threads],
+                    user=created_threads[number % threads].user,
+                    role="user" if number % 2 == 0 else "assistant",
+                    content=f"Synthetic message {number}",
+                )
+                for number in range(start, min(start + INSERT_BATCH_SIZE, messages))
+            )
+        self.stdout.write(
+            f"Created {users} users, {threads} threads and {messages} messages in {time.monotonic() - started:.1f}s."
+        )
+        thread = created_threads[-1]
+        return thread, thread.user
+
+    def _run(self, queries, repeat, label):
+        """Prints the median time and query plan of each query."""
+        for name, queryset in queries.items():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(queryset.all())  # .all() clones the queryset, so every run hits the database
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f"{name}: median {statistics.median(timings):.2f} ms, max {max(timings):.2f} ms")
+            for line in query_plan(queryset, label):
+                self.stdout.write(f"    {line}")
+
+
+def benchmark_queries(thread, user):
+    """Returns the benchmarked querysets by name."""
+    return {
+        "history": (
+            Message.objects.filter(thread=thread)
+            .order_by('-timestamp', '-id')
+            .values_list('role', 'content')[:settings.AGENT_HISTORY_MAX_MESSAGES]
+        ),
+        "message_page": message_page_queryset(thread),
+        "earlier_messages": message_page_queryset(thread, before=earlier_messages_cursor(thread)),
+        "thread_list": Thread.objects.filter(user=user).order_by('-created_at'),
+    }
+
+
+def earlier_messages_cursor(thread):
+    """Returns the `before` id the thread page sends to load the page before its newest one."""
+    newest = list(message_page_queryset(thread))[:settings.THREAD_MESSAGES_PAGE_SIZE]
+    return newest[-1].id if newest else None
+
+
+def query_plan(queryset, label):
+    """Returns the lines of the query plan the database uses for queryset.
+
+    The label is appended as an SQL comment. sqlite3 caches prepared statements by
+    their text, and a cached EXPLAIN keeps reporting the plan it was prepared with
+    after an index is dropped, so each pass needs a distinct statement.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql} -- {label}", params)
+        return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
@@ -0,0 +1,222 @@
+"""Loads a JSON or JSONL file of records into a vector collection.
+
+Records are read incrementally, so the file is never loaded into memory as a
+whole. They are grouped into batches that a bounded pool of worker threads
+embeds and upserts concurrently. Completed batches are recorded in an optional
+checkpoint file so an interrupted run can be resumed.
+
+Typical usage example:
+
+    python manage.py ingest data/data.json --collection restaurants --workers 4
+"""
+import json
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from chat.ai.tokens import estimate_tokens
+from chat.ai.vector_collection import EMBEDDING_BATCH_LIMIT, Document, VectorCollection
+
+READ_CHUNK_SIZE = 64 * 1024
+WHITESPACE = re.compile(r"[ \t\r\n]*")
+
+
+class Command(BaseCommand):
+    help = "Ingests a JSON array or JSONL file of records into a vector collection."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Path to a .json file containing an array of records, or a .jsonl file.")
+        parser.add_argument("--collection", default="default", help="Name of the collection to ingest into.")
+        parser.add_argument("--id-field", help="Record field to use as the document id (defaults to the record's position).")
+        parser.add_argument("--batch-size", type=int, default=100, help="Documents per embedding request.")
+        parser.add_argument("--workers", type=int, default=4, help="Number of batches embedded concurrently.")
+        parser.add_argument("--checkpoint", help="File recording completed batches, used to resume an interrupted run.")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        workers = options["workers"]
+        if not 1 <= batch_size <= EMBEDDING_BATCH_LIMIT:
+            raise CommandError(f"--batch-size must be between 1 and {EMBEDDING_BATCH_LIMIT}.")
+        if workers < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        self.batch_size = batch_size
+        self.checkpoint_path = options["checkpoint"]
+        self.completed = load_checkpoint(self.checkpoint_path, batch_size)
+        if self.completed:
+            self.stdout.write(f"Resuming: skipping {len(self.completed)} completed batches.")
+
+        collection = VectorCollection(collection_name=options["collection"])
+        batches = iter_batches(iter_records(options["path"]), batch_size, options["id_field"])
+
+        self.documents = 0
+        self.tokens = 0
+        self.started = time.monotonic()
+        pending = {}
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for number, batch in batches:
+                if number in self.completed:
+                    continue
+                # Keep at most two batches per worker in flight so reading never runs far ahead of embedding
+                while len(pending) >= workers * 2:
+                    self._collect(wait(pending, return_when=FIRST_COMPLETED).done, pending)
+                pending[executor.submit(collection.add_many, batch, batch_size=batch_size)] = (number, batch)
+            while pending:
+                self._collect(wait(pending, return_when=FIRST_COMPLETED).done, pending)
+        except Exception as e:
+            for future in pending:
+                future.cancel()
+            if self.checkpoint_path:
+                raise CommandError(f"Ingestion failed: {e}. Re-run with the same --checkpoint to resume.") from e
+            raise CommandError(f"Ingestion failed: {e}") from e
+        finally:
+            executor.shutdown(wait=True)
+
+        self.stdout.write(self.style.SUCCESS(f"Ingested {self._throughput()}."))
+
+    def _collect(self, done, pending):
+        """Records finished batches, updates the checkpoint and reports throughput.
+
+        Successful batches are checkpointed before the first failed batch's error is re-raised.
+        """
+        error = None
+        for future in done:
+            number, batch = pending.pop(future)
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            self.completed.add(number)
+            self.documents += len(batch)
+            self.tokens += sum(estimate_tokens(document.to_embed_str()) for document in batch)
+        save_checkpoint(self.checkpoint_path, self.batch_size, self.completed)
+        if error is not None:
+            raise error
+        self.stdout.write(self._throughput())
+
+    def _throughput(self):
+        """Describes the documents ingested so far and the ingestion rate."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (
+            f"{self.documents} documents in {elapsed:.1f}s "
+            f"({self.documents / elapsed:.1f} docs/sec, {self.tokens / elapsed:.0f} tokens/sec)"
+        )
+
+
+def iter_batches(records, batch_size, id_field=None):
+    """Groups records into numbered batches of Documents.
+
+    Batch numbers depend only on the input order and batch size, which is what
+    allows a checkpoint to identify them across runs.
+    """
+    documents = (
+        Document(record[id_field] if id_field else position, record)
+        for position, record in enumerate(records)
+    )
+    number = 0
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            return
+        yield number, batch
+        number += 1
+
+
+def iter_records(path):
+    """Yields the records of a .jsonl file line by line, or of a .json file element by element."""
+    with open(path, encoding="utf-8") as file:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(file)
+
+
+def iter_json_array(file, chunk_size=READ_CHUNK_SIZE):
+    """Yields the elements of a top-level JSON array without reading the whole file.
+
+    Raises:
+        CommandError: If the file does not contain a valid JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    index = 0  # Position of the next unread character in buffer
+    eof = False
+
+    def fill():
+        # The consumed text is dropped only when reading, so records are not copied out one by one
+        nonlocal buffer, index, eof
+        chunk = file.read(chunk_size)
+        buffer = buffer[index:] + chunk
+        index = 0
+        eof = not chunk
+
+    def next_char():
+        # Skips whitespace and returns the next character, or "" at the end of the file
+        nonlocal index
+        while True:
+            index = WHITESPACE.match(buffer, index).end()
+            if index < len(buffer):
+                return buffer[index]
+            if eof:
+                return ""
+            fill()
+
+    if next_char() != "[":
+        raise CommandError("Expected the JSON file to contain an array of records.")
+    index += 1
+    if next_char() == "]":
+        return
+
+    while True:
+        char = next_char()
+        if not char:
+            raise CommandError("Unexpected end of file inside the JSON array.")
+        if char in ",]":
+            raise CommandError("Expected a record in the JSON array.")
+        try:
+            record, end = decoder.raw_decode(buffer, index)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError("Invalid JSON in the records file.")
+            fill()
+            continue
+        if end == len(buffer) and not eof:
+            # A value ending exactly at the buffer boundary may be truncated (e.g. a number)
+            fill()
+            continue
+        yield record
+        index = end
+
+        char = next_char()
+        if char == "]":
+            return
+        if not char:
+            raise CommandError("Unexpected end of file inside the JSON array.")
+        if char != ",":
+            raise CommandError("Expected a comma between the records of the JSON array.")
+        index += 1
+
+
+def load_checkpoint(path, batch_size):
+    """Returns the set of completed batch numbers stored in the checkpoint file, if any."""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as file:
+        checkpoint = json.load(file)
+    if checkpoint["batch_size"] != batch_size:
+        raise CommandError(f"The checkpoint was written with --batch-size {checkpoint['batch_size']}; use the same batch size to resume.")
+    return set(checkpoint["completed"])
+
+
+def save_checkpoint(path, batch_size, completed):
+    """Atomically writes the completed batch numbers to the checkpoint file."""
+    if not path:
+        return
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump({"batch_size": batch_size, "completed": sorted(completed)}, file)
+    os.replace(temporary_path, path)
@@ -0,0 +1,69 @@
+"""Runs queued agent turns from the database-backed task queue.
+
+Start one or more of these alongside the web server when AGENT_TASK_MODE is
+"worker". Each claims queued tasks and runs them in a pool of threads, so the
+web processes never wait on the LLM.
+
+Typical usage example:
+
+    python manage.py run_agent_worker --workers 4
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from chat.tasks import claim_next, run_task, sweep_stale_tasks
+
+
+class Command(BaseCommand):
+    help = "Runs queued agent turns."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=settings.AGENT_TASK_WORKERS, help="Number of turns run concurrently.")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty instead of waiting for more tasks.")
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        if workers < 1:
+            raise CommandError("--workers must be at least 1.")
+
+        if workers == 1:
+            # Run tasks in this thread, which keeps --once runs deterministic
+            self._run_inline(options["poll_interval"], options["once"])
+            return
+
+        pending = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-worker") as executor:
+            while True:
+                self._sweep()
+                while len(pending) < workers:
+                    task_id = claim_next()
+                    if task_id is None:
+                        break
+                    pending.add(executor.submit(run_task, task_id, claimed=True))
+                if options["once"] and not pending:
+                    break
+                if pending:
+                    # Wake up as soon as a slot frees, but keep polling for new tasks
+                    pending = wait(pending, timeout=options["poll_interval"], return_when=FIRST_COMPLETED).not_done
+                else:
+                    time.sleep(options["poll_interval"])
+
+    def _sweep(self):
+        """Fails the tasks abandoned by stopped workers, at most every AGENT_TASK_SWEEP_INTERVAL seconds."""
+        stale = sweep_stale_tasks()
+        if stale:
+            self.stdout.write(f"Marked {stale} abandoned tasks as failed.")
+
+    def _run_inline(self, poll_interval, once):
+        """Claims and runs one task at a time."""
+        while True:
+            self._sweep()
+            task_id = claim_next()
+            if task_id is not None:
+                run_task(task_id, claimed=True)
+            elif once:
+                return
+            else:
+                time.sleep(poll_interval)
@@ -0,0 +1,108 @@
+"""This module contains the Python-Markdown extension that styles rendered messages.
+
+BlockClassExtension adds Tailwind's `mb-4` margin to every block element except
+the last, so consecutive paragraphs, lists and code blocks are spaced apart, and
+can give unlabelled code a default `language-*` class for Prism. It does this
+while the document is rendered instead of re-parsing the HTML afterwards.
+
+Typical usage example:
+
+    html = markdown.markdown(text, extensions=['fenced_code', BlockClassExtension()])
+"""
+import re
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from markdown.util import HTML_PLACEHOLDER_RE
+
+BLOCK_TAGS = {'p', 'pre', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'blockquote', 'hr', 'li'}
+
+MARGIN_CLASS = 'mb-4'
+
+# Fenced code blocks are stashed as raw HTML; these match the tags they start with
+STASHED_PRE_RE = re.compile(r'^<pre\b[^>]*>')
+STASHED_CODE_RE = re.compile(r'<code>')
+CLASS_ATTRIBUTE_RE = re.compile(r'\bclass="([^"]*)"')
+
+
+class BlockClassTreeprocessor(Treeprocessor):
+    """Adds the margin and language classes to the element tree.
+
+    Attributes:
+        default_language: A string used as the `language-*` class of code elements
+                          without one, or an empty string to leave them unlabelled.
+    """
+    def __init__(self, md, default_language=''):
+        super().__init__(md)
+        self.default_language = default_language
+
+    def run(self, root):
+        blocks = []
+        for element in root.iter():
+            if element is root:
+                continue
+            stash_index = self._stash_index(element)
+            if stash_index is not None:
+                # Fenced code was rendered before the tree was built and is stashed as HTML
+                if self._is_stashed_code_block(stash_index):
+                    blocks.append(stash_index)
+            elif element.tag in BLOCK_TAGS:
+                blocks.append(element)
+            elif element.tag == 'code' and self.default_language and 'class' not in element.attrib:
+                element.set('class', f'language-{self.default_language}')
+
+        # Only add margin if there are multiple block elements
+        if len(blocks) > 1:
+            for block in blocks[:-1]:  # Exclude the last element
+                if isinstance(block, int):
+                    self._add_stashed_margin(block)
+                else:
+                    block.set('class', f"{block.get('class', '')} {MARGIN_CLASS}".lstrip())
+
+    def _stash_index(self, element):
+        """Returns the stash index of a paragraph holding only a raw HTML placeholder, or None.
+
+        Raw HTML, including fenced code, is left in the tree as such a paragraph and
+        swapped for the stashed HTML at the end. The paragraph must stay unchanged for
+        the swap to happen, so classes are added to the stashed HTML instead.
+        """
+        if element.tag != 'p' or len(element) or element.attrib:
+            return None
+        match = HTML_PLACEHOLDER_RE.fullmatch((element.text or '').strip())
+        return int(match.group(1)) if match else None
+
+    def _is_stashed_code_block(self, index):
+        """Checks if stashed HTML is a fenced code block, labelling its code if needed.
+
+        Other raw HTML written in a message is passed through untouched.
+        """
+        html = self.md.htmlStash.rawHtmlBlocks[index]
+        if not isinstance(html, str) or not STASHED_PRE_RE.match(html):
+            return False
+        if self.default_language:
+            self.md.htmlStash.rawHtmlBlocks[index] = STASHED_CODE_RE.sub(
+                f'<code class="language-{self.default_language}">', html, count=1
+            )
+        return True
+
+    def _add_stashed_margin(self, index):
+        """Adds the margin class to the opening `<pre>` tag of a stashed code block."""
+        html = self.md.htmlStash.rawHtmlBlocks[index]
+        opening_tag = STASHED_PRE_RE.match(html).group(0)
+        if CLASS_ATTRIBUTE_RE.search(opening_tag):
+            new_tag = CLASS_ATTRIBUTE_RE.sub(rf'class="\1 {MARGIN_CLASS}"', opening_tag, count=1)
+        else:
+            new_tag = f'{opening_tag[:-1]} class="{MARGIN_CLASS}">'
+        self.md.htmlStash.rawHtmlBlocks[index] = new_tag + html[len(opening_tag):]
+
+
+class BlockClassExtension(Extension):
+    """Registers BlockClassTreeprocessor with a Markdown instance."""
+    def __init__(self, **kwargs):
+        self.config = {
+            'default_language': ['', 'Language class given to code elements without one.'],
+        }
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        # Priority 15 runs after the inline processor (20), so inline code elements exist
+        md.treeprocessors.register(BlockClassTreeprocessor(md, self.getConfig('default_language')), 'block_class', 15)
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:47
+
+import chat.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_auto_20231203_0630'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='customuser',
+            managers=[
+                ('objects', chat.models.CustomUserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='summarized_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_thread_summary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['thread', 'timestamp'], name='chat_message_thread_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='thread',
+            index=models.Index(fields=['user', '-created_at'], name='chat_thread_user_created_idx'),
+        ),
+    ]
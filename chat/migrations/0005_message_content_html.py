@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_html',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
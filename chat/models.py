@@ -42,6 +42,14 @@ class Thread(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     name = models.CharField(max_length=200, default='New Thread')
     created_at = models.DateTimeField(default=timezone.now)  # Add this field
+    summary = models.TextField(blank=True, default='')  # Rolling summary of messages outside the agent's history window
+    summarized_message_id = models.BigIntegerField(null=True, blank=True)  # Newest message included in the summary
+
+    class Meta:
+        indexes = [
+            # Covers the sidebar's threads-by-user, newest first
+            models.Index(fields=['user', '-created_at'], name='chat_thread_user_created_idx'),
+        ]
 
 
 class Message(models.Model):
@@ -55,4 +63,40 @@ class Message(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     content = models.TextField()
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='user')
-    timestamp = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    timestamp = models.DateTimeField(auto_now_add=True)
+    content_html = models.TextField(blank=True, default='')  # Content rendered from markdown once, when first needed
+
+    class Meta:
+        indexes = [
+            # Covers loading a thread's messages in timestamp order
+            models.Index(fields=['thread', 'timestamp'], name='chat_message_thread_ts_idx'),
+        ]
+
+
+class AgentTask(models.Model):
+    # An agent turn run off the request thread, see chat/tasks.py
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE)
+    content = models.TextField()  # The user's message
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    reply_html = models.TextField(blank=True, default='')  # Rendered rows of the turn's messages
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Covers workers claiming the oldest queued task
+            models.Index(fields=['status', 'created_at'], name='chat_agenttask_status_idx'),
+        ]
@@ -0,0 +1,205 @@
+"""This module limits how fast and how concurrently each user may call the passthrough API.
+
+Every user gets a token bucket, which bounds their request rate while allowing
+short bursts, and a cap on their requests in flight. The limits come from
+PASSTHROUGH_RATE_LIMITS, a "default" entry that can be overridden per group
+under "groups" and per user email under "users":
+
+    {
+        "default": {"requests_per_minute": 60, "burst": 10, "concurrency": 2},
+        "groups": {"staff": {"requests_per_minute": 600, "concurrency": 8}},
+        "users": {"grader@example.com": {"concurrency": 16}}
+    }
+
+A limit left out of an entry is not enforced, except "burst", the number of
+requests that may be made at once after a pause, which defaults to 1. The
+counters are kept in a SQLite file, so every worker process on the host enforces
+the same limits. A request in flight holds a lease that is released when its
+response ends. Leases expire after PASSTHROUGH_LEASE_SECONDS, so a worker that
+dies mid-request cannot hold a slot for ever.
+
+Typical usage example:
+
+    try:
+        lease = acquire_slot(request.user)
+    except RateLimitExceeded as e:
+        return too_many_requests(e.retry_after)
+    try:
+        ...
+    finally:
+        release_slot(lease)
+"""
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from django.conf import settings
+
+# Seconds a client is asked to wait when all of its concurrent slots are taken
+CONCURRENCY_RETRY_AFTER = 1
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request exceeds its user's rate or concurrency limit.
+
+    Attributes:
+        retry_after: The number of seconds after which the request may succeed.
+    """
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limit exceeded, retry after {retry_after:.1f} seconds")
+        self.retry_after = retry_after
+
+
+def acquire_slot(user):
+    """Admits a passthrough request from user.
+
+    Args:
+        user: The authenticated user making the request.
+
+    Returns:
+        A lease to pass to `release_slot` when the request ends, or None if the user's
+        concurrency is not limited.
+
+    Raises:
+        RateLimitExceeded: If the user has no tokens left or no free concurrent slot.
+    """
+    limits = limits_for(user)
+    if not limits:
+        return None
+    return get_limiter().acquire(user.pk, limits)
+
+
+def release_slot(lease):
+    """Frees the concurrent slot held by a lease from `acquire_slot`."""
+    if lease is not None:
+        get_limiter().release(lease)
+
+
+def limits_for(user):
+    """Returns the limits that apply to user: their own, their first listed group's, or the default.
+
+    Returns:
+        A dictionary of limits, empty if the user is not limited.
+    """
+    config = settings.PASSTHROUGH_RATE_LIMITS
+    if not config:
+        return {}
+    user_limits = config.get("users", {}).get(user.get_username())
+    if user_limits is not None:
+        return user_limits
+    group_limits = config.get("groups", {})
+    if group_limits:
+        user_groups = set(user.groups.values_list("name", flat=True))
+        for group, limits in group_limits.items():
+            if group in user_groups:
+                return limits
+    return config.get("default", {})
+
+
+def get_limiter():
+    """Returns the process's limiter for PASSTHROUGH_RATE_LIMIT_PATH, creating it on first use."""
+    global _limiter
+    path = settings.PASSTHROUGH_RATE_LIMIT_PATH
+    if _limiter is None or _limiter.path != path:
+        with _limiter_lock:
+            if _limiter is None or _limiter.path != path:
+                _limiter = RateLimiter(path, lease_seconds=settings.PASSTHROUGH_LEASE_SECONDS)
+    return _limiter
+
+
+class RateLimiter:
+    """Per-user token buckets and concurrency leases stored in a SQLite file.
+
+    Each admission runs in a `BEGIN IMMEDIATE` transaction, which takes the file's
+    write lock up front, so concurrent requests from any number of processes are
+    admitted one at a time and never overspend a bucket.
+
+    Attributes:
+        path: The path to the SQLite file.
+        lease_seconds: The number of seconds after which an unreleased lease expires.
+    """
+    def __init__(self, path, lease_seconds=600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (user_id INTEGER PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS leases (id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, expires REAL NOT NULL)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS leases_user ON leases (user_id, expires)")
+
+    def acquire(self, user_id, limits):
+        """Takes a token and a concurrent slot for a user.
+
+        Args:
+            user_id: The id of the user.
+            limits: A dictionary of the user's "requests_per_minute", "burst" and
+                    "concurrency" limits. Missing limits are not enforced.
+
+        Returns:
+            The lease holding the slot, or None if concurrency is not limited.
+
+        Raises:
+            RateLimitExceeded: If the bucket is empty or every concurrent slot is taken.
+        """
+        now = time.time()
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            concurrency = limits.get("concurrency")
+            if concurrency is not None:
+                connection.execute("DELETE FROM leases WHERE user_id = ? AND expires < ?", (user_id, now))
+                (active,) = connection.execute("SELECT COUNT(*) FROM leases WHERE user_id = ?", (user_id,)).fetchone()
+                if active >= concurrency:
+                    raise RateLimitExceeded(CONCURRENCY_RETRY_AFTER)
+
+            requests_per_minute = limits.get("requests_per_minute")
+            if requests_per_minute is not None:
+                self._take_token(connection, user_id, now, requests_per_minute / 60, limits.get("burst", 1))
+
+            lease = None
+            if concurrency is not None:
+                lease = uuid.uuid4().hex
+                connection.execute(
+                    "INSERT INTO leases (id, user_id, expires) VALUES (?, ?, ?)",
+                    (lease, user_id, now + self.lease_seconds)
+                )
+            connection.execute("COMMIT")
+            return lease
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def release(self, lease):
+        """Frees the concurrent slot held by a lease from `acquire`."""
+        self._connection().execute("DELETE FROM leases WHERE id = ?", (lease,))
+
+    def _take_token(self, connection, user_id, now, rate, burst):
+        """Refills the user's bucket at rate tokens per second up to burst, then takes one token."""
+        row = connection.execute("SELECT tokens, updated FROM buckets WHERE user_id = ?", (user_id,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+        if tokens < 1:
+            raise RateLimitExceeded((1 - tokens) / rate if rate > 0 else self.lease_seconds)
+        connection.execute(
+            "INSERT OR REPLACE INTO buckets (user_id, tokens, updated) VALUES (?, ?, ?)",
+            (user_id, tokens - 1, now)
+        )
+
+    def _connection(self):
+        """Returns this thread's connection to the SQLite file."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
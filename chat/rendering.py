@@ -0,0 +1,53 @@
+"""This module renders message content from markdown to HTML.
+
+Message content never changes after it is saved, so its HTML is rendered once
+and stored in Message.content_html instead of on every page load. The Agent
+renders messages as it saves them, and render_messages fills in messages saved
+before the column existed.
+
+Typical usage example:
+
+    html = render_markdown("**Taco Palenque** is open late.")
+    render_messages(messages)
+"""
+import threading
+import markdown
+from .markdown_extensions import BlockClassExtension
+from .models import Message
+
+_local = threading.local()  # Markdown instances are reusable but not thread-safe
+
+
+def render_markdown(content, default_language=''):
+    """Returns the HTML shown for a message's markdown content.
+
+    Args:
+        content: A string containing markdown.
+        default_language: A string used as the `language-*` class of code without one.
+
+    Returns:
+        A string containing the rendered HTML.
+    """
+    renderers = _local.__dict__.setdefault('renderers', {})
+    renderer = renderers.get(default_language)
+    if renderer is None:
+        renderer = markdown.Markdown(extensions=['fenced_code', BlockClassExtension(default_language=default_language)])
+        renderers[default_language] = renderer
+    return renderer.reset().convert(content)
+
+
+def render_messages(messages):
+    """Renders and saves the HTML of any messages that do not have it yet.
+
+    Args:
+        messages: A list of Message instances. Their content_html is set in place.
+    """
+    rendered = []
+    for message in messages:
+        if not message.content_html:
+            message.content_html = render_markdown(message.content)
+            # Content that renders to nothing would be rendered and saved again on every load
+            if message.content_html:
+                rendered.append(message)
+    if rendered:
+        Message.objects.bulk_update(rendered, ['content_html'])
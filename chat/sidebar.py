@@ -0,0 +1,61 @@
+"""This module builds the pages of threads shown in the sidebar.
+
+The first page is rendered on almost every request, so it is cached per user
+and invalidated whenever one of the user's threads is created, renamed or
+deleted (see chat.signals). Only the fields the sidebar shows are fetched.
+
+Typical usage example:
+
+    page = get_sidebar_page(request.user)
+    page["threads"], page["has_more"], page["next_offset"]
+"""
+from django.conf import settings
+from django.core.cache import cache
+from .models import Thread
+
+
+def sidebar_cache_key(user_id):
+    """Returns the cache key of a user's first sidebar page."""
+    return f"sidebar_threads:{user_id}"
+
+
+def get_sidebar_page(user, offset=0):
+    """Returns a page of the user's threads, newest first.
+
+    Args:
+        user: The user whose threads are listed.
+        offset: The number of threads to skip. Only the first page is cached.
+
+    Returns:
+        A dictionary with "threads", a list of {"id", "name"} dictionaries, "has_more",
+        a boolean indicating if older threads exist, and "next_offset", the offset of
+        the next page.
+    """
+    if offset:
+        return _fetch_page(user.pk, offset)
+    key = sidebar_cache_key(user.pk)
+    page = cache.get(key)
+    if page is None:
+        page = _fetch_page(user.pk, offset)
+        cache.set(key, page, settings.SIDEBAR_CACHE_TTL)
+    return page
+
+
+def invalidate_sidebar(user_id):
+    """Drops a user's cached sidebar page."""
+    cache.delete(sidebar_cache_key(user_id))
+
+
+def _fetch_page(user_id, offset):
+    """Queries one page of threads, fetching one extra row to tell if there are more."""
+    page_size = settings.SIDEBAR_THREADS_PAGE_SIZE
+    threads = list(
+        Thread.objects.filter(user_id=user_id)
+        .order_by('-created_at')
+        .values('id', 'name')[offset:offset + page_size + 1]
+    )
+    return {
+        "threads": threads[:page_size],
+        "has_more": len(threads) > page_size,
+        "next_offset": offset + page_size,
+    }
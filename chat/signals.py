@@ -0,0 +1,29 @@
+# chat/signals.py
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from .models import Thread
+from .sidebar import invalidate_sidebar
+from .token_cache import invalidate_token, invalidate_user_tokens
+
+# The user fields that decide whether a bearer token may still authenticate
+TOKEN_USER_FIELDS = {'is_active', 'password', 'email'}
+
+@receiver(post_save, sender=Thread)
+@receiver(post_delete, sender=Thread)
+def invalidate_thread_list(sender, instance, **kwargs):
+    # A thread was created, renamed or deleted, so the owner's cached sidebar is stale
+    invalidate_sidebar(instance.user_id)
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_api_token(sender, instance, **kwargs):
+    # A token was created, rotated or revoked
+    invalidate_token(instance.key)
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_api_tokens(sender, instance, update_fields=None, **kwargs):
+    # Saves such as the last_login update on every login leave the user's tokens valid
+    if update_fields is None or TOKEN_USER_FIELDS.intersection(update_fields):
+        invalidate_user_tokens(instance.pk)
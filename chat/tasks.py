@@ -0,0 +1,170 @@
+"""This module runs agent turns off the request thread using a database-backed queue.
+
+A turn is stored as an AgentTask row and the view returns immediately; the page
+polls the task's status until the reply is ready. How queued tasks are run is
+set by AGENT_TASK_MODE:
+
+    "thread"  a pool of threads inside each web process runs them
+    "worker"  the run_agent_worker management command runs them, so web processes
+              only enqueue
+
+No broker is needed: tasks are claimed with a conditional UPDATE, so any number
+of threads and worker processes can share the queue without running a task twice.
+
+Typical usage example:
+
+    task = enqueue(thread, "Where can I get tacos?")
+    ...
+    run_task(task.pk)
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+from .ai.agent import Agent
+from .ai.answer_cache import get_answer_cache
+from .models import AgentTask
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_last_sweep = None
+_sweep_lock = threading.Lock()
+
+
+def enqueue(thread, content):
+    """Queues an agent turn for a thread.
+
+    Args:
+        thread: The Thread the user's message belongs to.
+        content: A string containing the user's message.
+
+    Returns:
+        The queued AgentTask.
+    """
+    task = AgentTask.objects.create(thread=thread, content=content)
+    if settings.AGENT_TASK_MODE == 'thread':
+        # Wait for the commit so the pool's own connection can see the task
+        transaction.on_commit(lambda: get_executor().submit(run_task, task.pk))
+    return task
+
+
+def get_executor():
+    """Returns the process's task thread pool, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.AGENT_TASK_WORKERS, thread_name_prefix='agent-task'
+                )
+    return _executor
+
+
+def claim(task_id):
+    """Marks a queued task as running.
+
+    Returns:
+        A boolean indicating if this caller claimed the task. False means another
+        thread or worker claimed it first.
+    """
+    return AgentTask.objects.filter(pk=task_id, status=AgentTask.QUEUED).update(
+        status=AgentTask.RUNNING, started_at=timezone.now()
+    ) == 1
+
+
+def claim_next():
+    """Claims the oldest queued task.
+
+    Returns:
+        The id of the claimed task, or None if the queue is empty.
+    """
+    while True:
+        task_id = (
+            AgentTask.objects.filter(status=AgentTask.QUEUED)
+            .order_by('created_at', 'id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        if task_id is None:
+            return None
+        if claim(task_id):
+            return task_id
+
+
+def run_task(task_id, claimed=False):
+    """Runs an agent turn and records its outcome on the task.
+
+    Args:
+        task_id: The id of the AgentTask to run.
+        claimed: A boolean indicating if the caller has already claimed the task.
+    """
+    try:
+        if not claimed:
+            sweep_stale_tasks()
+            if not claim(task_id):
+                return
+        task = AgentTask.objects.select_related('thread__user').get(pk=task_id)
+        try:
+            agent = Agent(thread=task.thread, answer_cache=get_answer_cache())
+            agent.chat(task.content)
+        except Exception as e:
+            logger.exception("Agent task %s failed", task_id)
+            AgentTask.objects.filter(pk=task_id).update(
+                status=AgentTask.FAILED, error=repr(e), finished_at=timezone.now()
+            )
+            return
+        AgentTask.objects.filter(pk=task_id).update(
+            status=AgentTask.DONE,
+            reply_html=render_to_string('chat/messages.html', {'messages': agent.new_messages}),
+            finished_at=timezone.now(),
+        )
+    finally:
+        close_old_connections()  # Pool threads outlive requests, so clean up like a request would
+
+
+def fail_stale_tasks():
+    """Marks tasks left running or queued longer than AGENT_TASK_STALE_SECONDS as failed.
+
+    Running tasks were claimed by a process that stopped before finishing them. They
+    are not retried because the turn may already have added messages to the thread.
+    Queued tasks were lost with the process whose thread pool they were submitted to,
+    or no worker has been running to claim them; by now their page has stopped waiting.
+
+    Returns:
+        The number of tasks marked as failed.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.AGENT_TASK_STALE_SECONDS)
+    abandoned = AgentTask.objects.filter(status=AgentTask.RUNNING, started_at__lt=cutoff).update(
+        status=AgentTask.FAILED, error='The task was abandoned by its worker.', finished_at=now
+    )
+    orphaned = AgentTask.objects.filter(status=AgentTask.QUEUED, created_at__lt=cutoff).update(
+        status=AgentTask.FAILED, error='The task was never run.', finished_at=now
+    )
+    return abandoned + orphaned
+
+
+def sweep_stale_tasks():
+    """Runs `fail_stale_tasks` if this process has not for AGENT_TASK_SWEEP_INTERVAL seconds.
+
+    Called before claiming tasks, so abandoned tasks are failed while the processes
+    that run tasks stay up, not only when a worker starts.
+
+    Returns:
+        The number of tasks marked as failed, 0 if the sweep was skipped.
+    """
+    global _last_sweep
+    with _sweep_lock:
+        now = time.monotonic()
+        if _last_sweep is not None and now - _last_sweep < settings.AGENT_TASK_SWEEP_INTERVAL:
+            return 0
+        _last_sweep = now
+    return fail_stale_tasks()
@@ -1,4 +1,14 @@
 import vcr
+import requests
+import json
+import asyncio
+import tempfile
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from chat.views import async_openai_api_chat_completions_passthrough
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APITestCase
@@ -34,4 +44,296 @@ class OpenAIAPITest(APITestCase):
         self.assertEqual(response.status_code, 200)
 
         # Assert that the response data is as expected
-        self.assertIn('choices', response.data)
\ No newline at end of file
+        self.assertIn('choices', response.data)
+
+    @patch('chat.views.get_session')
+    def test_openai_api_chat_completions_passthrough_streaming(self, mock_get_session):
+        mock_post = mock_get_session.return_value.post
+        chunks = [
+            b'data: {"choices": [{"index": 0, "delta": {"content": "The Los Angeles"}}]}\n\n',
+            b'data: {"choices": [{"index": 0, "delta": {"content": " Dodgers"}}]}\n\n',
+            b'data: [DONE]\n\n',
+        ]
+        mock_post.return_value = MagicMock(
+            status_code=200,
+            headers={"Content-Type": "text/event-stream"},
+            iter_content=MagicMock(return_value=iter(chunks)),
+        )
+
+        request_data = {
+            "messages": [{"role": "user", "content": "Who won the world series in 2020?"}],
+            "model": "gpt-3.5-turbo",
+            "stream": True
+        }
+
+        response = self.client.post(
+            self.api_url,
+            request_data,
+            format='json',
+            HTTP_AUTHORIZATION='Bearer ' + self.token.key
+        )
+
+        # Assert that the upstream events are relayed unchanged and the upstream request is streamed
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(b''.join(response.streaming_content), b''.join(chunks))
+        self.assertTrue(mock_post.call_args.kwargs['stream'])
+        mock_post.return_value.close.assert_called_once()
+
+    @patch('chat.views.get_session')
+    def test_openai_api_chat_completions_passthrough_timeout(self, mock_get_session):
+        mock_get_session.return_value.post.side_effect = requests.exceptions.ReadTimeout()
+
+        response = self.client.post(
+            self.api_url,
+            {"messages": [{"role": "user", "content": "Hi"}], "model": "gpt-3.5-turbo"},
+            format='json',
+            HTTP_AUTHORIZATION='Bearer ' + self.token.key
+        )
+
+        # Assert that a stuck upstream is reported as a gateway timeout
+        self.assertEqual(response.status_code, 504)
+
+COMPLETION_CACHE_SETTINGS = {
+    'CACHES': {
+        'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        'completions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    },
+    'PASSTHROUGH_CACHE_TTL': 60,
+}
+
+@override_settings(**COMPLETION_CACHE_SETTINGS)
+class CompletionCacheAPITest(APITestCase):
+    def setUp(self):
+        caches['completions'].clear()
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.token = Token.objects.create(user=self.user)
+        self.api_url = reverse('openai_api_chat_completions_passthrough')
+        self.request_data = {
+            "messages": [{"role": "user", "content": "Who won the world series in 2020?"}],
+            "model": "gpt-3.5-turbo",
+            "temperature": 0
+        }
+
+    def post(self, request_data, token=None):
+        return self.client.post(
+            self.api_url, request_data, format='json', HTTP_AUTHORIZATION='Bearer ' + (token or self.token).key
+        )
+
+    @patch('chat.views.get_session')
+    def test_repeated_deterministic_request_is_served_from_cache(self, mock_get_session):
+        mock_post = mock_get_session.return_value.post
+        mock_post.return_value = MagicMock(status_code=200, json=MagicMock(return_value={"choices": ["Dodgers"]}))
+
+        first = self.post(self.request_data)
+        second = self.post(dict(reversed(list(self.request_data.items()))))
+
+        self.assertEqual(first['X-Completion-Cache'], 'MISS')
+        self.assertEqual(second['X-Completion-Cache'], 'HIT')
+        self.assertEqual(second.data, {"choices": ["Dodgers"]})
+        mock_post.assert_called_once()
+
+    @patch('chat.views.get_session')
+    def test_cache_is_scoped_per_user(self, mock_get_session):
+        mock_post = mock_get_session.return_value.post
+        mock_post.return_value = MagicMock(status_code=200, json=MagicMock(return_value={"choices": []}))
+        other_user = get_user_model().objects.create_user(email='otheruser@test.com', password='12345')
+
+        self.post(self.request_data)
+        response = self.post(self.request_data, token=Token.objects.create(user=other_user))
+
+        self.assertEqual(response['X-Completion-Cache'], 'MISS')
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('chat.views.get_session')
+    def test_errors_and_nondeterministic_requests_are_not_cached(self, mock_get_session):
+        mock_post = mock_get_session.return_value.post
+        mock_post.return_value = MagicMock(status_code=429, json=MagicMock(return_value={"error": {}}))
+        self.post(self.request_data)
+        self.assertEqual(self.post(self.request_data)['X-Completion-Cache'], 'MISS')
+
+        response = self.post({**self.request_data, "temperature": 1})
+        self.assertNotIn('X-Completion-Cache', response)
+        self.assertEqual(mock_post.call_count, 3)
+
+class RateLimitAPITest(APITestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        rate_limit_settings = override_settings(
+            PASSTHROUGH_RATE_LIMITS={"default": {"requests_per_minute": 60, "burst": 2, "concurrency": 1}},
+            PASSTHROUGH_RATE_LIMIT_PATH=str(Path(directory.name) / 'rate_limits.sqlite3'),
+        )
+        rate_limit_settings.enable()
+        self.addCleanup(rate_limit_settings.disable)
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.token = Token.objects.create(user=self.user)
+        self.api_url = reverse('openai_api_chat_completions_passthrough')
+
+    def post(self, request_data):
+        return self.client.post(self.api_url, request_data, format='json', HTTP_AUTHORIZATION='Bearer ' + self.token.key)
+
+    @patch('chat.views.get_session')
+    def test_requests_over_the_rate_are_rejected(self, mock_get_session):
+        mock_get_session.return_value.post.return_value = MagicMock(status_code=200, json=MagicMock(return_value={"choices": []}))
+        request_data = {"messages": [{"role": "user", "content": "Hi"}], "model": "gpt-3.5-turbo"}
+
+        self.assertEqual(self.post(request_data).status_code, 200)
+        self.assertEqual(self.post(request_data).status_code, 200)
+        response = self.post(request_data)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(mock_get_session.return_value.post.call_count, 2)
+
+    @patch('chat.views.get_session')
+    def test_stream_holds_its_slot_until_it_ends(self, mock_get_session):
+        mock_get_session.return_value.post.return_value = MagicMock(
+            status_code=200,
+            headers={"Content-Type": "text/event-stream"},
+            iter_content=MagicMock(return_value=iter([b'data: [DONE]\n\n'])),
+        )
+        request_data = {"messages": [{"role": "user", "content": "Hi"}], "model": "gpt-3.5-turbo", "stream": True}
+
+        streaming = self.post(request_data)
+        self.assertEqual(self.post(request_data).status_code, 429)  # The first stream is still open
+
+        b''.join(streaming.streaming_content)
+        streaming.close()
+        self.assertEqual(self.post(request_data).status_code, 200)
+
+    @patch('chat.views.get_session')
+    def test_unread_stream_is_released_when_closed(self, mock_get_session):
+        upstream = MagicMock(status_code=200, headers={"Content-Type": "text/event-stream"})
+        mock_get_session.return_value.post.return_value = upstream
+        request_data = {"messages": [{"role": "user", "content": "Hi"}], "model": "gpt-3.5-turbo", "stream": True}
+
+        # The client disconnects before the relay sends anything
+        self.post(request_data).close()
+
+        upstream.close.assert_called_once()
+        upstream.iter_content.assert_not_called()
+        self.assertEqual(self.post(request_data).status_code, 200)
+
+    @patch('chat.views.get_session')
+    def test_slot_is_released_on_upstream_error(self, mock_get_session):
+        mock_get_session.return_value.post.side_effect = requests.exceptions.ReadTimeout()
+        request_data = {"messages": [{"role": "user", "content": "Hi"}], "model": "gpt-3.5-turbo", "stream": True}
+
+        self.assertEqual(self.post(request_data).status_code, 504)
+        self.assertEqual(self.post(request_data).status_code, 504)
+
+class AsyncOpenAIAPITest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.token = Token.objects.create(user=self.user)
+        self.api_url = reverse('openai_api_chat_completions_passthrough')
+        self.factory = AsyncRequestFactory()
+        self.request_data = {
+            "messages": [{"role": "user", "content": "Who won the world series in 2020?"}],
+            "model": "gpt-3.5-turbo"
+        }
+
+    @patch('chat.views.apost', new_callable=AsyncMock)
+    async def test_async_passthrough(self, mock_apost):
+        mock_apost.return_value = MagicMock(status=200, json=AsyncMock(return_value={"choices": []}))
+        request = self.factory.post(
+            self.api_url,
+            json.dumps(self.request_data),
+            content_type='application/json',
+            headers={'Authorization': 'Bearer ' + self.token.key}
+        )
+
+        response = await async_openai_api_chat_completions_passthrough(request)
+
+        # Assert that the upstream JSON is returned and the connection is released
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('choices', json.loads(response.content))
+        self.assertEqual(mock_apost.call_args.kwargs['json'], self.request_data)
+        mock_apost.return_value.release.assert_called_once()
+
+    async def test_async_passthrough_requires_token(self):
+        request = self.factory.post(self.api_url, json.dumps(self.request_data), content_type='application/json')
+
+        response = await async_openai_api_chat_completions_passthrough(request)
+        self.assertEqual(response.status_code, 403)
+
+    async def test_async_passthrough_rejects_unknown_token(self):
+        request = self.factory.post(
+            self.api_url,
+            json.dumps(self.request_data),
+            content_type='application/json',
+            headers={'Authorization': 'Bearer not-a-token'}
+        )
+
+        response = await async_openai_api_chat_completions_passthrough(request)
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(**COMPLETION_CACHE_SETTINGS)
+    @patch('chat.views.apost', new_callable=AsyncMock)
+    async def test_async_passthrough_cache(self, mock_apost):
+        caches['completions'].clear()
+        mock_apost.return_value = MagicMock(status=200, json=AsyncMock(return_value={"choices": ["Dodgers"]}))
+        request_data = {**self.request_data, "temperature": 0}
+
+        responses = []
+        for _ in range(2):
+            request = self.factory.post(
+                self.api_url,
+                json.dumps(request_data),
+                content_type='application/json',
+                headers={'Authorization': 'Bearer ' + self.token.key}
+            )
+            responses.append(await async_openai_api_chat_completions_passthrough(request))
+
+        self.assertEqual([response['X-Completion-Cache'] for response in responses], ['MISS', 'HIT'])
+        self.assertEqual(json.loads(responses[1].content), {"choices": ["Dodgers"]})
+        mock_apost.assert_awaited_once()
+
+    @patch('chat.views.apost', new_callable=AsyncMock)
+    async def test_async_passthrough_rate_limit(self, mock_apost):
+        mock_apost.return_value = MagicMock(status=200, json=AsyncMock(return_value={"choices": []}))
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                PASSTHROUGH_RATE_LIMITS={"default": {"requests_per_minute": 60, "burst": 1, "concurrency": 1}},
+                PASSTHROUGH_RATE_LIMIT_PATH=str(Path(directory) / 'rate_limits.sqlite3'),
+            ):
+                statuses = []
+                for _ in range(2):
+                    request = self.factory.post(
+                        self.api_url,
+                        json.dumps(self.request_data),
+                        content_type='application/json',
+                        headers={'Authorization': 'Bearer ' + self.token.key}
+                    )
+                    response = await async_openai_api_chat_completions_passthrough(request)
+                    statuses.append(response.status_code)
+
+        self.assertEqual(statuses, [200, 429])
+        self.assertEqual(response['Retry-After'], '1')
+        mock_apost.assert_awaited_once()
+
+    @patch('chat.views.apost', new_callable=AsyncMock)
+    async def test_async_unread_stream_is_released_when_closed(self, mock_apost):
+        mock_apost.return_value = MagicMock(status=200, headers={"Content-Type": "text/event-stream"})
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                PASSTHROUGH_RATE_LIMITS={"default": {"requests_per_minute": 60, "burst": 2, "concurrency": 1}},
+                PASSTHROUGH_RATE_LIMIT_PATH=str(Path(directory) / 'rate_limits.sqlite3'),
+            ):
+                statuses = []
+                for _ in range(2):
+                    request = self.factory.post(
+                        self.api_url,
+                        json.dumps({**self.request_data, "stream": True}),
+                        content_type='application/json',
+                        headers={'Authorization': 'Bearer ' + self.token.key}
+                    )
+                    response = await async_openai_api_chat_completions_passthrough(request)
+                    statuses.append(response.status_code)
+                    # The client disconnects before the relay sends anything
+                    await sync_to_async(response.close)()
+                    await asyncio.sleep(0)
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(mock_apost.return_value.release.call_count, 2)
@@ -1,8 +1,18 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from chat.models import Thread, Message
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404
+from chat.ai.agent import Agent
+from chat.models import AgentTask, Thread, Message
+from chat.tasks import run_task
 import vcr
+import json
+from unittest.mock import AsyncMock, patch
+from django.test import AsyncRequestFactory
+from chat.views import async_new_message
+from chat.http_client import aclose_async_session
+from openai.openai_object import OpenAIObject
 
 class MessageIntegrationTestCase(TestCase):
     def setUp(self):
@@ -27,6 +37,130 @@ class MessageIntegrationTestCase(TestCase):
         ).exists()
         self.assertTrue(message_exists)  # Message should exist in the database and be associated with the correct user and thread
 
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_message_creation_streaming(self, mock_create):
+        mock_create.return_value = iter([
+            OpenAIObject.construct_from({"choices": [{"index": 0, "delta": {"content": content}}]})
+            for content in ["Hello", "! How can I help?"]
+        ])
+
+        # Test that the reply is streamed as Server-Sent Events when requested
+        response = self.client.post(
+            reverse('new_message', kwargs={'pk': self.thread.pk}),
+            {'content': 'Hello, World!'},
+            HTTP_ACCEPT='text/event-stream'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+
+        deltas = [json.loads(line[len('data: '):]).get('delta') for line in body.splitlines() if line.startswith('data: ')]
+        self.assertEqual(deltas[:2], ['Hello', '! How can I help?'])
+        self.assertIn('event: done', body)
+
+        # The done event carries the rendered rows of the new messages
+        done = json.loads(body.split('event: done\ndata: ')[1].split('\n')[0])
+        self.assertIn('<p>Hello, World!</p>', done['html'])
+        self.assertIn('<p>Hello! How can I help?</p>', done['html'])
+
+        # Check that both sides of the conversation were persisted once the stream completed
+        self.assertTrue(Message.objects.filter(content='Hello, World!', role='user', thread=self.thread).exists())
+        self.assertTrue(Message.objects.filter(content='Hello! How can I help?', role='assistant', thread=self.thread).exists())
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_message_creation_streaming_hides_tool_calls(self, mock_create):
+        mock_create.side_effect = [
+            iter([
+                OpenAIObject.construct_from({"choices": [{"index": 0, "delta": {"content": content}}]})
+                for content in ["Tool: search_food", '("tacos")']
+            ]),
+            iter([OpenAIObject.construct_from({"choices": [{"index": 0, "delta": {"content": "Try Taco Palenque."}}]})]),
+        ]
+        tools = {"search_food": {"params": "query", "description": "", "function": lambda query: "Taco Palenque"}}
+
+        with patch('chat.views.Agent', lambda **kwargs: Agent(tools=tools, **kwargs)):
+            response = self.client.post(
+                reverse('new_message', kwargs={'pk': self.thread.pk}),
+                {'content': 'Where can I get tacos?'},
+                HTTP_ACCEPT='text/event-stream'
+            )
+            body = b''.join(response.streaming_content).decode()
+
+        # The tool call is not streamed, and the page is told to start the reply over after it
+        payloads = [json.loads(line[len('data: '):]) for line in body.splitlines() if line.startswith('data: ')]
+        self.assertEqual(payloads[:2], [{'reset': True}, {'delta': 'Try Taco Palenque.'}])
+        self.assertNotIn('Tool:', ''.join(payload.get('delta', '') for payload in payloads))
+        self.assertIn('event: reset', body)
+        self.assertIn('event: done', body)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_message_creation_fragment(self, mock_create):
+        mock_create.return_value = OpenAIObject.construct_from(
+            {"choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello!"}}]}
+        )
+        Message.objects.create(thread=self.thread, user=self.user, content='An earlier message')
+
+        # Test that page script gets only the new message rows instead of a redirect
+        response = self.client.post(
+            reverse('new_message', kwargs={'pk': self.thread.pk}),
+            {'content': 'Hello, World!'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'chat/messages.html')
+        self.assertTemplateNotUsed(response, 'base_generic.html')
+        self.assertContains(response, '<p>Hello, World!</p>')
+        self.assertContains(response, '<p>Hello!</p>')
+        self.assertNotContains(response, 'An earlier message')
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_message_creation_fragment_in_another_users_thread(self, mock_create):
+        other_user = get_user_model().objects.create_user(email='otheruser@test.com', password='12345')
+        other_thread = Thread.objects.create(name='Other Thread', user=other_user)
+        Message.objects.create(thread=other_thread, user=other_user, content='A private message')
+
+        # Test that the new message rows of another user's thread are never rendered
+        response = self.client.post(
+            reverse('new_message', kwargs={'pk': other_thread.pk}),
+            {'content': 'Hello, World!'},
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 404)
+        mock_create.assert_not_called()
+        self.assertFalse(Message.objects.filter(content='Hello, World!').exists())
+
+    @override_settings(AGENT_TASK_MODE='worker')
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_message_creation_queued(self, mock_create):
+        mock_create.return_value = OpenAIObject.construct_from(
+            {"choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello!"}}]}
+        )
+
+        # Test that the reply is queued and the view returns without waiting for it
+        response = self.client.post(
+            reverse('new_message', kwargs={'pk': self.thread.pk}),
+            {'content': 'Hello, World!'},
+            HTTP_ACCEPT='text/event-stream',
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        mock_create.assert_not_called()
+        self.assertEqual(self.client.get(status_url).json(), {'status': 'queued'})
+
+        # Once a worker has run the turn, polling returns the new message rows
+        run_task(response.json()['task'])
+        status = self.client.get(status_url).json()
+        self.assertEqual(status['status'], 'done')
+        self.assertIn('<p>Hello!</p>', status['html'])
+
+    def test_task_status_is_private(self):
+        other_user = get_user_model().objects.create_user(email='other@test.com', password='12345')
+        other_thread = Thread.objects.create(name='Other Thread', user=other_user)
+        task = AgentTask.objects.create(thread=other_thread, content='Hello')
+        response = self.client.get(reverse('agent_task_status', kwargs={'pk': other_thread.pk, 'task_id': task.pk}))
+        self.assertEqual(response.status_code, 404)
+
     def test_thread_view_with_messages(self):
         # Create a message within the thread
         Message.objects.create(thread=self.thread, user=self.user, content='Hello, World!')
@@ -55,4 +189,73 @@ class MessageNonAuthenticatedTestCase(TestCase):
 
     def tearDown(self):
         # Clean up after each test method
-        self.client.logout()
\ No newline at end of file
+        self.client.logout()
+
+class AsyncMessageIntegrationTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(name='Test Thread', user=self.user)
+        self.factory = AsyncRequestFactory()
+
+    @patch('chat.ai.agent.openai.ChatCompletion.acreate', new_callable=AsyncMock)
+    async def test_async_message_creation(self, mock_acreate):
+        mock_acreate.return_value = OpenAIObject.construct_from(
+            {"choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello!"}}]}
+        )
+        request = self.factory.post(reverse('new_message', kwargs={'pk': self.thread.pk}), {'content': 'Hello, World!'})
+        request.user = self.user
+
+        # Test that the async view awaits the reply and redirects back to the thread
+        try:
+            response = await async_new_message(request, pk=self.thread.pk)
+        finally:
+            await aclose_async_session()  # The session is bound to this test's event loop
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(await Message.objects.filter(content='Hello, World!', role='user', thread=self.thread).aexists())
+        self.assertTrue(await Message.objects.filter(content='Hello!', role='assistant', thread=self.thread).aexists())
+
+    @patch('chat.ai.agent.openai.ChatCompletion.acreate', new_callable=AsyncMock)
+    async def test_async_message_creation_fragment(self, mock_acreate):
+        mock_acreate.return_value = OpenAIObject.construct_from(
+            {"choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello!"}}]}
+        )
+        request = self.factory.post(
+            reverse('new_message', kwargs={'pk': self.thread.pk}),
+            {'content': 'Hello, World!'},
+            headers={'X-Requested-With': 'XMLHttpRequest'}
+        )
+        request.user = self.user
+
+        try:
+            response = await async_new_message(request, pk=self.thread.pk)
+        finally:
+            await aclose_async_session()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'<p>Hello, World!</p>', response.content)
+        self.assertIn(b'<p>Hello!</p>', response.content)
+        self.assertTrue(await Message.objects.filter(content='Hello, World!', role='user', thread=self.thread).aexists())
+        self.assertTrue(await Message.objects.filter(content='Hello!', role='assistant', thread=self.thread).aexists())
+
+    @patch('chat.ai.agent.openai.ChatCompletion.acreate', new_callable=AsyncMock)
+    async def test_async_message_creation_fragment_in_another_users_thread(self, mock_acreate):
+        other_user = await get_user_model().objects.acreate(email='otheruser@test.com')
+        request = self.factory.post(
+            reverse('new_message', kwargs={'pk': self.thread.pk}),
+            {'content': 'Hello, World!'},
+            headers={'X-Requested-With': 'XMLHttpRequest'}
+        )
+        request.user = other_user
+
+        with self.assertRaises(Http404):
+            await async_new_message(request, pk=self.thread.pk)
+        mock_acreate.assert_not_called()
+        self.assertFalse(await Message.objects.filter(content='Hello, World!').aexists())
+
+    async def test_async_message_creation_requires_login(self):
+        request = self.factory.post(reverse('new_message', kwargs={'pk': self.thread.pk}), {'content': 'Hello, World!'})
+        request.user = AnonymousUser()
+
+        response = await async_new_message(request, pk=self.thread.pk)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse('login')))
+        self.assertFalse(await Message.objects.filter(content='Hello, World!').aexists())
@@ -1,6 +1,9 @@
 # aistarterkit/chat/tests/test_privacy.py
-from django.test import TestCase
+from django.http import Http404
+from django.test import AsyncRequestFactory, TestCase
 from django.urls import reverse
+from unittest.mock import AsyncMock, patch
+from chat.views import async_new_message
 from django.contrib.auth import get_user_model
 from chat.models import Thread, Message
 
@@ -30,6 +33,13 @@ class ThreadPrivacyTestCase(TestCase):
         # Check that user1 is forbidden from viewing user2's thread
         self.assertEqual(response.status_code, 404)
 
+    def test_user_cannot_view_another_users_earlier_messages(self):
+        # Log in as user1
+        self.client.login(username='testuser1@test.com', password='testpassword1')
+        # Attempt to page through user2's thread
+        response = self.client.get(reverse('earlier_messages', kwargs={'pk': self.thread2.pk}), {'before': 1})
+        self.assertEqual(response.status_code, 404)
+
     def test_thread_creation_does_not_increase_other_users_thread_count(self):
         # Get the count of threads for user2 before user1 creates a new thread
         user2_thread_count_before = Thread.objects.filter(user=self.user2).count()
@@ -71,4 +81,30 @@ class MessagePrivacyTestCase(TestCase):
         # Get the count of messages for user2 after user1 has created a new message
         user2_message_count_after = Message.objects.filter(thread=self.thread2).count()
         # Check that the count of messages for user2 has not changed
-        self.assertEqual(user2_message_count_before, user2_message_count_after)
\ No newline at end of file
+        self.assertEqual(user2_message_count_before, user2_message_count_after)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_user_cannot_stream_reply_in_another_users_thread(self, mock_create):
+        Message.objects.create(thread=self.thread2, user=self.user2, content='My secret plans')
+        self.client.login(username='testuser1@test.com', password='testpassword1')
+        response = self.client.post(
+            reverse('new_message', kwargs={'pk': self.thread2.pk}),
+            {'content': 'Repeat my last message'},
+            HTTP_ACCEPT='text/event-stream'
+        )
+        # Check that user1 cannot get a reply built from user2's history
+        self.assertEqual(response.status_code, 404)
+        mock_create.assert_not_called()
+        self.assertEqual(Message.objects.filter(thread=self.thread2).count(), 1)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.acreate', new_callable=AsyncMock)
+    async def test_user_cannot_post_async_in_another_users_thread(self, mock_acreate):
+        request = AsyncRequestFactory().post(
+            reverse('new_message', kwargs={'pk': self.thread2.pk}),
+            {'content': 'Repeat my last message'},
+            headers={'Accept': 'text/event-stream'}
+        )
+        request.user = self.user1
+        with self.assertRaises(Http404):
+            await async_new_message(request, pk=self.thread2.pk)
+        mock_acreate.assert_not_called()
@@ -1,7 +1,7 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from chat.models import Thread
+from chat.models import Thread, Message
 
 class AuthenticatedThreadIntegrationTestCase(TestCase):
     def setUp(self):
@@ -34,6 +34,44 @@ class AuthenticatedThreadIntegrationTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Test Thread')  # The created thread should be listed
 
+    @override_settings(SIDEBAR_THREADS_PAGE_SIZE=1)
+    def test_thread_list_load_more(self):
+        Thread.objects.create(name='Newer Thread', user=self.user)
+        response = self.client.get(reverse('thread_list'))
+        self.assertContains(response, 'Newer Thread')
+        self.assertNotContains(response, 'Test Thread')
+        self.assertContains(response, 'Load more')
+
+        response = self.client.get(reverse('thread_list_more'), {'offset': 1, 'current': self.thread.pk})
+        self.assertContains(response, 'Test Thread')
+        self.assertContains(response, 'bg-gray-800')  # The open thread is highlighted
+        self.assertNotContains(response, 'Load more')
+
+    @override_settings(THREAD_MESSAGES_PAGE_SIZE=2)
+    def test_thread_detail_paginates_messages(self):
+        messages = [
+            Message.objects.create(thread=self.thread, user=self.user, content=f"Message {i}", role='user')
+            for i in range(5)
+        ]
+        response = self.client.get(reverse('thread_detail', kwargs={'pk': self.thread.pk}))
+        self.assertEqual([message.content for message in response.context['messages']], ["Message 3", "Message 4"])
+        earlier_url = response.context['earlier_messages_url']
+        self.assertEqual(earlier_url, f"{reverse('earlier_messages', kwargs={'pk': self.thread.pk})}?before={messages[3].id}")
+        self.assertContains(response, earlier_url)
+
+        response = self.client.get(earlier_url)
+        self.assertTemplateUsed(response, 'chat/messages.html')
+        self.assertTemplateNotUsed(response, 'base_generic.html')
+        self.assertEqual([message.content for message in response.context['messages']], ["Message 1", "Message 2"])
+
+        response = self.client.get(response.context['earlier_messages_url'])
+        self.assertEqual([message.content for message in response.context['messages']], ["Message 0"])
+        self.assertIsNone(response.context['earlier_messages_url'])
+
+    def test_earlier_messages_requires_cursor(self):
+        response = self.client.get(reverse('earlier_messages', kwargs={'pk': self.thread.pk}), {'before': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
     def test_thread_detail_view(self):
         # Test that the thread detail page can be accessed
         response = self.client.get(reverse('thread_detail', kwargs={'pk': self.thread.pk}))
@@ -1,7 +1,21 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+import threading
+import time
+from django.contrib.auth import get_user_model
+from chat.models import Thread, Message
 import vcr
-from chat.ai.agent import Agent, ToolInvoker
-from unittest.mock import MagicMock
+import openai
+from chat.ai import agent as agent_module
+from chat.ai.agent import STREAM_RESET, Agent, ToolInvoker, streamable_length
+from unittest.mock import AsyncMock, MagicMock, patch
+from openai.openai_object import OpenAIObject
+
+def stream_chunks(*contents):
+    # Build the chunks returned by openai.ChatCompletion.create(stream=True)
+    return iter([
+        OpenAIObject.construct_from({"choices": [{"index": 0, "delta": {"content": content}}]})
+        for content in contents
+    ])
 
 class TestAgent(TestCase):
     def setUp(self):
@@ -29,6 +43,436 @@ class TestAgent(TestCase):
         response = self.agent.chat("Hello")
         self.assertNotIn("Tool:", response)
 
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_stream(self, mock_create):
+        mock_create.return_value = stream_chunks("Hi", " there", "!")
+        chunks = list(self.agent.chat_stream("Hello"))
+        self.assertEqual(chunks, ["Hi", " there", "!"])
+        self.assertTrue(mock_create.call_args.kwargs["stream"])
+        self.assertEqual(self.agent.history[-1], {"role": "assistant", "content": "Hi there!"})
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_stream_with_tool_invocation(self, mock_create):
+        mock_create.side_effect = [
+            stream_chunks("Tool: search_food", '("tacos")'),
+            stream_chunks("Try Taco Palenque."),
+        ]
+        chunks = list(self.agent.chat_stream("Where can I get tacos in Edinburg?"))
+        self.assertIn("Try Taco Palenque.", chunks)
+        self.tools["search_food"]["function"].assert_called_once_with("tacos")
+        self.assertEqual(mock_create.call_count, 2)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_stream_hides_tool_calls(self, mock_create):
+        mock_create.side_effect = [
+            stream_chunks("Let me look. To", "ol: search_food", '("tacos")'),
+            stream_chunks("Try Taco Palenque."),
+        ]
+        chunks = list(self.agent.chat_stream("Where can I get tacos in Edinburg?"))
+        self.assertEqual(chunks, ["Let me look. ", STREAM_RESET, "Try Taco Palenque."])
+        # The history keeps the call, so the thread shows which tool was used
+        self.assertEqual(self.agent.history[1]["content"], 'Let me look. Tool: search_food("tacos")')
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_stream_releases_held_back_text(self, mock_create):
+        mock_create.return_value = stream_chunks("Hi T", "here", ", To")
+        self.assertEqual(list(self.agent.chat_stream("Hello")), ["Hi ", "There", ", ", "To"])
+
+    @patch('chat.ai.agent.openai.ChatCompletion.acreate', new_callable=AsyncMock)
+    async def test_achat_stream_hides_tool_calls(self, mock_acreate):
+        async def astream_chunks(*contents):
+            for chunk in stream_chunks(*contents):
+                yield chunk
+        mock_acreate.side_effect = [
+            astream_chunks("Tool: search_", 'food("tacos")'),
+            astream_chunks("Try Taco Palenque."),
+        ]
+        with patch('chat.ai.agent.get_async_session'):
+            chunks = [chunk async for chunk in self.agent.achat_stream("Where can I get tacos in Edinburg?")]
+        self.assertEqual(chunks, [STREAM_RESET, "Try Taco Palenque."])
+        self.tools["search_food"]["function"].assert_called_once_with("tacos")
+
+    def test_streamable_length(self):
+        self.assertEqual(streamable_length("Try Taco Palenque."), 18)
+        self.assertEqual(streamable_length("Let me look. Tool: search_food"), 13)
+        self.assertEqual(streamable_length("Let me look. Too"), 13)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_with_multiple_tool_calls(self, mock_create):
+        self.tools["search_places"] = {
+            "params": "query",
+            "description": "Tool to lookup places based on the user's query.",
+            "function": MagicMock(return_value="Edinburg, TX")
+        }
+        mock_create.side_effect = [
+            OpenAIObject.construct_from({"choices": [{"index": 0, "message": {
+                "role": "assistant", "content": 'Tool: search_food("tacos")\nTool: search_places("Edinburg")'
+            }}]}),
+            OpenAIObject.construct_from({"choices": [{"index": 0, "message": {
+                "role": "assistant", "content": "Try Taco Palenque in Edinburg."
+            }}]}),
+        ]
+        response = self.agent.chat("Where can I get tacos in Edinburg?")
+        self.assertEqual(response, "Try Taco Palenque in Edinburg.")
+        self.assertEqual(mock_create.call_count, 2)  # Both results are sent in one follow-up completion
+        self.assertEqual(
+            [message["content"] for message in self.agent.history[2:4]],
+            ["Tool Result for search_food(tacos): Taco Palenque", "Tool Result for search_places(Edinburg): Edinburg, TX"]
+        )
+
+
+class TestAgentHistory(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(user=self.user)
+        for i in range(6):
+            Message.objects.create(thread=self.thread, user=self.user, content=f"Message {i}", role="user" if i % 2 == 0 else "assistant")
+
+    def test_build_history_in_order(self):
+        agent = Agent(thread=self.thread)
+        self.assertEqual([entry["content"] for entry in agent.history], [f"Message {i}" for i in range(6)])
+        self.assertEqual(agent.history[1], {"role": "assistant", "content": "Message 1"})
+
+    @override_settings(AGENT_HISTORY_MAX_MESSAGES=3)
+    def test_build_history_loads_most_recent_messages(self):
+        agent = Agent(thread=self.thread)
+        self.assertEqual([entry["content"] for entry in agent.history], ["Message 3", "Message 4", "Message 5"])
+
+    @override_settings(AGENT_HISTORY_MAX_TOKENS=6)
+    def test_prepare_messages_within_token_budget(self):
+        # Each "Message N" is estimated at 3 tokens, so two fit in the budget
+        agent = Agent(thread=self.thread)
+        messages = agent._prepare_messages("Hello", system_message="You are Jarvis.")
+        self.assertEqual(
+            [message["content"] for message in messages],
+            ["You are Jarvis.", "Message 4", "Message 5", "Hello"]
+        )
+
+    @override_settings(AGENT_HISTORY_MAX_TOKENS=1)
+    def test_prepare_messages_keeps_newest_message(self):
+        agent = Agent(thread=self.thread)
+        messages = agent._prepare_messages(None, system_message=None)
+        self.assertEqual([message["content"] for message in messages], ["Message 5"])
+
+
+class TestAgentPersistence(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(user=self.user)
+        self.tools = {
+            "search_food": {
+                "params": "query",
+                "description": "Tool to lookup food based on the user's query.",
+                "function": MagicMock(return_value="Taco Palenque")
+            }
+        }
+
+    def completion(self, content):
+        return OpenAIObject.construct_from({"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]})
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_saves_turn_in_one_insert(self, mock_create):
+        mock_create.side_effect = [self.completion('Tool: search_food("tacos")'), self.completion("Try Taco Palenque.")]
+        agent = Agent(tools=self.tools, thread=self.thread)
+        with self.assertNumQueries(4):  # SAVEPOINT, INSERT, RELEASE SAVEPOINT and the summary check
+            agent.chat("Where can I get tacos?")
+        self.assertEqual(
+            list(self.thread.message_set.order_by('timestamp', 'id').values_list('role', 'content')),
+            [
+                ("user", "Where can I get tacos?"),
+                ("assistant", 'Tool: search_food("tacos")'),
+                ("assistant", "Tool Result: Taco Palenque"),
+                ("assistant", "Try Taco Palenque."),
+            ]
+        )
+        self.assertEqual(self.thread.message_set.last().content_html, "<p>Try Taco Palenque.</p>")
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_saves_partial_turn_on_error(self, mock_create):
+        mock_create.return_value = self.completion('Tool: search_food("tacos")')
+        self.tools["search_food"]["function"].side_effect = RuntimeError("Search is down")
+        agent = Agent(tools=self.tools, thread=self.thread)
+        with self.assertRaises(RuntimeError):
+            agent.chat("Where can I get tacos?")
+        self.assertEqual(self.thread.message_set.count(), 2)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_stream_saves_turn_when_finished(self, mock_create):
+        mock_create.return_value = stream_chunks("Hello", " there")
+        agent = Agent(thread=self.thread)
+        stream = agent.chat_stream("Hi")
+        self.assertEqual(next(stream), "Hello")
+        self.assertEqual(self.thread.message_set.count(), 0)
+        list(stream)
+        self.assertEqual(self.thread.message_set.count(), 2)
+
+    @override_settings(AGENT_BUFFER_HISTORY=False)
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_unbuffered_saves_each_message(self, mock_create):
+        mock_create.return_value = self.completion("Hello there")
+        agent = Agent(thread=self.thread)
+        agent._update_history("user", "Hi")
+        self.assertEqual(self.thread.message_set.count(), 1)
+
+
+@override_settings(AGENT_SUMMARY_IN_BACKGROUND=False, AGENT_HISTORY_MAX_TOKENS=6)
+class TestAgentSummary(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(user=self.user)
+        self.messages = [
+            Message.objects.create(thread=self.thread, user=self.user, content=f"Message {i}", role="user" if i % 2 == 0 else "assistant")
+            for i in range(6)
+        ]
+
+    def completion(self, content):
+        return OpenAIObject.construct_from({"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]})
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_summarizes_messages_outside_window(self, mock_create):
+        mock_create.return_value = self.completion("The user said hello.")
+        agent = Agent(thread=self.thread)
+        agent._schedule_summary()
+
+        # Only the two newest messages fit in the window, so the four before them are summarized
+        transcript = mock_create.call_args.kwargs["messages"][1]["content"]
+        self.assertIn("user: Message 0", transcript)
+        self.assertIn("assistant: Message 3", transcript)
+        self.assertNotIn("Message 4", transcript)
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.summary, "The user said hello.")
+        self.assertEqual(self.thread.summarized_message_id, self.messages[3].id)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_summarizes_only_new_messages(self, mock_create):
+        mock_create.return_value = self.completion("Updated summary.")
+        self.thread.summary = "Earlier summary."
+        self.thread.summarized_message_id = self.messages[2].id
+        self.thread.save()
+        agent = Agent(thread=self.thread)
+        agent._schedule_summary()
+
+        prompt = mock_create.call_args.kwargs["messages"][1]["content"]
+        self.assertIn("Earlier summary.", prompt)
+        self.assertNotIn("Message 2", prompt)
+        self.assertIn("assistant: Message 3", prompt)
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.summary, "Updated summary.")
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_no_summary_when_history_fits(self, mock_create):
+        with self.settings(AGENT_HISTORY_MAX_TOKENS=3000):
+            Agent(thread=self.thread)._schedule_summary()
+        mock_create.assert_not_called()
+
+    def test_prepare_messages_includes_summary(self):
+        self.thread.summary = "The user likes tacos."
+        agent = Agent(thread=self.thread)
+        messages = agent._prepare_messages("Hello", system_message="You are Jarvis.")
+        self.assertEqual(messages[0]["content"], "You are Jarvis.")
+        self.assertEqual(messages[1]["role"], "system")
+        self.assertIn("The user likes tacos.", messages[1]["content"])
+        self.assertEqual([message["content"] for message in messages[2:]], ["Message 4", "Message 5", "Hello"])
+
+
+class TestAgentAnswerCache(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(user=self.user)
+        self.answer_cache = MagicMock()
+
+    def completion(self, content):
+        return OpenAIObject.construct_from({"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]})
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_first_message_answered_from_cache(self, mock_create):
+        self.answer_cache.lookup.return_value = "Try Taco Palenque."
+        agent = Agent(thread=self.thread, answer_cache=self.answer_cache)
+        self.assertEqual(agent.chat("Where can I get tacos?"), "Try Taco Palenque.")
+        mock_create.assert_not_called()
+        self.assertEqual(
+            list(self.thread.message_set.order_by('timestamp', 'id').values_list('role', 'content')),
+            [("user", "Where can I get tacos?"), ("assistant", "Try Taco Palenque.")]
+        )
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_first_message_answer_is_stored(self, mock_create):
+        self.answer_cache.lookup.return_value = None
+        mock_create.return_value = self.completion("Try Taco Palenque.")
+        agent = Agent(thread=self.thread, answer_cache=self.answer_cache)
+        agent.chat("Where can I get tacos?")
+        self.answer_cache.lookup.assert_called_once_with("Where can I get tacos?", scope=f"user:{self.user.pk}")
+        self.answer_cache.store.assert_called_once_with(
+            "Where can I get tacos?", "Try Taco Palenque.", scope=f"user:{self.user.pk}"
+        )
+
+    @override_settings(ANSWER_CACHE_SCOPE='global')
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_global_scope_only_stores_tool_backed_answers(self, mock_create):
+        self.answer_cache.lookup.return_value = None
+        mock_create.return_value = self.completion("Nice to meet you, Ana.")
+        Agent(thread=self.thread, answer_cache=self.answer_cache).chat("Hi, I'm Ana.")
+        self.answer_cache.lookup.assert_called_once_with("Hi, I'm Ana.", scope="global")
+        self.answer_cache.store.assert_not_called()
+
+        tools = {"search_food": {"params": "query", "description": "", "function": MagicMock(return_value="Taco Palenque")}}
+        mock_create.side_effect = [self.completion('Tool: search_food("tacos")'), self.completion("Try Taco Palenque.")]
+        thread = Thread.objects.create(user=self.user)
+        Agent(tools=tools, thread=thread, answer_cache=self.answer_cache).chat("Where can I get tacos?")
+        self.answer_cache.store.assert_called_once_with("Where can I get tacos?", "Try Taco Palenque.", scope="global")
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_agent_without_thread_skips_user_scoped_cache(self, mock_create):
+        mock_create.return_value = self.completion("Try Taco Palenque.")
+        Agent(answer_cache=self.answer_cache).chat("Where can I get tacos?")
+        self.answer_cache.lookup.assert_not_called()
+        self.answer_cache.store.assert_not_called()
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_later_messages_skip_cache(self, mock_create):
+        Message.objects.create(thread=self.thread, user=self.user, role="user", content="Hi")
+        mock_create.return_value = self.completion("Try Taco Palenque.")
+        agent = Agent(thread=self.thread, answer_cache=self.answer_cache)
+        agent.chat("Where can I get tacos?")
+        self.answer_cache.lookup.assert_not_called()
+        self.answer_cache.store.assert_not_called()
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_stream_answered_from_cache(self, mock_create):
+        self.answer_cache.lookup.return_value = "Try Taco Palenque."
+        agent = Agent(thread=self.thread, answer_cache=self.answer_cache)
+        self.assertEqual(list(agent.chat_stream("Where can I get tacos?")), ["Try Taco Palenque."])
+        mock_create.assert_not_called()
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_failing_lookup_is_a_miss(self, mock_create):
+        self.answer_cache.lookup.side_effect = RuntimeError("Embedding request failed")
+        mock_create.return_value = self.completion("Try Taco Palenque.")
+        agent = Agent(thread=self.thread, answer_cache=self.answer_cache)
+        with self.assertLogs('chat.ai.agent', level='ERROR'):
+            self.assertEqual(agent.chat("Where can I get tacos?"), "Try Taco Palenque.")
+
+
+@override_settings(AGENT_FUNCTION_CALLING=True)
+@patch('chat.ai.agent._function_calling_disabled_until', 0.0)
+class TestAgentFunctionCalling(TestCase):
+    def setUp(self):
+        self.tools = {
+            "search_food": {
+                "params": "query",
+                "description": "Tool to lookup food based on the user's query.",
+                "function": MagicMock(return_value="Taco Palenque")
+            }
+        }
+
+    def completion(self, content=None, tool_calls=None):
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = [
+                {"id": f"call_{index}", "type": "function", "function": {"name": name, "arguments": arguments}}
+                for index, (name, arguments) in enumerate(tool_calls)
+            ]
+        return OpenAIObject.construct_from({"choices": [{"index": 0, "message": message}]})
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_invokes_function_calls(self, mock_create):
+        mock_create.side_effect = [
+            self.completion(tool_calls=[("search_food", '{"query": "tacos, spicy"}')]),
+            self.completion("Try Taco Palenque."),
+        ]
+        agent = Agent(tools=self.tools)
+        response = agent.chat("Where can I get spicy tacos?")
+        self.assertEqual(response, "Try Taco Palenque.")
+        # The comma stays inside the argument instead of splitting it in two
+        self.tools["search_food"]["function"].assert_called_once_with("tacos, spicy")
+        self.assertEqual(mock_create.call_args.kwargs["tools"], agent.tool_invoker.function_definitions())
+        self.assertNotIn('"Tool: "', agent.prompt)
+        self.assertEqual(
+            [message["content"] for message in agent.history[1:3]],
+            ['Tool: search_food("tacos, spicy")', "Tool Result: Taco Palenque"]
+        )
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_chat_stream_invokes_streamed_function_calls(self, mock_create):
+        def tool_call_chunk(function):
+            return OpenAIObject.construct_from(
+                {"choices": [{"index": 0, "delta": {"tool_calls": [{"index": 0, "function": function}]}}]}
+            )
+        mock_create.side_effect = [
+            iter([
+                tool_call_chunk({"name": "search_food", "arguments": ""}),
+                tool_call_chunk({"arguments": '{"query": '}),
+                tool_call_chunk({"arguments": '"tacos"}'}),
+            ]),
+            stream_chunks("Try Taco Palenque."),
+        ]
+        agent = Agent(tools=self.tools)
+        chunks = list(agent.chat_stream("Where can I get tacos?"))
+        self.assertEqual(chunks, [STREAM_RESET, "Try Taco Palenque."])
+        self.tools["search_food"]["function"].assert_called_once_with("tacos")
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_falls_back_to_text_protocol(self, mock_create):
+        mock_create.side_effect = [
+            openai.error.InvalidRequestError("Unrecognized request argument supplied: tools", "tools"),
+            self.completion('Tool: search_food("tacos")'),
+            self.completion("Try Taco Palenque."),
+        ]
+        agent = Agent(tools=self.tools)
+        with self.assertLogs('chat.ai.agent', level='WARNING'):
+            response = agent.chat("Where can I get tacos?")
+        self.assertEqual(response, "Try Taco Palenque.")
+        self.assertFalse(agent.function_calling)
+        self.assertNotIn("tools", mock_create.call_args_list[1].kwargs)
+        self.assertIn('"Tool: "', mock_create.call_args_list[1].kwargs["messages"][0]["content"])
+        self.tools["search_food"]["function"].assert_called_once_with("tacos")
+        self.assertFalse(Agent(tools=self.tools).function_calling)  # Later agents skip the failing request
+
+    @override_settings(AGENT_FUNCTION_CALLING_RETRY_SECONDS=60)
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_function_calling_is_retried_after_cooldown(self, mock_create):
+        mock_create.side_effect = [
+            openai.error.InvalidRequestError("Unrecognized request argument supplied: tools", "tools"),
+            self.completion("Try Taco Palenque."),
+        ]
+        with self.assertLogs('chat.ai.agent', level='WARNING'):
+            Agent(tools=self.tools).chat("Where can I get tacos?")
+        self.assertFalse(Agent(tools=self.tools).function_calling)
+        with patch('chat.ai.agent.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertTrue(Agent(tools=self.tools).function_calling)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_invalid_request_mentioning_tools_is_raised(self, mock_create):
+        mock_create.side_effect = openai.error.InvalidRequestError("Invalid 'messages[1].content': describe your tools", "messages")
+        agent = Agent(tools=self.tools)
+        with self.assertRaises(openai.error.InvalidRequestError):
+            agent.chat("Which tools do you have?")
+        self.assertTrue(Agent(tools=self.tools).function_calling)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_invalid_function_arguments_are_a_tool_error(self, mock_create):
+        mock_create.side_effect = [
+            self.completion(tool_calls=[("search_food", '{"query": "tacos')]),
+            self.completion("Sorry, let me try that again."),
+        ]
+        agent = Agent(tools=self.tools)
+        with self.assertLogs('chat.ai.agent', level='WARNING'):
+            response = agent.chat("Where can I get tacos?")
+        self.assertEqual(response, "Sorry, let me try that again.")
+        self.tools["search_food"]["function"].assert_not_called()
+        self.assertEqual(
+            agent.history[2]["content"], "Tool Result: Error: the arguments for search_food were not a valid JSON object."
+        )
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_other_invalid_requests_are_raised(self, mock_create):
+        mock_create.side_effect = openai.error.InvalidRequestError("This model's maximum context length is exceeded", "messages")
+        agent = Agent(tools=self.tools)
+        with self.assertRaises(openai.error.InvalidRequestError):
+            agent.chat("Where can I get tacos?")
+        self.assertEqual(mock_create.call_count, 1)
+        self.assertTrue(agent.function_calling)
+
 
 class TestToolInvoker(TestCase):
     def setUp(self):
@@ -47,4 +491,87 @@ class TestToolInvoker(TestCase):
 
     def test_invoke_tool_with_unknown_tool(self):
         with self.assertRaises(ValueError):
-            self.tool_invoker.invoke_tool("Tool: unknown_tool('tacos')")
\ No newline at end of file
+            self.tool_invoker.invoke_tool("Tool: unknown_tool('tacos')")
+
+    def test_extract_calls(self):
+        calls = self.tool_invoker.extract_calls('Tool: search_food("tacos")\nTool: search_food("tamales, spicy")')
+        self.assertEqual(calls, [("search_food", ["tacos"]), ("search_food", ["tamales", "spicy"])])
+
+    def test_invoke_calls_runs_tools_concurrently(self):
+        # Each call waits for the other to start, so running them one at a time would time out
+        barrier = threading.Barrier(2, timeout=5)
+        self.tools["search_food"]["function"] = lambda query: (barrier.wait(), query.upper())[1]
+        results = self.tool_invoker.invoke_calls('Tool: search_food("tacos")\nTool: search_food("tamales")')
+        self.assertEqual(results, [("search_food", ["tacos"], "TACOS"), ("search_food", ["tamales"], "TAMALES")])
+
+    @override_settings(AGENT_TOOL_TIMEOUT=0.1)
+    def test_invoke_calls_reports_timeout(self):
+        release = threading.Event()
+        self.tools["slow_search"] = {"params": "query", "description": "", "function": lambda query: release.wait(5)}
+        try:
+            with self.assertLogs('chat.ai.agent', level='WARNING'):
+                results = self.tool_invoker.invoke_calls('Tool: search_food("tacos")\nTool: slow_search("tamales")')
+        finally:
+            release.set()
+        self.assertEqual(results[0], ("search_food", ["tacos"], "Taco Palenque"))
+        self.assertEqual(results[1][2], "Error: slow_search did not finish within 0.1 seconds.")
+
+    @override_settings(AGENT_TOOL_TIMEOUT=0.1, AGENT_TOOL_WORKERS=1)
+    @patch('chat.ai.agent._tool_executor', None)
+    def test_abandoned_tool_calls_are_bounded(self):
+        release = threading.Event()
+        self.tools["slow_search"] = {"params": "query", "description": "", "function": lambda query: release.wait(5)}
+        try:
+            with self.assertLogs('chat.ai.agent', level='WARNING'):
+                self.tool_invoker.invoke_calls('Tool: slow_search("tamales")\nTool: search_food("tacos")')
+            # The only worker is still held by the timed out call, so the queued one was cancelled
+            self.tools["search_food"]["function"].assert_not_called()
+            results = self.tool_invoker.invoke_calls('Tool: search_food("tacos")')
+            self.assertEqual(results[0][2], "Error: search_food could not run because earlier tool calls have not finished.")
+        finally:
+            release.set()
+        self.addCleanup(agent_module.get_tool_executor().shutdown)
+        deadline = time.monotonic() + 5
+        while agent_module._abandoned_tool_calls and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(agent_module._abandoned_tool_calls, 0)
+        self.assertEqual(self.tool_invoker.invoke_calls('Tool: search_food("tacos")')[0][2], "Taco Palenque")
+
+    def test_invoke_calls_with_unknown_tool(self):
+        with self.assertRaises(ValueError):
+            self.tool_invoker.invoke_calls('Tool: search_food("tacos")\nTool: unknown_tool("tacos")')
+        self.tools["search_food"]["function"].assert_not_called()
+
+    def test_function_definitions(self):
+        self.tools["search_places"] = {"params": "query, city", "description": "Tool to lookup places.", "function": MagicMock()}
+        definitions = self.tool_invoker.function_definitions()
+        self.assertEqual(definitions[1], {
+            "type": "function",
+            "function": {
+                "name": "search_places",
+                "description": "Tool to lookup places.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {"query": {"type": "string"}, "city": {"type": "string"}},
+                    "required": ["query", "city"],
+                },
+            },
+        })
+
+    def test_parse_function_calls_orders_arguments_by_params(self):
+        self.tools["search_places"] = {"params": "query, city", "description": "", "function": MagicMock()}
+        calls = self.tool_invoker.parse_function_calls([
+            {"name": "search_places", "arguments": '{"city": "Edinburg", "query": "tacos, spicy"}'},
+        ])
+        self.assertEqual(calls, [("search_places", ["tacos, spicy", "Edinburg"])])
+
+    def test_parse_function_calls_with_invalid_arguments(self):
+        with self.assertLogs('chat.ai.agent', level='WARNING'):
+            calls = self.tool_invoker.parse_function_calls([
+                {"name": "search_food", "arguments": '{"query": "tacos'},
+                {"name": "search_food", "arguments": '["tacos"]'},
+            ])
+        self.assertEqual(calls, [("search_food", None), ("search_food", None)])
+        results = self.tool_invoker.run_calls(calls)
+        self.assertEqual(results[0][2], "Error: the arguments for search_food were not a valid JSON object.")
+        self.tools["search_food"]["function"].assert_not_called()
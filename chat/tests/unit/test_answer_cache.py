@@ -0,0 +1,68 @@
+from django.test import TestCase, override_settings
+from unittest.mock import patch
+from chat.ai.answer_cache import SemanticAnswerCache
+from chat.ai.vector_collection import Document, VectorCollection
+
+# Normalized texts and their embeddings; any other text embeds as [0, 1, 0]
+EMBEDDINGS = {
+    "where can i get tacos?": [1.0, 0.0, 0.0],
+    "where can i get some tacos?": [0.99, 0.14, 0.0],
+    "what is the weather like?": [0.0, 0.0, 1.0],
+}
+
+class FakeEmbeddingFunction:
+    def __init__(self, **kwargs):
+        pass
+
+    def __call__(self, input):
+        return [EMBEDDINGS.get(text, [0.0, 1.0, 0.0]) for text in input]
+
+@override_settings(EMBEDDING_CACHE_PATH='')
+class TestSemanticAnswerCache(TestCase):
+    def setUp(self):
+        with patch('chat.ai.vector_collection.embedding_functions.OpenAIEmbeddingFunction', FakeEmbeddingFunction):
+            self.source = VectorCollection(collection_name="answer_cache_source")
+            self.answer_cache = SemanticAnswerCache(
+                source=self.source, collection_name="answer_cache_test", threshold=0.95, ttl=60, revision_ttl=0
+            )
+
+    def tearDown(self):
+        for name in ("answer_cache_source", "answer_cache_test"):
+            self.source.chroma_client.delete_collection(name)
+
+    def test_similar_question_is_answered(self):
+        self.answer_cache.store("Where can I get tacos?", "Try Taco Palenque.")
+        self.assertEqual(self.answer_cache.lookup("Where can I get  some tacos?"), "Try Taco Palenque.")
+
+    def test_different_question_misses(self):
+        self.assertIsNone(self.answer_cache.lookup("Where can I get tacos?"))
+        self.answer_cache.store("Where can I get tacos?", "Try Taco Palenque.")
+        self.assertIsNone(self.answer_cache.lookup("What is the weather like?"))
+
+    def test_expired_answer_misses(self):
+        self.answer_cache.ttl = -1
+        self.answer_cache.store("Where can I get tacos?", "Try Taco Palenque.")
+        self.assertIsNone(self.answer_cache.lookup("Where can I get tacos?"))
+
+    def test_source_change_invalidates_answers(self):
+        self.answer_cache.store("Where can I get tacos?", "Try Taco Palenque.")
+        self.source.add(Document("1", {"name": "Taqueria Arandas"}))
+        self.assertIsNone(self.answer_cache.lookup("Where can I get tacos?"))
+
+        # Answers stored under the new revision are served again
+        self.answer_cache.store("Where can I get tacos?", "Try Taqueria Arandas.")
+        self.assertEqual(self.answer_cache.lookup("Where can I get tacos?"), "Try Taqueria Arandas.")
+
+    def test_answers_are_scoped(self):
+        self.answer_cache.store("Where can I get tacos?", "Try Taco Palenque.", scope="user:1")
+        self.assertEqual(self.answer_cache.lookup("Where can I get tacos?", scope="user:1"), "Try Taco Palenque.")
+        self.assertIsNone(self.answer_cache.lookup("Where can I get tacos?", scope="user:2"))
+        self.assertIsNone(self.answer_cache.lookup("Where can I get tacos?"))
+
+    def test_source_revision_is_reused_within_revision_ttl(self):
+        self.answer_cache.revision_ttl = 60
+        self.answer_cache.store("Where can I get tacos?", "Try Taco Palenque.")
+        with patch.object(self.source, 'revision', wraps=self.source.revision) as mock_revision:
+            self.answer_cache.lookup("Where can I get tacos?")
+            self.answer_cache.lookup("Where can I get tacos?")
+        mock_revision.assert_not_called()
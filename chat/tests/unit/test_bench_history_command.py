@@ -0,0 +1,21 @@
+import io
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from chat.models import Message, Thread
+
+class TestBenchHistoryCommand(TestCase):
+    def test_reports_timings_and_rolls_back(self):
+        output = io.StringIO()
+        call_command("bench_history", messages=200, threads=4, users=2, repeat=2, compare=True, stdout=output)
+        report = output.getvalue()
+        for name in ("history", "message_page", "earlier_messages", "thread_list"):
+            self.assertIn(f"{name}: median", report)
+        self.assertIn("chat_message_thread_ts_idx", report)
+        self.assertIn("Without indexes", report)
+        self.assertEqual(Message.objects.count(), 0)
+        self.assertEqual(Thread.objects.count(), 0)
+
+    def test_rejects_invalid_counts(self):
+        with self.assertRaises(CommandError):
+            call_command("bench_history", messages=0, stdout=io.StringIO())
@@ -0,0 +1,35 @@
+from django.test import SimpleTestCase, override_settings
+from chat.completion_cache import completion_cache_key
+
+@override_settings(PASSTHROUGH_CACHE_TTL=60, PASSTHROUGH_CACHE_SCOPE='user')
+class TestCompletionCacheKey(SimpleTestCase):
+    def setUp(self):
+        self.request_data = {
+            "model": "gpt-3.5-turbo",
+            "messages": [{"role": "user", "content": "Who won the world series in 2020?"}],
+            "temperature": 0,
+        }
+
+    def test_key_ignores_key_order(self):
+        reordered = dict(reversed(list(self.request_data.items())))
+        self.assertEqual(completion_cache_key(self.request_data, 1), completion_cache_key(reordered, 1))
+
+    def test_key_depends_on_request(self):
+        changed = {**self.request_data, "max_tokens": 10}
+        self.assertNotEqual(completion_cache_key(self.request_data, 1), completion_cache_key(changed, 1))
+
+    def test_key_is_scoped_per_user(self):
+        self.assertNotEqual(completion_cache_key(self.request_data, 1), completion_cache_key(self.request_data, 2))
+
+    @override_settings(PASSTHROUGH_CACHE_SCOPE='global')
+    def test_global_key_is_shared(self):
+        self.assertEqual(completion_cache_key(self.request_data, 1), completion_cache_key(self.request_data, 2))
+
+    def test_nondeterministic_requests_are_not_cached(self):
+        self.assertIsNone(completion_cache_key({**self.request_data, "temperature": 0.7}, 1))
+        self.assertIsNone(completion_cache_key({k: v for k, v in self.request_data.items() if k != "temperature"}, 1))
+        self.assertIsNone(completion_cache_key({**self.request_data, "stream": True}, 1))
+
+    @override_settings(PASSTHROUGH_CACHE_TTL=0)
+    def test_disabled_cache(self):
+        self.assertIsNone(completion_cache_key(self.request_data, 1))
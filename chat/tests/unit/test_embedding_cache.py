@@ -0,0 +1,62 @@
+import os
+import tempfile
+from unittest.mock import MagicMock
+from django.test import TestCase
+from chat.ai.embedding_cache import CachedEmbeddingFunction
+
+def fake_embeddings(texts):
+    # A deterministic stand-in for the embeddings API
+    return [[float(len(text)), 0.5, -1.25] for text in texts]
+
+class TestCachedEmbeddingFunction(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "cache", "embeddings.sqlite3")
+        self.embedding_function = MagicMock(side_effect=fake_embeddings)
+        self.cached = CachedEmbeddingFunction(self.embedding_function, model_name="test-model", path=self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_embeds_misses_only(self):
+        self.assertEqual(self.cached(["tacos"]), [[5.0, 0.5, -1.25]])
+        self.assertEqual(self.cached(["tacos", "burgers"]), [[5.0, 0.5, -1.25], [7.0, 0.5, -1.25]])
+
+        # Check that "tacos" was only embedded once
+        self.assertEqual([call.args[0] for call in self.embedding_function.call_args_list], [["tacos"], ["burgers"]])
+
+    def test_duplicate_texts_are_embedded_once(self):
+        self.assertEqual(len(self.cached(["tacos", "tacos"])), 2)
+        self.embedding_function.assert_called_once_with(["tacos"])
+
+    def test_cache_is_shared_through_the_file(self):
+        self.cached(["tacos"])
+        other_process = CachedEmbeddingFunction(MagicMock(), model_name="test-model", path=self.path)
+        self.assertEqual(other_process(["tacos"]), [[5.0, 0.5, -1.25]])
+        other_process.embedding_function.assert_not_called()
+
+    def test_hits_and_misses_have_the_same_precision(self):
+        self.embedding_function.side_effect = lambda texts: [[0.1, 1 / 3] for text in texts]
+        miss = self.cached(["tacos"])
+        self.assertEqual(self.cached(["tacos"]), miss)
+
+    def test_keys_include_model_name(self):
+        self.cached(["tacos"])
+        other_model = CachedEmbeddingFunction(MagicMock(side_effect=fake_embeddings), model_name="other-model", path=self.path)
+        other_model(["tacos"])
+        other_model.embedding_function.assert_called_once_with(["tacos"])
+
+    def test_evicts_least_recently_used(self):
+        self.cached.max_entries = 2
+        self.cached.EVICTION_CHECK_INTERVAL = 1
+        self.cached.TOUCH_INTERVAL_SECONDS = 0
+        self.cached(["tacos"])
+        self.cached(["burgers"])
+        self.cached(["tacos"])  # "burgers" is now the least recently used
+        self.cached(["pizza"])
+        self.embedding_function.reset_mock()
+
+        self.cached(["tacos", "pizza"])
+        self.embedding_function.assert_not_called()
+        self.cached(["burgers"])
+        self.embedding_function.assert_called_once_with(["burgers"])
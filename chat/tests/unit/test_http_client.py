@@ -0,0 +1,75 @@
+import aiohttp
+from django.test import TestCase, override_settings
+from unittest.mock import AsyncMock, MagicMock, patch
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError
+from chat import http_client
+
+class TestHttpClient(TestCase):
+    def setUp(self):
+        # Start each test without a cached session
+        http_client._session = None
+
+    def tearDown(self):
+        http_client._session = None
+
+    def test_session_is_shared(self):
+        self.assertIs(http_client.get_session(), http_client.get_session())
+
+    def test_borrowed_session_cannot_close_the_shared_session(self):
+        session = http_client.get_session()
+        borrowed = http_client.BorrowedSession()
+        self.assertIs(borrowed.request.__self__, session)
+        with patch.object(session, "close") as mock_close:
+            borrowed.close()
+        mock_close.assert_not_called()
+
+    @override_settings(OPENAI_HTTP_POOL_SIZE=4, OPENAI_HTTP_MAX_RETRIES=2, OPENAI_HTTP_BACKOFF_FACTOR=0.1)
+    def test_adapter_configuration(self):
+        adapter = http_client.get_session().get_adapter("https://api.openai.com/v1/chat/completions")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertEqual(adapter.max_retries.backoff_factor, 0.1)
+        self.assertIn(429, adapter.max_retries.status_forcelist)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+
+    @override_settings(OPENAI_HTTP_CONNECT_TIMEOUT=1, OPENAI_HTTP_READ_TIMEOUT=30)
+    def test_default_timeout(self):
+        session = http_client.get_session()
+        with patch("requests.Session.request") as mock_request:
+            session.post("https://api.openai.com/v1/chat/completions", json={})
+            self.assertEqual(mock_request.call_args.kwargs["timeout"], (1, 30))
+            session.post("https://api.openai.com/v1/chat/completions", json={}, timeout=5)
+            self.assertEqual(mock_request.call_args.kwargs["timeout"], 5)
+
+    @override_settings(OPENAI_HTTP_MAX_RETRIES=3)
+    def test_read_timeout_is_not_retried(self):
+        url = "https://api.openai.com/v1/chat/completions"
+        retry = http_client.get_session().get_adapter(url).max_retries
+        self.assertEqual(retry.read, 0)
+        # The request reached the server, so a second POST could run the completion twice
+        with self.assertRaises(MaxRetryError):
+            retry.increment(method="POST", url=url, error=ReadTimeoutError(None, url, "Read timed out."))
+
+    @override_settings(OPENAI_HTTP_MAX_RETRIES=3)
+    async def test_async_read_timeout_is_not_retried(self):
+        session = MagicMock(post=AsyncMock(side_effect=aiohttp.ServerTimeoutError("Timeout on reading data from socket")))
+        with patch("chat.http_client.get_async_session", return_value=session):
+            with self.assertRaises(aiohttp.ServerTimeoutError):
+                await http_client.apost("https://api.openai.com/v1/chat/completions", json={})
+        session.post.assert_awaited_once()
+
+    async def test_close_async_session(self):
+        session = http_client.get_async_session()
+        await http_client.aclose_async_session()
+        self.assertTrue(session.closed)
+        self.assertIsNot(http_client.get_async_session(), session)
+        await http_client.aclose_async_session()
+
+    async def test_asgi_shutdown_closes_async_session(self):
+        from aistarterkit.asgi import application
+        session = http_client.get_async_session()
+        messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+        sent = []
+        await application({"type": "lifespan"}, AsyncMock(side_effect=lambda: next(messages)), AsyncMock(side_effect=sent.append))
+        self.assertEqual([message["type"] for message in sent], ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+        self.assertTrue(session.closed)
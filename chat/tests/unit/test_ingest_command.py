@@ -0,0 +1,97 @@
+import io
+import json
+import os
+import tempfile
+from unittest.mock import patch
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from chat.management.commands.ingest import iter_json_array
+
+RESTAURANTS = [
+    {"name": "Jason's Deli", "address": "1604 W University Dr."},
+    {"name": "Taco Palenque", "address": "1414 W University Dr."},
+    {"name": "University Drafthouse", "address": "2405 W University Dr. F"},
+]
+
+class TestIterJsonArray(TestCase):
+    def test_reads_records_across_chunk_boundaries(self):
+        # A tiny chunk size forces records to be split across reads
+        records = list(iter_json_array(io.StringIO(json.dumps(RESTAURANTS, indent=4)), chunk_size=7))
+        self.assertEqual(records, RESTAURANTS)
+
+    def test_reads_numbers_split_across_chunks(self):
+        records = list(iter_json_array(io.StringIO("[12345, 678]"), chunk_size=3))
+        self.assertEqual(records, [12345, 678])
+
+    def test_empty_array(self):
+        self.assertEqual(list(iter_json_array(io.StringIO(" [ ] "))), [])
+
+    def test_rejects_non_array(self):
+        with self.assertRaises(CommandError):
+            list(iter_json_array(io.StringIO('{"name": "Taco Palenque"}')))
+
+    def test_rejects_missing_elements(self):
+        for text in ("[1,,2]", "[,1]", "[1,]", "[1 2]", "[1, 2"):
+            with self.subTest(text=text), self.assertRaises(CommandError):
+                list(iter_json_array(io.StringIO(text), chunk_size=2))
+
+    def test_reads_many_records_in_one_chunk(self):
+        records = [{"id": i} for i in range(1000)]
+        self.assertEqual(list(iter_json_array(io.StringIO(json.dumps(records)))), records)
+
+class TestIngestCommand(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.json_path = os.path.join(self.directory.name, "data.json")
+        with open(self.json_path, "w") as file:
+            json.dump(RESTAURANTS, file)
+        self.jsonl_path = os.path.join(self.directory.name, "data.jsonl")
+        with open(self.jsonl_path, "w") as file:
+            file.write("\n".join(json.dumps(record) for record in RESTAURANTS))
+        self.checkpoint_path = os.path.join(self.directory.name, "checkpoint.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def ingested_ids(self, mock_collection):
+        return sorted(
+            document.id
+            for call in mock_collection.return_value.add_many.call_args_list
+            for document in call.args[0]
+        )
+
+    @patch("chat.management.commands.ingest.VectorCollection")
+    def test_ingest_json(self, mock_collection):
+        out = io.StringIO()
+        call_command("ingest", self.json_path, "--collection", "restaurants", "--batch-size", "2", stdout=out)
+
+        mock_collection.assert_called_once_with(collection_name="restaurants")
+        self.assertEqual(self.ingested_ids(mock_collection), ["0", "1", "2"])
+        self.assertIn("Ingested 3 documents", out.getvalue())
+        self.assertIn("docs/sec", out.getvalue())
+        self.assertIn("tokens/sec", out.getvalue())
+
+    @patch("chat.management.commands.ingest.VectorCollection")
+    def test_ingest_jsonl_with_id_field(self, mock_collection):
+        call_command("ingest", self.jsonl_path, "--id-field", "name", stdout=io.StringIO())
+        self.assertEqual(self.ingested_ids(mock_collection), ["Jason's Deli", "Taco Palenque", "University Drafthouse"])
+
+    @patch("chat.management.commands.ingest.VectorCollection")
+    def test_resume_from_checkpoint(self, mock_collection):
+        # Fail the second batch so only the first is checkpointed
+        mock_collection.return_value.add_many.side_effect = [1, Exception("rate limited")]
+        with self.assertRaises(CommandError):
+            call_command("ingest", self.json_path, "--batch-size", "2", "--workers", "1", "--checkpoint", self.checkpoint_path, stdout=io.StringIO())
+
+        mock_collection.return_value.add_many.reset_mock(side_effect=True)
+        call_command("ingest", self.json_path, "--batch-size", "2", "--checkpoint", self.checkpoint_path, stdout=io.StringIO())
+
+        # Check that only the unfinished batch is ingested on the second run
+        self.assertEqual(self.ingested_ids(mock_collection), ["2"])
+
+    @patch("chat.management.commands.ingest.VectorCollection")
+    def test_checkpoint_batch_size_must_match(self, mock_collection):
+        call_command("ingest", self.json_path, "--batch-size", "2", "--checkpoint", self.checkpoint_path, stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command("ingest", self.json_path, "--batch-size", "3", "--checkpoint", self.checkpoint_path, stdout=io.StringIO())
@@ -0,0 +1,72 @@
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.test import TestCase, override_settings
+from chat.rate_limit import RateLimiter, RateLimitExceeded, limits_for
+
+class TestRateLimiter(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.limiter = RateLimiter(str(Path(directory.name) / 'rate_limits.sqlite3'), lease_seconds=60)
+
+    @patch('chat.rate_limit.time.time', return_value=1000.0)
+    def test_bucket_allows_burst_then_refills(self, mock_time):
+        limits = {"requests_per_minute": 60, "burst": 2}
+        self.limiter.acquire(1, limits)
+        self.limiter.acquire(1, limits)
+        with self.assertRaises(RateLimitExceeded) as raised:
+            self.limiter.acquire(1, limits)
+        self.assertAlmostEqual(raised.exception.retry_after, 1.0)
+
+        self.limiter.acquire(2, limits)  # Each user has their own bucket
+
+        mock_time.return_value = 1001.0
+        self.limiter.acquire(1, limits)
+
+    def test_concurrency_is_capped_until_released(self):
+        limits = {"concurrency": 2}
+        first = self.limiter.acquire(1, limits)
+        self.limiter.acquire(1, limits)
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.acquire(1, limits)
+        self.limiter.release(first)
+        self.assertIsNotNone(self.limiter.acquire(1, limits))
+
+    @patch('chat.rate_limit.time.time', return_value=1000.0)
+    def test_expired_leases_are_freed(self, mock_time):
+        self.limiter.acquire(1, {"concurrency": 1})
+        mock_time.return_value = 1061.0
+        self.limiter.acquire(1, {"concurrency": 1})
+
+    def test_rejected_request_keeps_its_token(self):
+        limits = {"requests_per_minute": 60, "burst": 1, "concurrency": 1}
+        self.limiter.acquire(1, {"concurrency": 1})
+        with self.assertRaises(RateLimitExceeded):
+            self.limiter.acquire(1, limits)
+        self.limiter.acquire(2, limits)
+        self.assertIsNone(self.limiter.acquire(1, {"requests_per_minute": 60, "burst": 1}))
+
+@override_settings(PASSTHROUGH_RATE_LIMITS={
+    "default": {"concurrency": 1},
+    "groups": {"staff": {"concurrency": 4}},
+    "users": {"grader@test.com": {"concurrency": 8}},
+})
+class TestLimitsFor(TestCase):
+    def test_most_specific_limits_apply(self):
+        User = get_user_model()
+        user = User.objects.create_user(email='testuser@test.com', password='12345')
+        staff = User.objects.create_user(email='staff@test.com', password='12345')
+        staff.groups.add(Group.objects.create(name='staff'))
+        grader = User.objects.create_user(email='grader@test.com', password='12345')
+
+        self.assertEqual(limits_for(user), {"concurrency": 1})
+        self.assertEqual(limits_for(staff), {"concurrency": 4})
+        self.assertEqual(limits_for(grader), {"concurrency": 8})
+
+    @override_settings(PASSTHROUGH_RATE_LIMITS={})
+    def test_no_limits_configured(self):
+        user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.assertEqual(limits_for(user), {})
@@ -0,0 +1,63 @@
+import glob
+import os
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from chat.models import Message, Thread
+from chat.rendering import render_markdown, render_messages
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), '..', 'fixtures', 'markdown')
+
+class TestRendering(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(user=self.user)
+
+    def test_render_markdown(self):
+        self.assertEqual(
+            render_markdown("Try **Taco Palenque**.\n\nIt is open late."),
+            '<p class="mb-4">Try <strong>Taco Palenque</strong>.</p>\n<p>It is open late.</p>'
+        )
+
+    def test_render_messages_fills_in_missing_html(self):
+        rendered = Message.objects.create(thread=self.thread, user=self.user, content="*Cached*", content_html="<p>Cached</p>")
+        unrendered = Message.objects.create(thread=self.thread, user=self.user, content="*New*")
+        with self.assertNumQueries(1):
+            render_messages([rendered, unrendered])
+        self.assertEqual(rendered.content_html, "<p>Cached</p>")
+        unrendered.refresh_from_db()
+        self.assertEqual(unrendered.content_html, "<p><em>New</em></p>")
+
+    def test_render_messages_skips_query_when_all_rendered(self):
+        message = Message.objects.create(thread=self.thread, user=self.user, content="Hi", content_html="<p>Hi</p>")
+        with self.assertNumQueries(0):
+            render_messages([message])
+
+    def test_render_messages_does_not_save_empty_html(self):
+        message = Message.objects.create(thread=self.thread, user=self.user, content="")
+        with self.assertNumQueries(0):
+            render_messages([message])
+        self.assertEqual(message.content_html, "")
+
+
+class TestRenderMarkdownGolden(TestCase):
+    # Each <name>.md renders to <name>.html, and to <name>.python.html with a default language
+    def test_matches_golden_files(self):
+        sources = sorted(glob.glob(os.path.join(GOLDEN_DIR, '*.md')))
+        self.assertTrue(sources)
+        for source_path in sources:
+            with open(source_path, encoding='utf-8') as file:
+                source = file.read()
+            for default_language, suffix in (('', ''), ('python', '.python')):
+                golden_path = f"{source_path[:-len('.md')]}{suffix}.html"
+                if not os.path.exists(golden_path):
+                    continue
+                with open(golden_path, encoding='utf-8') as file:
+                    expected = file.read()
+                with self.subTest(golden=os.path.basename(golden_path)):
+                    self.assertEqual(render_markdown(source, default_language) + "\n", expected)
+
+    def test_raw_html_is_passed_through(self):
+        self.assertEqual(
+            render_markdown("Text\n\n<div>raw</div>\n\nAfter"),
+            '<p class="mb-4">Text</p>\n<div>raw</div>\n\n<p>After</p>'
+        )
@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+from chat.context_processors import thread_list
+from chat.models import Thread
+from chat.sidebar import get_sidebar_page
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    SIDEBAR_THREADS_PAGE_SIZE=2,
+)
+class TestSidebarPage(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.threads = [Thread.objects.create(user=self.user, name=f"Thread {i}") for i in range(3)]
+
+    def test_first_page_is_newest_threads(self):
+        page = get_sidebar_page(self.user)
+        self.assertEqual([thread["name"] for thread in page["threads"]], ["Thread 2", "Thread 1"])
+        self.assertEqual(set(page["threads"][0]), {"id", "name"})
+        self.assertTrue(page["has_more"])
+        self.assertEqual(page["next_offset"], 2)
+
+    def test_next_page(self):
+        page = get_sidebar_page(self.user, offset=2)
+        self.assertEqual([thread["name"] for thread in page["threads"]], ["Thread 0"])
+        self.assertFalse(page["has_more"])
+
+    def test_first_page_is_cached(self):
+        get_sidebar_page(self.user)
+        with self.assertNumQueries(0):
+            get_sidebar_page(self.user)
+
+    def test_cache_invalidated_on_create_rename_and_delete(self):
+        get_sidebar_page(self.user)
+        Thread.objects.create(user=self.user, name="Thread 3")
+        self.assertEqual(get_sidebar_page(self.user)["threads"][0]["name"], "Thread 3")
+
+        self.threads[2].name = "Renamed"
+        self.threads[2].save()
+        self.assertIn("Renamed", [thread["name"] for thread in get_sidebar_page(self.user)["threads"]])
+
+        Thread.objects.filter(name="Thread 3").delete()
+        self.assertEqual(get_sidebar_page(self.user)["threads"][0]["name"], "Renamed")
+
+    def test_context_processor_is_lazy(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            context = thread_list(request)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(context['sidebar']['threads']), 2)
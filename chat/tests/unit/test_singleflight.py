@@ -0,0 +1,67 @@
+import threading
+import time
+from django.test import TestCase
+from unittest.mock import MagicMock
+from chat.ai.singleflight import SingleFlight, SingleFlightEmbeddingFunction
+
+def run_concurrently(flight, key, function, callers):
+    """Calls flight.do from several threads while the first call blocks, returning each outcome."""
+    release = threading.Event()
+    started = threading.Event()
+    def blocking_function(*args):
+        started.set()
+        release.wait(5)
+        return function(*args)
+
+    outcomes = [None] * callers
+    def call(index):
+        try:
+            outcomes[index] = flight.do(key, blocking_function, index)
+        except Exception as e:
+            outcomes[index] = e
+
+    threads = [threading.Thread(target=call, args=(0,))]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=call, args=(index,)) for index in range(1, callers)]
+    for thread in threads[1:]:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while flight.in_flight(key) != callers - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)  # Wait until every other caller has joined the call in flight
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+class TestSingleFlight(TestCase):
+    def setUp(self):
+        self.flight = SingleFlight()
+
+    def test_concurrent_calls_share_one_call(self):
+        function = MagicMock(return_value=["Taco Palenque"])
+        outcomes = run_concurrently(self.flight, "tacos", function, callers=5)
+        self.assertEqual(outcomes, [["Taco Palenque"]] * 5)
+        function.assert_called_once_with(0)  # Only the first caller's call ran
+        self.assertEqual(self.flight.shared, 4)
+        self.assertIsNone(self.flight.in_flight("tacos"))
+
+    def test_error_is_shared(self):
+        function = MagicMock(side_effect=RuntimeError("Upstream failed"))
+        outcomes = run_concurrently(self.flight, "tacos", function, callers=3)
+        self.assertTrue(all(isinstance(outcome, RuntimeError) for outcome in outcomes))
+        function.assert_called_once()
+
+    def test_later_calls_run_again(self):
+        function = MagicMock(return_value=1)
+        self.flight.do("tacos", function)
+        self.flight.do("tacos", function)
+        self.assertEqual(function.call_count, 2)
+        self.assertEqual(self.flight.shared, 0)
+
+    def test_embedding_requests_are_coalesced_by_texts(self):
+        embed = MagicMock(return_value=[[0.1, 0.2]])
+        embedding_function = SingleFlightEmbeddingFunction(embed, model_name="test-model", flight=self.flight)
+        self.assertEqual(embedding_function(["tacos"]), [[0.1, 0.2]])
+        outcomes = run_concurrently(self.flight, ("test-model", ("tacos",)), lambda index: [[0.1, 0.2]], callers=3)
+        self.assertEqual(outcomes, [[[0.1, 0.2]]] * 3)
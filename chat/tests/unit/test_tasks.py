@@ -0,0 +1,127 @@
+import io
+from datetime import timedelta
+from unittest.mock import patch
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from openai.openai_object import OpenAIObject
+from chat import tasks as task_queue
+from chat.models import AgentTask, Message, Thread
+from chat.tasks import claim, claim_next, enqueue, fail_stale_tasks, run_task, sweep_stale_tasks
+
+def completion(content):
+    return OpenAIObject.construct_from({"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]})
+
+class TestTasks(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.thread = Thread.objects.create(user=self.user)
+        task_queue._last_sweep = None  # Let each test's first sweep run
+
+    @override_settings(AGENT_TASK_MODE='worker')
+    def test_enqueue_in_worker_mode_only_queues(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            task = enqueue(self.thread, "Hello")
+        self.assertEqual(task.status, AgentTask.QUEUED)
+        self.assertEqual(callbacks, [])
+
+    @override_settings(AGENT_TASK_MODE='thread')
+    def test_enqueue_in_thread_mode_submits_after_commit(self):
+        with patch('chat.tasks.get_executor') as mock_get_executor:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                task = enqueue(self.thread, "Hello")
+        self.assertEqual(len(callbacks), 1)
+        mock_get_executor.return_value.submit.assert_called_once_with(run_task, task.pk)
+
+    def test_task_is_claimed_once(self):
+        task = enqueue(self.thread, "Hello")
+        self.assertTrue(claim(task.pk))
+        self.assertFalse(claim(task.pk))
+        self.assertIsNone(claim_next())
+
+    def test_claim_next_takes_oldest(self):
+        first = enqueue(self.thread, "First")
+        enqueue(self.thread, "Second")
+        self.assertEqual(claim_next(), first.pk)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_run_task(self, mock_create):
+        mock_create.return_value = completion("Hi there!")
+        task = enqueue(self.thread, "Hello")
+        run_task(task.pk)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, AgentTask.DONE)
+        self.assertIn('<p>Hi there!</p>', task.reply_html)
+        self.assertIsNotNone(task.finished_at)
+        self.assertEqual(Message.objects.filter(thread=self.thread).count(), 2)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_run_task_failure(self, mock_create):
+        mock_create.side_effect = RuntimeError("API is down")
+        task = enqueue(self.thread, "Hello")
+        with self.assertLogs('chat.tasks', level='ERROR'):
+            run_task(task.pk)
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, AgentTask.FAILED)
+        self.assertIn("API is down", task.error)
+
+    def test_fail_stale_tasks(self):
+        stale = AgentTask.objects.create(thread=self.thread, content="Hello", status=AgentTask.RUNNING, started_at=timezone.now() - timedelta(hours=1))
+        running = AgentTask.objects.create(thread=self.thread, content="Hello", status=AgentTask.RUNNING, started_at=timezone.now())
+        self.assertEqual(fail_stale_tasks(), 1)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, AgentTask.FAILED)
+        self.assertEqual(running.status, AgentTask.RUNNING)
+
+    def test_fail_stale_tasks_fails_orphaned_queued_tasks(self):
+        # Queued in the thread pool of a web process that has since restarted
+        orphaned = AgentTask.objects.create(thread=self.thread, content="Hello", created_at=timezone.now() - timedelta(hours=1))
+        queued = enqueue(self.thread, "Hello again")
+        self.assertEqual(fail_stale_tasks(), 1)
+        orphaned.refresh_from_db()
+        queued.refresh_from_db()
+        self.assertEqual(orphaned.status, AgentTask.FAILED)
+        self.assertEqual(orphaned.error, 'The task was never run.')
+        self.assertEqual(queued.status, AgentTask.QUEUED)
+        self.assertEqual(claim_next(), queued.pk)
+
+    def create_stale_task(self):
+        return AgentTask.objects.create(thread=self.thread, content="Hello", status=AgentTask.RUNNING, started_at=timezone.now() - timedelta(hours=1))
+
+    @override_settings(AGENT_TASK_SWEEP_INTERVAL=60)
+    def test_sweep_stale_tasks_is_rate_limited(self):
+        self.create_stale_task()
+        self.assertEqual(sweep_stale_tasks(), 1)
+        self.create_stale_task()
+        self.assertEqual(sweep_stale_tasks(), 0)
+        with patch('chat.tasks.time.monotonic', return_value=task_queue._last_sweep + 61):
+            self.assertEqual(sweep_stale_tasks(), 1)
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_run_task_sweeps_stale_tasks(self, mock_create):
+        mock_create.return_value = completion("Hi there!")
+        stale = self.create_stale_task()
+        run_task(enqueue(self.thread, "Hello").pk)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, AgentTask.FAILED)
+
+    def test_worker_sweeps_stale_tasks(self):
+        stale = self.create_stale_task()
+        stdout = io.StringIO()
+        call_command("run_agent_worker", workers=1, once=True, stdout=stdout)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, AgentTask.FAILED)
+        self.assertIn("Marked 1 abandoned tasks as failed.", stdout.getvalue())
+
+    @patch('chat.ai.agent.openai.ChatCompletion.create')
+    def test_worker_runs_queued_tasks(self, mock_create):
+        mock_create.return_value = completion("Hi there!")
+        tasks = [enqueue(self.thread, "Hello"), enqueue(self.thread, "Hello again")]
+        call_command("run_agent_worker", workers=1, once=True, stdout=io.StringIO())
+        for task in tasks:
+            task.refresh_from_db()
+            self.assertEqual(task.status, AgentTask.DONE)
@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from chat.token_cache import get_token_user, token_users
+from chat.views import BearerAuthentication
+
+class TestTokenCache(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='testuser@test.com', password='12345')
+        self.token = Token.objects.create(user=self.user)
+        self.key = self.token.key
+
+    def authenticate(self):
+        request = RequestFactory().post('/', HTTP_AUTHORIZATION='Bearer ' + self.key)
+        return BearerAuthentication().authenticate(request)
+
+    def test_user_is_cached(self):
+        self.assertEqual(get_token_user(self.key), self.user)
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+        self.assertEqual(user, self.user)
+        self.assertIsNot(user, get_token_user(self.key))  # Each request gets its own copy
+
+    def test_deleted_token_is_rejected(self):
+        self.authenticate()
+        self.token.delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_deactivated_user_is_rejected(self):
+        self.authenticate()
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_login_keeps_tokens_cached(self):
+        other_user = get_user_model().objects.create_user(email='other@test.com', password='12345')
+        other_key = Token.objects.create(user=other_user).key
+        get_token_user(other_key)
+        self.authenticate()
+
+        self.user.last_login = timezone.now()
+        self.user.save(update_fields=['last_login'])
+        self.assertIsNotNone(token_users.get(self.key))
+
+        # Deactivating a user only drops that user's tokens
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertIsNone(token_users.get(self.key))
+        self.assertIsNotNone(token_users.get(other_key))
+
+    def test_rotated_token_is_rejected(self):
+        self.authenticate()
+        old_key = self.key
+        self.token.delete()
+        self.key = Token.objects.create(user=self.user).key
+        self.assertEqual(self.authenticate()[0], self.user)
+        self.assertIsNone(token_users.get(old_key))
@@ -0,0 +1,43 @@
+from django.test import TestCase
+from unittest.mock import patch
+from chat.ai.ttl_cache import TTLCache
+
+class TestTTLCache(TestCase):
+    def setUp(self):
+        self.cache = TTLCache(max_entries=2, ttl=10)
+
+    def test_get_and_set(self):
+        self.assertIsNone(self.cache.get("tacos"))
+        self.cache.set("tacos", ["Taco Palenque"])
+        self.assertEqual(self.cache.get("tacos"), ["Taco Palenque"])
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+    @patch("chat.ai.ttl_cache.time.monotonic")
+    def test_entries_expire(self, mock_monotonic):
+        mock_monotonic.return_value = 100
+        self.cache.set("tacos", ["Taco Palenque"])
+        mock_monotonic.return_value = 111
+        self.assertIsNone(self.cache.get("tacos"))
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set("tacos", 1)
+        self.cache.set("burgers", 2)
+        self.cache.get("tacos")
+        self.cache.set("pizza", 3)
+        self.assertIsNone(self.cache.get("burgers"))
+        self.assertEqual(self.cache.get("tacos"), 1)
+        self.assertEqual(self.cache.get("pizza"), 3)
+
+    def test_delete(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.delete("a")
+        self.cache.delete("missing")
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.get("b"), 2)
+
+    def test_zero_ttl_disables_cache(self):
+        cache = TTLCache(ttl=0)
+        cache.set("tacos", 1)
+        self.assertIsNone(cache.get("tacos"))
@@ -1,6 +1,9 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+import threading
+import time
 import vcr
-from chat.ai.vector_collection import Document, VectorCollection
+from unittest.mock import MagicMock, patch
+from chat.ai.vector_collection import Document, VectorCollection, normalize_query
 
 class TestDocument(TestCase):
     def test_to_embed_str(self):
@@ -16,6 +19,7 @@ class TestDocument(TestCase):
         doc = Document("1", data)
         self.assertEqual(doc.data, data)  # Check that the data is correctly assigned
 
+@override_settings(EMBEDDING_CACHE_PATH='')  # Exercise the recorded embedding requests
 class TestVectorCollection(TestCase):
     def setUp(self):
         self.collection = VectorCollection(collection_name="test")
@@ -42,4 +46,104 @@ class TestVectorCollection(TestCase):
 
     def test_to_embed_str(self):
         doc = Document("1", {"text": "Hello, world!"})
-        self.assertEqual(doc.to_embed_str(), '{"text": "Hello, world!"}')
\ No newline at end of file
+        self.assertEqual(doc.to_embed_str(), '{"text": "Hello, world!"}')
+
+@override_settings(EMBEDDING_CACHE_PATH='')
+class TestVectorCollectionAddMany(TestCase):
+    def setUp(self):
+        self.collection = VectorCollection(collection_name="test_add_many")
+        self.collection.collection = MagicMock()
+        self.documents = [Document(i, {"text": f"Document {i}"}) for i in range(5)]
+
+    def test_add_many_batches_upserts(self):
+        added = self.collection.add_many(self.documents, batch_size=2)
+
+        # Check that five documents are upserted in three batches
+        self.assertEqual(added, 5)
+        upserts = self.collection.collection.upsert.call_args_list
+        self.assertEqual([call.kwargs["ids"] for call in upserts], [["0", "1"], ["2", "3"], ["4"]])
+        self.assertEqual(upserts[0].kwargs["documents"], ['{"text": "Document 0"}', '{"text": "Document 1"}'])
+
+    def test_add_many_reports_progress(self):
+        progress = MagicMock()
+        self.collection.add_many(iter(self.documents), batch_size=2, progress_callback=progress)
+
+        # Check that progress is reported after each batch, without a total for a generator
+        self.assertEqual([call.args for call in progress.call_args_list], [(2, None), (4, None), (5, None)])
+
+    @patch.object(VectorCollection._add_batch.retry, "sleep")
+    def test_add_many_retries_failed_batch(self, mock_sleep):
+        self.collection.collection.upsert.side_effect = [Exception("rate limited"), None, None, None]
+        self.collection.add_many(self.documents, batch_size=2)
+
+        # Check that only the failed batch is retried
+        self.assertEqual(self.collection.collection.upsert.call_count, 4)
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_add_many_rejects_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            self.collection.add_many(self.documents, batch_size=0)
+
+@override_settings(EMBEDDING_CACHE_PATH='')
+class TestVectorCollectionSearchCache(TestCase):
+    def setUp(self):
+        self.collection = VectorCollection(collection_name="test_search_cache")
+        self.collection.collection = MagicMock()
+        self.collection.collection.name = "test_search_cache"
+        self.collection.collection.query.return_value = {
+            "ids": [["1"]],
+            "metadatas": [[{"name": "Taco Palenque"}]],
+        }
+        VectorCollection.search_cache.clear()
+
+    def test_repeated_search_is_cached(self):
+        first = self.collection.search("tacos", n_results=1)
+        second = self.collection.search("  Tacos ", n_results=1)
+
+        # Check that the normalized query is only sent to the collection once
+        self.assertEqual(first, [{"name": "Taco Palenque"}])
+        self.assertEqual(second, first)
+        self.collection.collection.query.assert_called_once()
+        self.assertEqual(VectorCollection.search_cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_concurrent_searches_share_one_query(self):
+        release = threading.Event()
+        def slow_query(**kwargs):
+            release.wait(5)
+            return {"ids": [["1"]], "metadatas": [[{"name": "Taco Palenque"}]]}
+        self.collection.collection.query.side_effect = slow_query
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.collection.search("tacos", n_results=1))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        key = ("test_search_cache", VectorCollection._generations["test_search_cache"], "tacos", 1)
+        deadline = time.monotonic() + 5
+        while VectorCollection.search_flight.in_flight(key) != 2 and time.monotonic() < deadline:
+            time.sleep(0.001)  # Wait until the other searches have joined the query in flight
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, [[{"name": "Taco Palenque"}]] * 3)
+        self.collection.collection.query.assert_called_once()
+
+    def test_n_results_is_part_of_the_key(self):
+        self.collection.search("tacos", n_results=1)
+        self.collection.search("tacos", n_results=5)
+        self.assertEqual(self.collection.collection.query.call_count, 2)
+
+    def test_add_invalidates_cached_results(self):
+        self.collection.search("tacos", n_results=1)
+        self.collection.add(Document("2", {"name": "Taqueria Jalisco"}))
+        self.collection.search("tacos", n_results=1)
+        self.assertEqual(self.collection.collection.query.call_count, 2)
+
+    def test_add_many_invalidates_cached_results(self):
+        self.collection.search("tacos", n_results=1)
+        self.collection.add_many([Document("2", {"name": "Taqueria Jalisco"})])
+        self.collection.search("tacos", n_results=1)
+        self.assertEqual(self.collection.collection.query.call_count, 2)
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  Where can I get\tTACOS? "), "where can i get tacos?")
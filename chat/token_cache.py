@@ -0,0 +1,50 @@
+"""This module caches the users behind API bearer tokens.
+
+Every passthrough request is authenticated by its token, so the token's user is
+kept in a per-process TTLCache instead of being queried each time. Creating,
+rotating or deleting a token and changing what a user may authenticate with (for
+example deactivating them) drop the affected tokens from this process's cache
+(see chat.signals). Other worker processes notice such
+a change once their entries expire after API_TOKEN_CACHE_TTL seconds.
+
+Typical usage example:
+
+    user = get_token_user(token)
+"""
+import copy
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+from .ai.ttl_cache import TTLCache
+
+token_users = TTLCache(max_entries=settings.API_TOKEN_CACHE_MAX_ENTRIES, ttl=settings.API_TOKEN_CACHE_TTL)
+
+
+def get_token_user(key):
+    """Returns the user owning an API token.
+
+    Args:
+        key: The token's key.
+
+    Returns:
+        A copy of the user, so requests never share one instance.
+
+    Raises:
+        DoesNotExist: If no user owns the token.
+    """
+    user = token_users.get(key)
+    if user is None:
+        user = get_user_model().objects.get(auth_token=key)
+        token_users.set(key, user)
+    return copy.copy(user)
+
+
+def invalidate_token(key):
+    """Drops a token from this process's cache."""
+    token_users.delete(key)
+
+
+def invalidate_user_tokens(user_id):
+    """Drops the tokens of a user from this process's cache."""
+    for key in Token.objects.filter(user_id=user_id).values_list("key", flat=True):
+        token_users.delete(key)
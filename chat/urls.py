@@ -1,12 +1,24 @@
-from django.urls import path, re_path
+from django.conf import settings
+from django.urls import path
 from . import views
 
+if settings.ASYNC_VIEWS:
+    # Under ASGI, serve the endpoints that wait on the LLM without tying up a thread per request
+    new_message_view = views.async_new_message
+    passthrough_view = views.async_openai_api_chat_completions_passthrough
+else:
+    new_message_view = views.new_message
+    passthrough_view = views.openai_api_chat_completions_passthrough
+
 urlpatterns = [
     path('', views.thread_list, name='thread_list'),  # Add this line if needed
+    path('threads/more/', views.thread_list_more, name='thread_list_more'),  # GET request for the next page of sidebar threads.
     path('thread/<int:pk>/', views.thread_detail, name='thread_detail'),  # GET request to retrieve a specific thread.
     path('thread/', views.create_thread, name='create_thread'),  # POST request to create a new thread.
-    path('thread/<int:pk>/messages/', views.new_message, name='new_message'),  # POST request to create a new message in a thread.
+    path('thread/<int:pk>/messages/', new_message_view, name='new_message'),  # POST request to create a new message in a thread.
+    path('thread/<int:pk>/messages/earlier/', views.earlier_messages, name='earlier_messages'),  # GET request for the messages before a cursor.
+    path('thread/<int:pk>/tasks/<int:task_id>/', views.agent_task_status, name='agent_task_status'),  # GET request to poll a queued reply.
     path('thread/<int:pk>/delete', views.delete_thread, name='delete_thread'),  # DELETE request to delete a specific thread.
-    path('api/v1/chat/completions', views.openai_api_chat_completions_passthrough, name='openai_api_chat_completions_passthrough'),
+    path('api/v1/chat/completions', passthrough_view, name='openai_api_chat_completions_passthrough'),
     path('settings/', views.developer_settings, name='settings'),
 ]
\ No newline at end of file
@@ -1,14 +1,35 @@
 import requests
 import os
-from .ai.agent import Agent  # Import the Agent class from the current app directory
-from .models import Thread, Message
+import json
+import logging
+import math
+import asyncio
+import aiohttp
+from asgiref.sync import sync_to_async
+from .ai.agent import STREAM_RESET, Agent  # Import the Agent class from the current app directory
+from .ai.answer_cache import get_answer_cache
+from .completion_cache import (
+    CACHE_STATUS_HEADER, acache_completion, aget_cached_completion, cache_completion, completion_cache_key,
+    get_cached_completion,
+)
+from .http_client import apost, get_session
+from .models import AgentTask, Thread, Message
+from .rendering import render_messages
+from .rate_limit import RateLimitExceeded, acquire_slot, release_slot
+from .sidebar import get_sidebar_page
+from .token_cache import get_token_user
+from .tasks import enqueue
 from .forms import MessageForm, ThreadForm
 from .forms import CustomUserAuthenticationForm
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.auth import get_user_model
 from django.contrib.auth.views import LoginView
 from django.conf import settings
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
 from django.views.decorators.http import require_POST
 from rest_framework.authtoken.models import Token
@@ -18,6 +39,8 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.exceptions import AuthenticationFailed
 
+logger = logging.getLogger(__name__)
+
 class CustomLoginView(LoginView):
     authentication_form = CustomUserAuthenticationForm
 
@@ -33,33 +56,186 @@ class BearerAuthentication(BaseAuthentication):
             raise AuthenticationFailed('Bearer token not provided')
 
         try:
-            user = get_user_model().objects.get(auth_token=token)
+            user = get_token_user(token)
         except get_user_model().DoesNotExist:
             raise AuthenticationFailed('No such user')
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted')
 
         return (user, token)
     
+OPENAI_CHAT_COMPLETIONS_URL = "https://api.openai.com/v1/chat/completions"
+
 @api_view(['POST'])
 @authentication_classes([BearerAuthentication])
 @permission_classes([IsAuthenticated])
 def openai_api_chat_completions_passthrough(request):
-    # Get the request data and headers
+    # Get the request data
     request_data = request.data
-    request_headers = request.META
-    openai_api_key = settings.OPENAI_API_KEY
-    
-    # Forward the request to the OpenAI API
-    response = requests.post(
-        "https://api.openai.com/v1/chat/completions",
-        json=request_data,
-        headers={
-            "Content-Type": request_headers.get("CONTENT_TYPE"),
-            "Authorization": f"Bearer {openai_api_key}",
-        },
-    )
+    stream = bool(request_data.get("stream"))
+
+    # Serve repeated deterministic requests from the completion cache
+    cache_key = completion_cache_key(request_data, request.user.pk)
+    if cache_key:
+        cached_data = get_cached_completion(cache_key)
+        if cached_data is not None:
+            return Response(cached_data, headers={CACHE_STATUS_HEADER: 'HIT'})
+
+    # Admit the request under the user's rate and concurrency limits
+    try:
+        lease = acquire_slot(request.user)
+    except RateLimitExceeded as e:
+        return Response(rate_limit_error(), status=429, headers=retry_after_headers(e))
+
+    # Forward the request to the OpenAI API over the shared connection pool
+    response = None
+    try:
+        response = get_session().post(
+            OPENAI_CHAT_COMPLETIONS_URL,
+            json=request_data,
+            headers=passthrough_headers(request),
+            stream=stream,
+        )
+    except requests.exceptions.Timeout:
+        return Response({"error": {"message": "The upstream API timed out."}}, status=504)
+    except requests.exceptions.ConnectionError:
+        return Response({"error": {"message": "Could not connect to the upstream API."}}, status=502)
+    finally:
+        # A non-streamed body has been read by now; a stream holds its slot until the relay ends
+        if not stream or response is None:
+            release_slot(lease)
+
+    if stream:
+        # Relay the upstream Server-Sent Events to the client as they arrive
+        relay = event_stream_response(
+            relay_upstream_stream(response),
+            status=response.status_code,
+            content_type=response.headers.get("Content-Type", "text/event-stream"),
+        )
+        return close_upstream_with(relay, response.close, lease)
 
     # Return the OpenAI API response
-    return Response(response.json())
+    response_data = response.json()
+    if not cache_key:
+        return Response(response_data)
+    if response.status_code == 200:
+        cache_completion(cache_key, response_data)
+    return Response(response_data, headers={CACHE_STATUS_HEADER: 'MISS'})
+
+def relay_upstream_stream(response):
+    """Yields the raw body of a streamed upstream response."""
+    yield from response.iter_content(chunk_size=None)
+
+def close_upstream_with(relay, close_upstream, lease):
+    """Closes an upstream response and releases its slot when Django closes the relaying response.
+
+    A generator's own cleanup only runs once it has started, which it never does
+    if the client disconnects before the first chunk, so this hooks into the
+    response instead. Both `close_upstream` and `release_slot` may run twice.
+    """
+    def close():
+        close_upstream()
+        release_slot(lease)
+    relay._resource_closers.append(close)
+    return relay
+
+async def async_openai_api_chat_completions_passthrough(request):
+    # Async counterpart of openai_api_chat_completions_passthrough for ASGI deployments.
+    # DRF views are synchronous, so authentication and parsing are done by hand here.
+    if request.method != "POST":
+        return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+
+    try:
+        auth = await sync_to_async(BearerAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"detail": str(e.detail)}, status=403)
+    if auth is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+
+    try:
+        request_data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"detail": "JSON parse error."}, status=400)
+    stream = bool(request_data.get("stream"))
+
+    cache_key = completion_cache_key(request_data, auth[0].pk)
+    if cache_key:
+        cached_data = await aget_cached_completion(cache_key)
+        if cached_data is not None:
+            return JsonResponse(cached_data, safe=False, headers={CACHE_STATUS_HEADER: 'HIT'})
+
+    try:
+        lease = await sync_to_async(acquire_slot)(auth[0])
+    except RateLimitExceeded as e:
+        return JsonResponse(rate_limit_error(), status=429, headers=retry_after_headers(e))
+
+    # Forward the request to the OpenAI API without blocking the event loop
+    response = None
+    try:
+        response = await apost(
+            OPENAI_CHAT_COMPLETIONS_URL,
+            json=request_data,
+            headers=passthrough_headers(request),
+        )
+    except asyncio.TimeoutError:
+        return JsonResponse({"error": {"message": "The upstream API timed out."}}, status=504)
+    except aiohttp.ClientConnectionError:
+        return JsonResponse({"error": {"message": "Could not connect to the upstream API."}}, status=502)
+    finally:
+        if response is None:
+            await sync_to_async(release_slot, thread_sensitive=False)(lease)
+
+    if stream:
+        relay = event_stream_response(
+            arelay_upstream_stream(response, lease),
+            status=response.status,
+            content_type=response.headers.get("Content-Type", "text/event-stream"),
+        )
+        # Django closes responses from a worker thread, so the aiohttp response is released on its event loop
+        loop = asyncio.get_running_loop()
+        return close_upstream_with(relay, lambda: loop.call_soon_threadsafe(response.release), lease)
+
+    try:
+        response_data = await response.json(content_type=None)
+    finally:
+        response.release()
+        await sync_to_async(release_slot, thread_sensitive=False)(lease)
+    if not cache_key:
+        return JsonResponse(response_data, safe=False)
+    if response.status == 200:
+        await acache_completion(cache_key, response_data)
+    return JsonResponse(response_data, safe=False, headers={CACHE_STATUS_HEADER: 'MISS'})
+
+# Bearer tokens authenticate this endpoint, so it is exempt from CSRF checks like its DRF counterpart
+async_openai_api_chat_completions_passthrough.csrf_exempt = True
+
+async def arelay_upstream_stream(response, lease=None):
+    """Async version of `relay_upstream_stream` for aiohttp responses.
+
+    Unlike the sync relay this also cleans up when it ends, because Django does
+    not close an ASGI response whose client disconnected mid-stream.
+    """
+    try:
+        async for chunk in response.content.iter_any():
+            yield chunk
+    finally:
+        response.release()
+        await sync_to_async(release_slot, thread_sensitive=False)(lease)
+
+def rate_limit_error():
+    """Builds the body of a 429 response, in the OpenAI API's error format."""
+    return {"error": {"message": "Rate limit exceeded, please retry later.", "type": "rate_limit_exceeded"}}
+
+def retry_after_headers(error):
+    """Builds the Retry-After header for a RateLimitExceeded error, in whole seconds."""
+    return {"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+
+def passthrough_headers(request):
+    """Builds the headers for forwarding a passthrough request to the OpenAI API."""
+    return {
+        "Content-Type": request.META.get("CONTENT_TYPE"),
+        "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+    }
 
 @login_required
 def developer_settings(request):
@@ -112,16 +288,39 @@ def thread_list(request):
     return render(request, 'chat/empty_state.html')
 
 
+@login_required
+def thread_list_more(request):
+    # Render the next page of sidebar threads for the "Load more" button
+    try:
+        offset = max(int(request.GET.get('offset', 0)), 0)
+        current = int(request.GET.get('current', 0))
+    except ValueError:
+        offset, current = 0, 0
+    return render(request, 'chat/sidebar_threads.html', {
+        'sidebar': get_sidebar_page(request.user, offset=offset),
+        'thread': {'pk': current},  # Highlights the open thread if it is on this page
+    })
+
+
 @login_required
 def thread_detail(request, pk):
     # Check if the thread belongs to the user
     thread = get_object_or_404(Thread, pk=pk, user=request.user)
-    messages = thread.message_set.all()
     return render(request, 'chat/thread_detail.html', {
         'thread': thread,
-        'messages': messages,
+        **message_page(thread),
     })
 
+@login_required
+def earlier_messages(request, pk):
+    # Render the page of messages before the `before` cursor, for infinite scroll
+    thread = get_object_or_404(Thread, pk=pk, user=request.user)
+    try:
+        before = int(request.GET['before'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("A numeric 'before' message id is required.")
+    return render(request, 'chat/messages.html', message_page(thread, before=before))
+
 @login_required
 def create_thread(request):
     # Generate a default name for the thread, e.g., "Chat on <current date>"
@@ -142,14 +341,149 @@ def delete_thread(request, pk):
 
 @login_required
 def new_message(request, pk):
-    thread = get_object_or_404(Thread, pk=pk)
+    thread = get_object_or_404(Thread, pk=pk, user=request.user)  # Replies are built from the thread's history
     if request.method == "POST":
         form = MessageForm(request.POST)
         if form.is_valid():
             message = form.save(commit=False)
-            agent = Agent(thread=thread)
+            if settings.AGENT_TASK_MODE:
+                # Run the turn off the request thread and let the page poll for the reply
+                return agent_task_accepted(request, thread, enqueue(thread, message.content))
+            agent = Agent(thread=thread, answer_cache=get_answer_cache())
+            if 'text/event-stream' in request.headers.get('Accept', ''):
+                return stream_agent_reply(agent, message.content)
             agent.chat(message.content)
+            if is_fragment_request(request):
+                # Only the new message rows, for the page to append
+                return render(request, 'chat/messages.html', {'messages': agent.new_messages})
             return redirect('thread_detail', pk=thread.pk)
     else:
         form = MessageForm()
-    return render(request, 'chat/new_message.html', {'form': form, 'thread': thread})
\ No newline at end of file
+    return render(request, 'chat/new_message.html', {'form': form, 'thread': thread})
+
+async def async_new_message(request, pk):
+    # Async counterpart of new_message for ASGI deployments. login_required only
+    # supports synchronous views in this Django version, so the check is inlined.
+    is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+    if not is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    thread = await sync_to_async(get_object_or_404)(Thread, pk=pk, user=request.user)
+    form = MessageForm(request.POST)
+    if form.is_valid():
+        message = form.save(commit=False)
+        if settings.AGENT_TASK_MODE:
+            task = await sync_to_async(enqueue)(thread, message.content)
+            return agent_task_accepted(request, thread, task)
+        answer_cache = await sync_to_async(get_answer_cache)()
+        agent = await sync_to_async(Agent)(thread=thread, answer_cache=answer_cache)
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            return astream_agent_reply(agent, message.content)
+        await agent.achat(message.content)
+        if is_fragment_request(request):
+            return await sync_to_async(render)(request, 'chat/messages.html', {'messages': agent.new_messages})
+    return redirect('thread_detail', pk=thread.pk)
+
+@login_required
+def agent_task_status(request, pk, task_id):
+    # Report a queued agent turn's progress, with the new message rows once it is done
+    task = get_object_or_404(AgentTask, pk=task_id, thread__pk=pk, thread__user=request.user)
+    data = {'status': task.status}
+    if task.status == AgentTask.DONE:
+        data['html'] = task.reply_html
+    elif task.status == AgentTask.FAILED:
+        data['error'] = 'The assistant failed to reply.'
+    return JsonResponse(data)
+
+def agent_task_accepted(request, thread, task):
+    """Responds to a message whose reply was queued as an AgentTask."""
+    if is_fragment_request(request) or 'text/event-stream' in request.headers.get('Accept', ''):
+        return JsonResponse({
+            'task': task.pk,
+            'status': task.status,
+            'status_url': reverse('agent_task_status', args=[thread.pk, task.pk]),
+        }, status=202)
+    return redirect('thread_detail', pk=thread.pk)
+
+def is_fragment_request(request):
+    """Checks if the request comes from page script that only wants the new message rows."""
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+def render_new_messages(agent):
+    """Renders the rows of the messages the agent added to the thread."""
+    return render_to_string('chat/messages.html', {'messages': agent.new_messages})
+
+def message_page(thread, before=None):
+    """Returns the template context for the newest page of messages before the `before` id."""
+    page_size = settings.THREAD_MESSAGES_PAGE_SIZE
+    messages = list(message_page_queryset(thread, before))
+    page = messages[:page_size][::-1]
+    render_messages(page)
+    earlier_messages_url = None
+    if len(messages) > page_size:
+        earlier_messages_url = f"{reverse('earlier_messages', args=[thread.pk])}?before={page[0].id}"
+    return {'messages': page, 'earlier_messages_url': earlier_messages_url}
+
+def message_page_queryset(thread, before=None):
+    """Returns the newest messages before the `before` id, newest first, plus one to tell if there are more."""
+    messages = thread.message_set.order_by('-timestamp', '-id')
+    if before is not None:
+        messages = messages.filter(id__lt=before)  # Ids increase with timestamps, so the id is the cursor
+    return messages[:settings.THREAD_MESSAGES_PAGE_SIZE + 1]
+
+def stream_agent_reply(agent, content):
+    """Streams the agent's reply to `content` as Server-Sent Events.
+
+    Each chunk of the reply is sent as a `data` event carrying a JSON object with a
+    `delta` key, followed by a final `done` event carrying the rendered rows of the
+    turn's messages in `html` (or an `error` event if the agent fails). A `reset`
+    event, whose object has a `reset` key, tells the page to start the reply over
+    after a tool call.
+    """
+    def events():
+        try:
+            for delta in agent.chat_stream(content):
+                yield reply_event(delta)
+        except Exception:
+            logger.exception('Streaming agent reply failed')
+            yield sse_event({'error': 'The assistant failed to reply.'}, event='error')
+            return
+        yield sse_event({'html': render_new_messages(agent)}, event='done')
+
+    return event_stream_response(events())
+
+def astream_agent_reply(agent, content):
+    """Async version of `stream_agent_reply`."""
+    async def events():
+        try:
+            async for delta in agent.achat_stream(content):
+                yield reply_event(delta)
+        except Exception:
+            logger.exception('Streaming agent reply failed')
+            yield sse_event({'error': 'The assistant failed to reply.'}, event='error')
+            return
+        yield sse_event({'html': await sync_to_async(render_new_messages)(agent)}, event='done')
+
+    return event_stream_response(events())
+
+def reply_event(delta):
+    """Returns the Server-Sent Event for a chunk of a streamed agent reply."""
+    if delta is STREAM_RESET:
+        return sse_event({'reset': True}, event='reset')
+    return sse_event({'delta': delta})
+
+def event_stream_response(events, status=200, content_type='text/event-stream'):
+    """Wraps an iterator of Server-Sent Events in an unbuffered streaming response."""
+    response = StreamingHttpResponse(events, status=status, content_type=content_type)
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable proxy buffering so chunks are flushed immediately
+    return response
+
+def sse_event(data, event=None):
+    """Formats `data` as a single Server-Sent Event."""
+    message = f"data: {json.dumps(data)}\n\n"
+    if event is not None:
+        message = f"event: {event}\n" + message
+    return message